@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import time
+import random
+import getopt
+import shutil
+import hashlib
+import platform
+import tempfile
+from itertools import accumulate
+import index
+import search
+import postings_ops
+import query_planner
+from tombstones import load_tombstones
+from query_trace import percentile
+
+# Benchmark of index.py and search.py on synthetic corpora
+# benchmark.py -g generates a corpus and a query workload: documents of words drawn from a Zipfian distribution over a
+# generated vocabulary, with Reuters-like lengths, and Boolean queries of random AND / OR / NOT depth over frequent
+# and rare words. benchmark.py -i indexes a directory of documents and runs a queries file on it, timing the phases
+# of build_index (tokenize, block flush, merge, finish) and of the search (dictionary load, parse and plan, postings
+# fetch, set operations, result writing), optionally checks the results against an expected results file (e.g.
+# queries_results.txt for sanity-queries.txt on Reuters), and writes everything as JSON, so that the reports of two
+# commits can be diffed.
+
+# Number of training documents of the Reuters corpus, the unit of --scale
+REUTERS_DOCUMENTS = 7769
+VOCABULARY_SIZE = 50000
+ZIPF_EXPONENT = 1.0
+# The lengths of the documents are drawn from a log-normal distribution with a median of about 80 words
+LENGTH_MU = 4.4
+LENGTH_SIGMA = 0.8
+MIN_LENGTH = 5
+MAX_LENGTH = 2000
+NUMBER_OF_QUERIES = 1000
+MAX_DEPTH = 3
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'ri', 'so', 'tu', 've', 'wi',
+             'xo', 'za', 'bra', 'cle', 'dro', 'fri', 'glo', 'pla', 'str', 'tha', 'qui', 'ment', 'ion', 'ex', 'al']
+# Words that would be read as operators
+RESERVED_WORDS = {'and', 'or', 'not'}
+
+def usage():
+    print("usage: " + sys.argv[0] + " -g directory-of-documents [-n number-of-documents | --scale x] "
+          "[-q file-of-queries] [-m number-of-queries] [--depth d] [--vocabulary v] [--zipf s] [--seed s]")
+    print("       " + sys.argv[0] + " -i directory-of-documents -q file-of-queries [-e expected-results-file] "
+          "[-j json-file] [-f vbyte|gamma|text] [--positions] [-w workers] [--memory-limit bytes] [-k index-directory]")
+
+# Function that generates a vocabulary of distinct lower case words, most frequent first
+def generate_vocabulary(size, rng):
+    words = []
+    seen = set(RESERVED_WORDS)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+# Function that writes a corpus of number_of_documents documents into directory, one file per doc id
+# The doc ids increase with gaps of 1 or 2 like those of Reuters, and the words of every document are drawn from a
+# Zipfian distribution over the vocabulary: the word of rank r has a probability proportional to 1 / r ** exponent
+# The number of bytes written is returned
+def generate_corpus(directory, number_of_documents, vocabulary, exponent=ZIPF_EXPONENT, rng=None):
+    rng = rng or random.Random()
+    os.makedirs(directory, exist_ok=True)
+    cumulative_weights = list(accumulate(1 / rank ** exponent for rank in range(1, len(vocabulary) + 1)))
+    doc_id = 0
+    total_bytes = 0
+    for _ in range(number_of_documents):
+        doc_id += rng.randint(1, 2)
+        length = min(MAX_LENGTH, max(MIN_LENGTH, int(rng.lognormvariate(LENGTH_MU, LENGTH_SIGMA))))
+        words = rng.choices(vocabulary, cum_weights=cumulative_weights, k=length)
+        # Lines of about 12 words, like the lines of a news article
+        text = '\n'.join(' '.join(words[i:i + 12]) for i in range(0, length, 12)) + '\n'
+        with open(os.path.join(directory, str(doc_id)), 'w') as f:
+            f.write(text)
+        total_bytes += len(text)
+    return total_bytes
+
+# Function that returns a random Boolean query of at most depth nested operators
+# Half of the words are frequent ones (the first 1% of the vocabulary), the others are drawn uniformly, so rare
+def generate_query(vocabulary, depth, rng):
+    if depth == 0 or rng.random() < 0.2:
+        if rng.random() < 0.5:
+            word = vocabulary[rng.randrange(max(1, len(vocabulary) // 100))]
+        else:
+            word = rng.choice(vocabulary)
+        return 'NOT ' + word if rng.random() < 0.15 else word
+    operator = rng.choice(['AND', 'AND', 'OR'])
+    operands = []
+    for _ in range(rng.randint(2, 3)):
+        operand = generate_query(vocabulary, depth - 1, rng)
+        if ' ' in operand and not operand.startswith('NOT '):
+            operand = '(' + operand + ')'
+        operands.append(operand)
+    query = f' {operator} '.join(operands)
+    if rng.random() < 0.15:
+        query = 'NOT (' + query + ')'
+    return query
+
+# Function that writes number_of_queries queries of depth 1 to max_depth to queries_file
+def generate_queries(queries_file, vocabulary, number_of_queries=NUMBER_OF_QUERIES, max_depth=MAX_DEPTH, rng=None):
+    rng = rng or random.Random()
+    with open(queries_file, 'w') as f:
+        for _ in range(number_of_queries):
+            f.write(generate_query(vocabulary, rng.randint(1, max_depth), rng) + '\n')
+
+# Function that returns the size in bytes of every file of an index
+def index_sizes(directory):
+    return {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+
+# Function that indexes in_dir into directory and returns the stats and the phases of build_index
+def benchmark_index(in_dir, directory, postings_encoding='vbyte', positional=False, workers=1,
+                    memory_limit=index.MEMORY_LIMIT):
+    dict_file = os.path.join(directory, 'dictionary.txt')
+    postings_file = os.path.join(directory, 'postings.txt')
+    start = time.perf_counter()
+    stats = index.build_index(in_dir, dict_file, postings_file, postings_encoding, memory_limit, workers,
+                              positional=positional)
+    elapsed = time.perf_counter() - start
+    return dict_file, postings_file, {
+        'documents': stats['documents'],
+        'bytes_read': stats['bytes'],
+        'blocks': stats['blocks'],
+        'seconds': elapsed,
+        'documents_per_second': stats['documents'] / elapsed,
+        'phases': stats['phases'],
+        'files': index_sizes(directory),
+    }
+
+# Function that runs the queries on an index and returns the results and the phases and latencies of the search
+# The postings fetch is the time spent reading and decoding postings lists, the set operations are the rest of the
+# evaluation of the plans
+def benchmark_search(dict_file, postings_file, queries):
+    start = time.perf_counter()
+    dictionary, reader = search.open_index(dict_file, postings_file)
+    search.load_stemming_memo(dict_file)
+    search.load_wildcard_index(dict_file)
+    deleted = load_tombstones(dict_file)
+    collection_size = len(search.get_full_set_postings(dictionary, reader))
+    load_time = time.perf_counter() - start
+
+    fetch = {'seconds': 0.0, 'lists': 0, 'bytes': 0}
+    read_postings = reader.read_postings
+
+    def timed_read_postings(entry, has_skip_count=True):
+        fetch_start = time.perf_counter()
+        postings = read_postings(entry, has_skip_count)
+        fetch['seconds'] += time.perf_counter() - fetch_start
+        fetch['lists'] += 1
+        fetch['bytes'] += entry[2] if len(entry) > 2 and isinstance(entry[2], int) else 0
+        return postings
+
+    reader.read_postings = timed_read_postings
+    parse_time = evaluate_time = format_time = 0.0
+    latencies = []
+    results = []
+    for query in queries:
+        query_start = time.perf_counter()
+        postfix = search.parse_query(query)
+        plan = None
+        if postfix is not None:
+            plan = query_planner.plan_query(postfix, lambda term: search.get_term_frequency(term, dictionary),
+                                            collection_size)
+        evaluate_start = time.perf_counter()
+        doc_ids = []
+        if plan is not None:
+            doc_ids = postings_ops.to_doc_ids(search.evaluate_plan(plan, dictionary, reader))
+            if deleted is not None:
+                doc_ids = deleted.filter(doc_ids)
+        format_start = time.perf_counter()
+        results.append(' '.join(str(doc_id) for doc_id in doc_ids))
+        query_end = time.perf_counter()
+        parse_time += evaluate_start - query_start
+        evaluate_time += format_start - evaluate_start
+        format_time += query_end - format_start
+        latencies.append(query_end - query_start)
+    reader.read_postings = read_postings
+    reader.close()
+
+    latencies.sort()
+    report = {
+        'queries': len(queries),
+        'seconds': load_time + sum(latencies),
+        'phases': {
+            'dictionary_load': load_time,
+            'parse_and_plan': parse_time,
+            'postings_fetch': fetch['seconds'],
+            'set_operations': evaluate_time - fetch['seconds'],
+            'result_writing': format_time,
+        },
+        'postings_lists_fetched': fetch['lists'],
+        'postings_bytes_fetched': fetch['bytes'],
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': 1000 * percentile(latencies, 50),
+            'p95': 1000 * percentile(latencies, 95),
+            'p99': 1000 * percentile(latencies, 99),
+            'max': 1000 * latencies[-1] if latencies else 0.0,
+        },
+        # Hash of the results, equal between two runs that returned the same results
+        'results_sha1': hashlib.sha1('\n'.join(results).encode()).hexdigest(),
+    }
+    return results, report
+
+# Function that compares results with the lines of an expected results file
+def check_results(results, expected_file):
+    with open(expected_file, 'r') as f:
+        expected = f.read().split('\n')
+    mismatches = [i for i, result in enumerate(results)
+                  if i >= len(expected) or result.split() != expected[i].split()]
+    return {'expected_file': expected_file, 'mismatches': len(mismatches),
+            'first_mismatches': [i + 1 for i in mismatches[:10]]}
+
+def run_benchmark(in_dir, queries_file, expected_file=None, json_file=None, postings_encoding='vbyte',
+                  positional=False, workers=1, memory_limit=index.MEMORY_LIMIT, index_directory=None):
+    with open(queries_file, 'r') as f:
+        queries = [query for query in f.read().split('\n') if query.strip() != '']
+    directory = index_directory or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    try:
+        dict_file, postings_file, index_report = benchmark_index(in_dir, directory, postings_encoding, positional,
+                                                                 workers, memory_limit)
+        results, search_report = benchmark_search(dict_file, postings_file, queries)
+    finally:
+        if index_directory is None:
+            shutil.rmtree(directory)
+    report = {
+        'config': {'documents_directory': in_dir, 'queries_file': queries_file, 'postings_encoding': postings_encoding,
+                   'positions': positional, 'workers': workers, 'memory_limit': memory_limit,
+                   'python': platform.python_version()},
+        'index': index_report,
+        'search': search_report,
+    }
+    if expected_file is not None:
+        report['check'] = check_results(results, expected_file)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if json_file is None:
+        print(text)
+    else:
+        with open(json_file, 'w') as f:
+            f.write(text + '\n')
+    return report
+
+def main():
+    generate_directory = input_directory = queries_file = expected_file = json_file = index_directory = None
+    number_of_documents = REUTERS_DOCUMENTS
+    number_of_queries = NUMBER_OF_QUERIES
+    max_depth = MAX_DEPTH
+    vocabulary_size = VOCABULARY_SIZE
+    exponent = ZIPF_EXPONENT
+    seed = 0
+    postings_encoding = 'vbyte'
+    positional = False
+    workers = 1
+    memory_limit = index.MEMORY_LIMIT
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'g:n:q:m:i:e:j:f:w:k:',
+                                   ['scale=', 'depth=', 'vocabulary=', 'zipf=', 'seed=', 'positions', 'workers=',
+                                    'memory-limit='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-g':
+            generate_directory = a
+        elif o == '-n':
+            number_of_documents = int(a)
+        elif o == '--scale':
+            number_of_documents = round(float(a) * REUTERS_DOCUMENTS)
+        elif o == '-q':
+            queries_file = a
+        elif o == '-m':
+            number_of_queries = int(a)
+        elif o == '--depth':
+            max_depth = int(a)
+        elif o == '--vocabulary':
+            vocabulary_size = int(a)
+        elif o == '--zipf':
+            exponent = float(a)
+        elif o == '--seed':
+            seed = int(a)
+        elif o == '-i':
+            input_directory = a
+        elif o == '-e':
+            expected_file = a
+        elif o == '-j':
+            json_file = a
+        elif o == '-f':
+            postings_encoding = a
+        elif o == '--positions':
+            positional = True
+        elif o in ('-w', '--workers'):
+            workers = int(a)
+        elif o == '--memory-limit':
+            memory_limit = int(a)
+        elif o == '-k':
+            index_directory = a
+        else:
+            assert False, "unhandled option"
+
+    if generate_directory is not None:
+        rng = random.Random(seed)
+        vocabulary = generate_vocabulary(vocabulary_size, rng)
+        start = time.perf_counter()
+        total_bytes = generate_corpus(generate_directory, number_of_documents, vocabulary, exponent, rng)
+        print(f"{number_of_documents} documents, {total_bytes / 1e6:.1f} MB written to {generate_directory} in "
+              f"{time.perf_counter() - start:.1f} s")
+        if queries_file is not None:
+            generate_queries(queries_file, vocabulary, number_of_queries, max_depth, rng)
+            print(f"{number_of_queries} queries written to {queries_file}")
+        return
+
+    if input_directory is None or queries_file is None:
+        usage()
+        sys.exit(2)
+
+    run_benchmark(input_directory, queries_file, expected_file, json_file, postings_encoding, positional, workers,
+                  memory_limit, index_directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+# Compressed bitmaps of doc ids in the style of Roaring bitmaps
+# The doc ids are split by their high 16 bits into containers of at most 65536 doc ids. A container holding at most
+# ARRAY_LIMIT doc ids is sparse: a sorted array('H') of the low 16 bits. A fuller container is dense: a bitmap of
+# 65536 bits kept as a Python int, so AND, OR and AND NOT of two dense containers are single big integer operations.
+# postings_ops.py uses these bitmaps for the postings of very frequent terms and for the full doc id list,
+# and arrays of doc ids for everything else.
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+LOW_MASK = CONTAINER_SIZE - 1
+DENSE_BYTES = CONTAINER_SIZE // 8
+# A sparse container takes 2 bytes per doc id and a dense one 8 KB, so 4096 doc ids is where dense becomes smaller
+ARRAY_LIMIT = 4096
+SPARSE = 0
+DENSE = 1
+
+# Turns the '0' and '1' characters of a binary representation into 0 and 1 bytes
+BIT_TABLE = bytes.maketrans(b'01', b'\x00\x01')
+
+# Function that returns the number of doc ids of a container
+def cardinality(container):
+    return len(container) if isinstance(container, array) else container.bit_count()
+
+# Function that turns the low bits of a sorted list of doc ids into a dense container
+def to_dense(values):
+    bitmap = bytearray(DENSE_BYTES)
+    for value in values:
+        bitmap[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(bitmap, 'little')
+
+# Function that returns the positions of the set bits of a dense container, added to base
+# The bits are listed lowest first as 0 and 1 bytes and the positions of the 1 bytes are picked with compress,
+# so no Python code runs per bit
+def dense_positions(container, base=0):
+    bits = bin(container)[:1:-1].encode().translate(BIT_TABLE)
+    return list(compress(range(base, base + len(bits)), bits))
+
+# Function that returns the sorted low bits of a dense container
+def dense_values(container):
+    return array('H', dense_positions(container))
+
+# Function that returns a dense container as a sparse one when it holds few enough doc ids
+def shrink(container):
+    if container.bit_count() <= ARRAY_LIMIT:
+        return dense_values(container)
+    return container
+
+# Function that returns a sparse container as a dense one when it holds too many doc ids
+def grow(values):
+    if len(values) > ARRAY_LIMIT:
+        return to_dense(values)
+    return array('H', values)
+
+# Function that returns a membership test for the low bits of a container
+def member_test(container):
+    if isinstance(container, array):
+        members = set(container)
+        return members.__contains__
+    data = container.to_bytes(DENSE_BYTES, 'little')
+    return lambda value: (data[value >> 3] >> (value & 7)) & 1
+
+def and_containers(c1, c2):
+    if isinstance(c1, int) and isinstance(c2, int):
+        return shrink(c1 & c2)
+    if isinstance(c1, int):
+        c1, c2 = c2, c1
+    contains = member_test(c2)
+    return array('H', [value for value in c1 if contains(value)])
+
+def or_containers(c1, c2):
+    if isinstance(c1, int) and isinstance(c2, int):
+        return c1 | c2
+    if isinstance(c1, int) or isinstance(c2, int):
+        return (c1 if isinstance(c1, int) else to_dense(c1)) | (c2 if isinstance(c2, int) else to_dense(c2))
+    return grow(sorted(set(c1).union(c2)))
+
+def and_not_containers(c1, c2):
+    if isinstance(c1, int):
+        return shrink(c1 & ~(c2 if isinstance(c2, int) else to_dense(c2)))
+    contains = member_test(c2)
+    return array('H', [value for value in c1 if not contains(value)])
+
+class RoaringBitmap:
+    # keys are the sorted high bits of the containers, containers holds the container of every key
+    def __init__(self, keys=None, containers=None):
+        self.keys = keys or []
+        self.containers = containers or []
+        self.size = sum(cardinality(container) for container in self.containers)
+
+    # Function that builds a bitmap from a sorted sequence of doc ids
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        keys = []
+        containers = []
+        start = 0
+        while start < len(doc_ids):
+            key = doc_ids[start] >> CONTAINER_BITS
+            # The doc ids of this container end before the first doc id of the next key
+            end = bisect_left(doc_ids, (key + 1) << CONTAINER_BITS, start)
+            keys.append(key)
+            containers.append(grow([doc_id & LOW_MASK for doc_id in doc_ids[start:end]]))
+            start = end
+        return cls(keys, containers)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for key, container in zip(self.keys, self.containers):
+            base = key << CONTAINER_BITS
+            if isinstance(container, int):
+                yield from dense_positions(container, base)
+            else:
+                for value in container:
+                    yield base + value
+
+    # Function that returns the doc ids as an array('i')
+    def to_array(self):
+        doc_ids = array('i')
+        for key, container in zip(self.keys, self.containers):
+            base = key << CONTAINER_BITS
+            if isinstance(container, int):
+                doc_ids.extend(dense_positions(container, base))
+            else:
+                doc_ids.extend([base + value for value in container] if base else container.tolist())
+        return doc_ids
+
+    # Function that keeps the doc ids of a sorted sequence that are in the bitmap, or not in it when keep is False
+    # One membership test is done per doc id, so the cost is proportional to the length of the sequence
+    def filter(self, doc_ids, keep=True):
+        result = array('i')
+        current_key = None
+        contains = None
+        position = 0
+        for doc_id in doc_ids:
+            key = doc_id >> CONTAINER_BITS
+            if key != current_key:
+                current_key = key
+                position = bisect_left(self.keys, key, position)
+                if position < len(self.keys) and self.keys[position] == key:
+                    contains = member_test(self.containers[position])
+                else:
+                    contains = None
+            if (contains is not None and contains(doc_id & LOW_MASK)) == keep:
+                result.append(doc_id)
+        return result
+
+    def intersection(self, other):
+        keys = []
+        containers = []
+        i = j = 0
+        while i < len(self.keys) and j < len(other.keys):
+            if self.keys[i] < other.keys[j]:
+                i += 1
+            elif self.keys[i] > other.keys[j]:
+                j += 1
+            else:
+                container = and_containers(self.containers[i], other.containers[j])
+                if cardinality(container):
+                    keys.append(self.keys[i])
+                    containers.append(container)
+                i += 1
+                j += 1
+        return RoaringBitmap(keys, containers)
+
+    def union(self, other):
+        keys = []
+        containers = []
+        i = j = 0
+        while i < len(self.keys) or j < len(other.keys):
+            if j == len(other.keys) or (i < len(self.keys) and self.keys[i] < other.keys[j]):
+                keys.append(self.keys[i])
+                containers.append(self.containers[i])
+                i += 1
+            elif i == len(self.keys) or self.keys[i] > other.keys[j]:
+                keys.append(other.keys[j])
+                containers.append(other.containers[j])
+                j += 1
+            else:
+                keys.append(self.keys[i])
+                containers.append(or_containers(self.containers[i], other.containers[j]))
+                i += 1
+                j += 1
+        return RoaringBitmap(keys, containers)
+
+    def difference(self, other):
+        keys = []
+        containers = []
+        j = 0
+        for key, container in zip(self.keys, self.containers):
+            j = bisect_left(other.keys, key, j)
+            if j < len(other.keys) and other.keys[j] == key:
+                container = and_not_containers(container, other.containers[j])
+                if not cardinality(container):
+                    continue
+            keys.append(key)
+            containers.append(container)
+        return RoaringBitmap(keys, containers)
+
+# Function that computes the union of any number of bitmaps in one pass
+# The containers of every key are combined at once: the dense ones with big integer ORs and the sparse ones through
+# a set, so no intermediate bitmap is built
+def union_all(bitmaps):
+    dense = {}
+    sparse = {}
+    for bitmap in bitmaps:
+        for key, container in zip(bitmap.keys, bitmap.containers):
+            if isinstance(container, int):
+                dense[key] = dense.get(key, 0) | container
+            else:
+                sparse.setdefault(key, set()).update(container)
+    keys = sorted(set(dense).union(sparse))
+    containers = []
+    for key in keys:
+        values = sorted(sparse.get(key, ()))
+        if key in dense:
+            containers.append(dense[key] | to_dense(values) if values else dense[key])
+        else:
+            containers.append(grow(values))
+    return RoaringBitmap(keys, containers)
+
+# Function that tells whether a sorted list of doc ids is dense enough to be stored as a bitmap,
+# which is the case when at least one of its containers would be dense
+def is_dense(doc_ids):
+    if len(doc_ids) <= ARRAY_LIMIT:
+        return False
+    start = 0
+    while start < len(doc_ids):
+        end = bisect_left(doc_ids, ((doc_ids[start] >> CONTAINER_BITS) + 1) << CONTAINER_BITS, start)
+        if end - start > ARRAY_LIMIT:
+            return True
+        start = end
+    return False
+
+# Function that serializes a bitmap
+# For every container: its key, its number of doc ids, its kind and the byte length of its data as variable byte
+# numbers, then its data: the low bits as little endian 16 bit numbers for a sparse container, the little endian
+# bitmap without its trailing zero bytes for a dense one
+def serialize(bitmap, vbyte_encode):
+    data = bytearray(vbyte_encode([len(bitmap.keys)]))
+    for key, container in zip(bitmap.keys, bitmap.containers):
+        if isinstance(container, array):
+            values = array('H', container)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            payload = values.tobytes()
+            kind = SPARSE
+        else:
+            payload = container.to_bytes((container.bit_length() + 7) // 8, 'little')
+            kind = DENSE
+        data.extend(vbyte_encode([key, cardinality(container), kind, len(payload)]))
+        data.extend(payload)
+    return bytes(data)
+
+# Function that reads a bitmap written by serialize from data starting at position pos
+def deserialize(data, pos, vbyte_decode):
+    (number_of_containers,), pos = vbyte_decode(data, pos, 1)
+    keys = []
+    containers = []
+    for _ in range(number_of_containers):
+        (key, count, kind, length), pos = vbyte_decode(data, pos, 4)
+        if kind == SPARSE:
+            container = array('H')
+            container.frombytes(data[pos:pos + length])
+            if sys.byteorder == 'big':
+                container.byteswap()
+        else:
+            container = int.from_bytes(data[pos:pos + length], 'little')
+        keys.append(key)
+        containers.append(container)
+        pos += length
+    return RoaringBitmap(keys, containers)
@@ -1,217 +1,649 @@
 import os
-import math
 import pickle
 import nltk
 from nltk.corpus import reuters
 from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
 import sys
+import errno
 import getopt
 import linecache
+import heapq
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import time
+from array import array
+from functools import partial
+from bisect import bisect_right
+import postings_format
+import lexicon
+import segments
+import shards
+import wildcard
+import result_cache
+import runs
+from postings_reader import PostingsReader
+from tombstones import Tombstones, load_tombstones, save_tombstones
+from normalisation import TermNormaliser, memo_path
 
-# Define a Node class to represent each element in the linked list
-class Posting:
-    def __init__(self, doc_id):
-        self.doc_id = doc_id
-        self.next = None
-        self.skip = None  # Pointer to the skip node
+# Default number of bytes the in-memory SPIMI block may use before it is written to disk
+MEMORY_LIMIT = 8 * 1024 * 1024
+# Bytes accounted for every new term of a block on top of the term string itself:
+# an empty array and the slot of the postings_lists dict
+TERM_OVERHEAD = sys.getsizeof(array('i')) + 48
+# Bytes accounted for every doc id appended to the postings array of a term
+DOC_ID_SIZE = array('i').itemsize
+# Maximum number of runs merged at once
+MERGE_FAN_IN = 64
+# Read buffer of every segment merged by --compact
+MERGE_BUFFER_SIZE = 1024 * 1024
+# Number of documents tokenized and stemmed together, by one worker process when indexing in parallel
+CHUNK_SIZE = 64
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
-
-def build_index(in_dir, out_dict, out_postings):   
-    memory_limit = 100000  # Adjust based on available memory
-    # the below line returns the current working directory
-    # (However, when I was running it on Pycharm, it was the directory of the Pycharm bin folder)
-    current_dir = os.getcwd()
-    temp_posting_path = os.path.join(current_dir, "temp_posting.txt")
-    temp_dict_path = os.path.join(current_dir, "temp_dict.txt")
-    # doc_freq dictionary, to be kept in memory
-    doc_freq = {}
+    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-f vbyte|gamma|text]"
+          " [--memory-limit bytes]"
+          " [-w workers] [-a] [--positions] [--skips n|sqrt|multi] [--shards n]"
+          " [--temp-dir directory] [--temp-limit bytes] [--resume]")
+    print("       " + sys.argv[0] + " --compact -d dictionary-file -p postings-file [-f vbyte|gamma|text]"
+          " [--skips n|sqrt|multi]")
+
+# Memoising normaliser of the process, created on first use so that every worker process has its own
+normaliser = None
+
+# Function that tokenizes and stems the documents of one chunk into a partial SPIMI block
+# The partial block maps every term of the chunk to the array of the doc ids of the chunk containing it, in doc id order
+# When positional is True, the positions of every term are collected as well: for every doc id of its array,
+# the number of positions of the term in the document followed by the positions (the flat positions list)
+# The partial block, the number of bytes read of every document and the positions (None if positional is False)
+# are returned
+def index_chunk(in_dir, filenames, positional=False):
+    global normaliser
+    if normaliser is None:
+        normaliser = TermNormaliser()
+    chunk_postings = {}
+    chunk_positions = {} if positional else None
+    bytes_read = []
+    for filename in filenames:
+        doc_id = int(filename)
+        with open(os.path.join(in_dir, filename), 'r') as f:
+            content = f.read()
+        bytes_read.append(len(content))
+
+        # Tokenize content in file into a list of tokensp
+        words = word_tokenize(content)
+        # Stem each token into a term
+        stemmed_words = [normaliser.normalise(word) for word in words]
+        if positional:
+            term_positions = {}
+            for position, term in enumerate(stemmed_words):
+                positions = term_positions.get(term)
+                if positions is None:
+                    positions = term_positions[term] = []
+                positions.append(position)
+            for term, positions in term_positions.items():
+                if term not in chunk_postings:
+                    chunk_postings[term] = array('i')
+                    chunk_positions[term] = array('i')
+                chunk_postings[term].append(doc_id)
+                chunk_positions[term].append(len(positions))
+                chunk_positions[term].extend(positions)
+            continue
+        for term in set(stemmed_words):
+            postings = chunk_postings.get(term)
+            if postings is None:
+                postings = chunk_postings[term] = array('i')
+            postings.append(doc_id)
+    return chunk_postings, bytes_read, chunk_positions
+
+# Function that runs index_chunk in a worker process
+# The words the worker memoised for the chunk and its counters are returned with the partial block,
+# so that the main process can save one memo for the whole collection
+def index_chunk_in_worker(in_dir, filenames, positional=False):
+    global normaliser
+    if normaliser is None:
+        normaliser = TermNormaliser(record_updates=True)
+    chunk_postings, bytes_read, chunk_positions = index_chunk(in_dir, filenames, positional)
+    return chunk_postings, bytes_read, chunk_positions, normaliser.take_updates()
+
+# Function that returns the bytes a partial block adds to the in-memory block holding postings_lists
+# Every doc id and every number of the flat positions list takes DOC_ID_SIZE, and a term that is not in the block yet
+# its string and TERM_OVERHEAD
+def partial_block_size(chunk_postings, chunk_positions, postings_lists):
+    size = 0
+    for term, doc_ids in chunk_postings.items():
+        if term not in postings_lists:
+            size += sys.getsizeof(term) + TERM_OVERHEAD
+        size += DOC_ID_SIZE * len(doc_ids)
+        if chunk_positions is not None:
+            size += DOC_ID_SIZE * len(chunk_positions[term])
+    return size
+
+# Function that returns the bytes of partial_block_size added by every doc id of a partial block
+# A new term is accounted to the first document containing it
+def document_sizes(chunk_postings, chunk_positions, postings_lists):
+    sizes = {}
+    for term, doc_ids in chunk_postings.items():
+        if term not in postings_lists:
+            sizes[doc_ids[0]] = sizes.get(doc_ids[0], 0) + sys.getsizeof(term) + TERM_OVERHEAD
+        if chunk_positions is None:
+            for doc_id in doc_ids:
+                sizes[doc_id] = sizes.get(doc_id, 0) + DOC_ID_SIZE
+            continue
+        positions = chunk_positions[term]
+        offset = 0
+        for doc_id in doc_ids:
+            # The doc id, the number of positions and the positions
+            sizes[doc_id] = sizes.get(doc_id, 0) + DOC_ID_SIZE * (2 + positions[offset])
+            offset += 1 + positions[offset]
+    return sizes
+
+# Function that splits a partial block into the partial block of the documents up to last_doc_id and the one of the
+# documents after it
+def split_partial_block(chunk_postings, chunk_positions, last_doc_id):
+    head_postings, tail_postings = {}, {}
+    head_positions, tail_positions = ({}, {}) if chunk_positions is not None else (None, None)
+    for term, doc_ids in chunk_postings.items():
+        split = bisect_right(doc_ids, last_doc_id)
+        if chunk_positions is not None:
+            positions = chunk_positions[term]
+            offset = 0
+            for _ in range(split):
+                offset += 1 + positions[offset]
+        if split > 0:
+            head_postings[term] = doc_ids[:split]
+            if chunk_positions is not None:
+                head_positions[term] = positions[:offset]
+        if split < len(doc_ids):
+            tail_postings[term] = doc_ids[split:]
+            if chunk_positions is not None:
+                tail_positions[term] = positions[offset:]
+    return (head_postings, head_positions), (tail_postings, tail_positions)
+
+# Function that runs function(in_dir, chunk) for every chunk on the executor and yields the results in chunk order
+# At most window chunks are in flight, so finished partial blocks do not pile up in memory
+def map_in_order(executor, function, in_dir, chunks, window):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(function, in_dir, chunk))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# The in-memory block keeps a growable array of doc ids per term, so adding a doc id is an append instead of a walk
+# to the tail of a linked list. The block is written to a run file of its own (see runs.py) once the bytes accounted
+# for its terms and doc ids exceed memory_limit, right after the document that went past it: a chunk of documents
+# going past it is split at that document and the rest of the chunk starts the next block.
+# The runs are written to the run directory of out_dict, in temp_dir if given, which never grows past temp_limit
+# bytes. Every run is checkpointed with the documents it covers, so with resume the build continues from the
+# checkpoint of an earlier, interrupted build of the same documents
+# The memo of the normaliser is saved next to the dictionary, search.py loads it to start with every word known
+# A dict with the number of documents and bytes read (the documents of the checkpoint are only counted in resumed),
+# the number of blocks written, the report of the normaliser and the seconds spent in each phase (tokenize:
+# tokenizing, stemming and adding to the in-memory block, flush: writing the runs, merge: merging them into the final
+# files, finish: the full doc id list, lexicon, memo and k-gram index) is returned
+# When filenames is given, only these documents of in_dir are indexed
+# When positional is True, the positions of the terms are carried through the runs and the merge along with the
+# doc ids and written to the positions file of the postings file (binary postings only)
+# skip_spacing is the spacing of the skip entries of the binary postings lists (see postings_format.skip_layout)
+def build_index(in_dir, out_dict, out_postings, postings_encoding='vbyte', memory_limit=MEMORY_LIMIT, workers=1,
+                filenames=None, positional=False, skip_spacing=postings_format.DEFAULT_SKIP_SPACING, temp_dir=None,
+                temp_limit=None, resume=False):
+    global normaliser
+    # Open the files in increasing numerical order of the filenames
+    sorted_filenames = sorted(os.listdir(in_dir) if filenames is None else filenames, key=int)
+    run_directory = runs.RunDirectory(runs.run_directory_path(out_dict, temp_dir),
+                                      runs.build_source(in_dir, sorted_filenames, positional, memory_limit),
+                                      temp_limit, resume)
     # postings_list dictionary, to be stored in harddisk after memory limit exceeding
+    # The document frequency of a term is the length of its postings array
     postings_lists = {}
-    # List to store pointers to starting terms in each block for merging
-    block_pointers = [0] # initialized to 0 for start of first block
+    # Flat positions lists of the terms of the block, only used when positional is True
+    positions_lists = {}
+    # Bytes accounted for the current block, and the documents it holds
+    block_size = 0
+    block_bytes_read = 0
+    block_documents = 0
+    start = time.perf_counter()
+    flush_time = 0.0
 
-    # Initialize NLTK's Porter stemmer
-    stemmer = PorterStemmer()
-    
-    # Open the files in increasing numerical order of the filenames
-    sorted_filenames = sorted(os.listdir(in_dir), key=int)
+    # The documents are tokenized and stemmed in chunks, by a pool of processes when workers > 1
+    # The partial blocks of the chunks are added to the in-memory block in chunk order, so the doc ids stay sorted
+    # The documents covered by the checkpoint of a resumed build are skipped
+    remaining_filenames = [filename for filename in sorted_filenames if int(filename) > run_directory.last_doc_id]
+    chunks = [remaining_filenames[i:i + CHUNK_SIZE] for i in range(0, len(remaining_filenames), CHUNK_SIZE)]
+    # The memo saved with the index is the one of this process, or the merge of the memos of the worker processes
+    if workers > 1:
+        normaliser = None
+        memo = TermNormaliser()
+        executor = ProcessPoolExecutor(workers)
+        partial_blocks = map_in_order(executor, partial(index_chunk_in_worker, positional=positional), in_dir, chunks,
+                                      2 * workers)
+    else:
+        normaliser = memo = TermNormaliser()
+        executor = None
+        partial_blocks = (index_chunk(in_dir, chunk, positional) for chunk in chunks)
+    resumed_bytes = run_directory.bytes_read
+    if run_directory.resumed:
+        memo.load(run_directory.memo_path())
+
+    # Function that writes the in-memory block to a new run and checkpoints it
+    def flush_block(last_doc_id):
+        writer = run_directory.create_run()
+        for term in sorted(postings_lists):
+            writer.write_term(term, postings_lists[term], positions_lists[term] if positional else None)
+        run_directory.add_run(writer, block_documents, block_bytes_read, last_doc_id, memo)
+
+    # Function that adds a partial block to the in-memory block
+    def add_partial_block(chunk_postings, chunk_positions):
+        for term, doc_ids in chunk_postings.items():
+            # Update postings list of terms
+            postings = postings_lists.get(term)
+            if postings is None:
+                postings = postings_lists[term] = array('i')
+            postings.extend(doc_ids)
+            if positional:
+                positions = positions_lists.get(term)
+                if positions is None:
+                    positions = positions_lists[term] = array('i')
+                positions.extend(chunk_positions[term])
+
+    try:
+        for chunk, (chunk_postings, document_bytes, chunk_positions, *updates) in zip(chunks, partial_blocks):
+            if updates:
+                memo.merge(*updates[0])
+            doc_ids = [int(filename) for filename in chunk]
+            while doc_ids:
+                chunk_size = partial_block_size(chunk_postings, chunk_positions, postings_lists)
+                if block_size + chunk_size <= memory_limit:
+                    add_partial_block(chunk_postings, chunk_positions)
+                    block_size += chunk_size
+                    block_bytes_read += sum(document_bytes)
+                    block_documents += len(doc_ids)
+                    break
+                # The documents of the chunk are added up to the one going past memory_limit
+                sizes = document_sizes(chunk_postings, chunk_positions, postings_lists)
+                split = 0
+                while block_size <= memory_limit:
+                    block_size += sizes.get(doc_ids[split], 0)
+                    split += 1
+                head, (chunk_postings, chunk_positions) = split_partial_block(chunk_postings, chunk_positions,
+                                                                              doc_ids[split - 1])
+                add_partial_block(*head)
+                block_bytes_read += sum(document_bytes[:split])
+                block_documents += split
+                flush_start = time.perf_counter()
+                flush_block(doc_ids[split - 1])
+                # Reset the postings_lists dictionary
+                postings_lists = {}
+                positions_lists = {}
+                block_size = block_bytes_read = block_documents = 0
+                flush_time += time.perf_counter() - flush_start
+                doc_ids, document_bytes = doc_ids[split:], document_bytes[split:]
+    except BaseException:
+        # The memo is only saved every few runs, an interrupted build saves it for the build resuming it
+        try:
+            run_directory.save_memo(memo)
+        except OSError:
+            pass
+        raise
+    if executor is not None:
+        executor.shutdown()
 
-    for filename in sorted_filenames:
-        with open(os.path.join(in_dir, filename), 'r') as f:
-            
-            # Tokenize content in file into a list of tokensp
-            words = word_tokenize(f.read())
-            # Stem each token into a term 
-            stemmed_words = [stemmer.stem(word.lower()) for word in words]
-            terms = set(stemmed_words)
-
-            for term in terms:
-                # Update document frequency of terms
-                doc_freq[term] = doc_freq.get(term, 0) + 1
-
-                # Update postings list of terms
-                if term not in postings_lists:
-                    postings_lists[term] = Posting(filename) # Posting is the Node class
-                else:
-                    # Traverse the linked list to find the end and then add the new node
-                    current_node = postings_lists[term]
-                    while current_node.next:
-                        current_node = current_node.next
-                    current_node.next = Posting(filename)
-
-                if sys.getsizeof(postings_lists) + sys.getsizeof(doc_freq) > memory_limit:
-                    write_block_to_disk(postings_lists, doc_freq, temp_dict_path, temp_posting_path)
-                    with open(temp_dict_path, 'a') as dict_file: # Open the dictionary file in append mode for writing
-                        # Store the pointer to the starting term of the next block of dictionary
-                        block_pointers.append(dict_file.tell())
-                    # Reset the postings_lists and doc_freq dictionaries
-                    postings_lists = {}
-                    doc_freq = {}
-    
     # Write the last block to disk
-    write_block_to_disk(postings_lists, doc_freq, temp_dict_path, temp_posting_path)
-    n_way_merge(block_pointers, temp_dict_path, temp_posting_path, out_dict, out_postings) 
-
-    # Write full list of doc_id to posting_file
-    with open(out_dict, 'a') as dict_file, open(out_postings, 'a') as postings_file:
-        pointer = postings_file.tell()
-        for doc_id in sorted_filenames:
-            postings_file.write(str(doc_id) + ' ')
-        postings_file.write('\n')
-        dict_file.write("Full_doc_id_pointer 1 " + str(pointer))
-
-    # Delete temporary files
-    if os.path.exists(temp_posting_path):
-        os.remove(temp_posting_path)
-    if os.path.exists(temp_dict_path):
-        os.remove(temp_dict_path)
-
-def write_block_to_disk(postings_lists, doc_freq, dictionary_file, postings_file):
-    # Sort all keys before writing to disk
-    sorted_terms = sorted(postings_lists.keys())
-    with open(dictionary_file, 'a') as dict_file, open(postings_file, 'a') as postings_file:
-        # Keep track of the current position in the postings file for pointer info
-        current_position = postings_file.tell()
-        
-        for term in sorted_terms:
-            postings_list = postings_lists[term]
-            doc_frequency = doc_freq[term]
-
-            # Store the term, its document frequency, and the pointer to posting list file in dictionary file
-            dict_file.write(f"{term} {doc_frequency} {current_position} {dict_file.tell()}\n")
-
-            postings_list_data = []
-            while postings_list:
-                postings_list_data.append(postings_list.doc_id)
-                postings_list = postings_list.next
-           
-            # Convert the list to a string and write to file
-            postings_file.write(' '.join(postings_list_data) + '\n')
-
-            # Update the current position in the postings file
-            current_position = postings_file.tell()
-
-        dict_file.write(f"-----BLOCK_END-----\n")
-        postings_file.write(f"-----BLOCK_END-----\n")
-
-def n_way_merge(block_pointers, read_dictionary_file, read_postings_file, write_dictionary_file, write_postings_file):
-    # Merge and transfer content from temporary to final files
-    block_handles = [open(read_dictionary_file, 'r') for _ in range(len(block_pointers))]
-    posting_handles = [open(read_postings_file, 'r') for _ in range(len(block_pointers))]
-    final_dictionary = open(write_dictionary_file, 'a')
-    final_posting = open(write_postings_file, 'a')
-
-    while True:
-        current_terms = []  # stores the term, index tuple
-        posting_pointers = []  # stores the posting list pointer of a term
-        doc_freq = [] # stores the document frequency of term
-        term_lengths = [] # stores the term length used for skipping
-        index = 0
-
-        # Read initial term information from each block and store its posting pointers
-        for i, pointer in enumerate(block_pointers[:]):
-            block_handles[i].seek(pointer)
-            # term + doc_freq + posting pointer + self pointer in a block
-            term_len = block_handles[i].readline()
-            term_info = term_len.strip().split(' ')
-            term = term_info[0].strip()
-            if term == '-----BLOCK_END-----':
-                block_pointers.remove(pointer)
-                continue
-            term_lengths.append(term_len)
-            doc_freq.append(int(term_info[1]))
-            posting_pointers.append(int(term_info[2]))
-            current_terms.append((term, index))
-            index += 1
-        
-        # All blocks have reached the end
-        if not block_pointers:
-            break
-        
-        # Find all terms to be merged
-        sorted_terms = sorted(current_terms, key=lambda x: x[0])
-        smallest_term = sorted_terms[0][0]
-
-        # Find their corresponding posting list and doc_freq of the terms
-        terms_to_merge = []
-        posting_to_merge = [] 
-        doc_freq_to_merge = []
-        for term in sorted_terms:   
-            if term[0] == smallest_term:
-                terms_to_merge.append(term)
-                posting_to_merge.append(posting_pointers[term[1]])
-                doc_freq_to_merge.append([doc_freq[term[1]]])
-            else:
-                break
-
-        # Advancing pointers
-        for term in terms_to_merge:
-            index = term[1]
-            temp_block_pointer = block_pointers[index]
-            temp_handle = open(read_dictionary_file, 'r')
-            temp_handle.seek(temp_block_pointer)
-            temp_line = temp_handle.readline()
-            new_pointer = temp_handle.tell()
-            block_pointers[index] = new_pointer
-            temp_handle.close()
-
-
-        # Merging step
-        # Merge posting
+    flush_start = time.perf_counter()
+    tokenize_time = flush_start - start - flush_time
+    if postings_lists:
+        flush_block(int(remaining_filenames[-1]))
+    merge_start = time.perf_counter()
+    flush_time += merge_start - flush_start
+    number_of_blocks = len(run_directory.runs)
+    n_way_merge(run_directory, out_dict, out_postings, postings_encoding, positional=positional,
+                skip_spacing=skip_spacing)
+    finish_start = time.perf_counter()
+
+    write_full_set(out_dict, out_postings, [int(doc_id) for doc_id in sorted_filenames], postings_encoding)
+
+    # Write the binary lexicon of the dictionary next to it, search.py can be given either of the two
+    lexicon.write_lexicon(out_dict, os.path.splitext(out_dict)[0] + '.lex')
+    memo.save(memo_path(out_dict))
+    # The k-gram index used to expand wildcards
+    wildcard.write_kgram_index(out_dict)
+
+    # Delete the run directory
+    run_directory.remove()
+
+    return {'documents': len(remaining_filenames), 'bytes': run_directory.bytes_read - resumed_bytes,
+            'resumed': len(sorted_filenames) - len(remaining_filenames), 'blocks': number_of_blocks,
+            'stemming': memo.report(),
+            'phases': {'tokenize': tokenize_time, 'flush': flush_time, 'merge': finish_start - merge_start,
+                       'finish': time.perf_counter() - finish_start}}
+
+# Function that writes the full list of doc ids at the end of the postings file and its line at the end of the dictionary
+def write_full_set(out_dict, out_postings, doc_ids, postings_encoding):
+    if postings_encoding == 'text':
+        with open(out_dict, 'a') as dict_file, open(out_postings, 'a') as postings_file:
+            pointer = postings_file.tell()
+            for doc_id in doc_ids:
+                postings_file.write(str(doc_id) + ' ')
+            postings_file.write('\n')
+            dict_file.write("Full_doc_id_pointer 1 " + str(pointer))
+    else:
+        with open(out_dict, 'a') as dict_file, open(out_postings, 'ab') as postings_file:
+            pointer = postings_file.tell()
+            # The full doc id list is the universe NOT is computed against, it is always stored as a bitmap
+            data = postings_format.encode_bitmap_postings(doc_ids)
+            postings_file.write(data)
+            dict_file.write(f"Full_doc_id_pointer 1 {pointer} {len(data)}")
+
+# Reads the terms of a final dictionary and postings file in order, for the compaction of delta segments
+# The final dictionary is written in term order, the full doc id list at its end is skipped
+class SegmentCursor:
+    def __init__(self, dictionary_file, postings_file, positional=False):
+        self.dict_file = open(dictionary_file, 'r', buffering=MERGE_BUFFER_SIZE)
+        self.reader = PostingsReader(postings_file)
+        self.positional = positional
+        self.term = None
+        self.doc_ids = None
+        self.positions = None
+        self.advance()
+
+    def advance(self):
+        term_info = self.dict_file.readline().split(' ')
+        if term_info[0].strip() in ('', lexicon.FULL_SET_TERM):
+            self.term = None
+            self.close()
+            return
+        self.term = term_info[0]
+        entry = tuple(int(number) for number in term_info[1:])
+        self.doc_ids = self.reader.read_postings(entry)
+        if self.positional:
+            self.positions = self.reader.read_flat_positions(entry)
+
+    def close(self):
+        self.dict_file.close()
+        self.reader.close()
+
+# Function that merges cursors over sorted runs of terms in one forward pass
+# A heap holds the current term of every cursor, the postings of equal terms are concatenated in cursor order,
+# which keeps the doc ids sorted as the blocks were written in doc id order
+# The flat positions lists are concatenated in the same order, they are None when the cursors have no positions
+def merge_cursors(cursors, write_term):
+    heap = [(cursor.term, i) for i, cursor in enumerate(cursors) if cursor.term is not None]
+    heapq.heapify(heap)
+    while heap:
+        smallest_term = heap[0][0]
         merged_postings = []
-        # List of all posting lists to be merged
-        posting_list = []
-        for i, ptr in enumerate(posting_to_merge):
-            posting_handles[i].seek(ptr)
-            posting_string = posting_handles[i].readline().strip()
-            posting = [int(x) for x in posting_string.split()]
-            posting_list.append(posting)
-        for posting in posting_list:
-            for i in posting:
-                merged_postings.append(i)
-                
-        # Merge doc_freq
-        final_doc_freq = sum(sum(sublist) for sublist in doc_freq_to_merge)
+        merged_positions = None
+        while heap and heap[0][0] == smallest_term:
+            i = heapq.heappop(heap)[1]
+            merged_postings.extend(cursors[i].doc_ids)
+            if cursors[i].positions is not None:
+                if merged_positions is None:
+                    merged_positions = []
+                merged_positions.extend(cursors[i].positions)
+            cursors[i].advance()
+            if cursors[i].term is not None:
+                heapq.heappush(heap, (cursors[i].term, i))
+        write_term(smallest_term, merged_postings, merged_positions)
+
+# Function that merges the runs of run_directory into the final dictionary and postings files
+# The merged postings are written as ASCII doc ids when postings_encoding is 'text',
+# otherwise they are written in the binary format of postings_format.py with the given codec
+# At most fan_in runs are merged at once. With more runs than that, consecutive runs are first merged into new runs,
+# the fewest bytes at a time (see runs.RunDirectory.merge_window), and removed as soon as they are merged
+def n_way_merge(run_directory, write_dictionary_file, write_postings_file, postings_encoding='text',
+                fan_in=MERGE_FAN_IN, positional=False, skip_spacing=postings_format.DEFAULT_SKIP_SPACING):
+    while len(run_directory.runs) > fan_in:
+        start, end = run_directory.merge_window(fan_in)
+        writer = run_directory.create_run()
+        merge_cursors(run_directory.open_cursors(start, end, positional), writer.write_term)
+        run_directory.replace_runs(start, end, writer)
+
+    # Merge and transfer content from the runs to the final files
+    final_files = [write_dictionary_file, write_postings_file]
+    if positional:
+        final_files.append(postings_format.positions_path(write_postings_file))
+    run_directory.start_final_merge(final_files)
+    write_final_files(lambda write_term: merge_cursors(run_directory.open_cursors(0, len(run_directory.runs),
+                                                                                  positional), write_term),
+                      write_dictionary_file, write_postings_file, postings_encoding, positional,
+                      skip_spacing=skip_spacing)
+
+# Function that writes the terms produced by merge into the final dictionary and postings files
+# merge is called with the function writing one term, its doc ids and its flat positions list
+# When positional is True, the positions are written to positions_file (by default the positions file of the
+# postings file) and their offset and byte length are added to the dictionary line of the term. The length of every
+# document, its number of tokens, is the sum of the counts of its positions over all the terms, it is written to
+# lengths_file (by default the lengths file of the postings file)
+# skip_spacing sets the size of the blocks of the binary postings lists, the ASCII ones keep a skip count of sqrt(df)
+def write_final_files(merge, write_dictionary_file, write_postings_file, postings_encoding, positional=False,
+                      positions_file=None, lengths_file=None, skip_spacing=postings_format.DEFAULT_SKIP_SPACING):
+    final_dictionary = open(write_dictionary_file, 'a')
+    binary = postings_encoding != 'text'
+    final_posting = open(write_postings_file, 'ab' if binary else 'a')
+    if binary and final_posting.tell() == 0:
+        postings_format.write_header(final_posting, postings_format.CODECS[postings_encoding])
+    final_positions = None
+    document_lengths = array('I')
+    if positional:
+        final_positions = open(positions_file or postings_format.positions_path(write_postings_file), 'ab')
+
+    def write_final_term(term, merged_postings, merged_positions=None):
         # Write merged dictionary and posting lists to final files
-        number_of_skips = str(round(math.sqrt(len(merged_postings)))) 
-        merged_postings_string = ' '.join(str(posting_id) for posting_id in merged_postings)
         final_pointer = final_posting.tell()
-        final_posting.write(number_of_skips + ' ' + merged_postings_string + '\n')
-        final_dictionary.write(f"{smallest_term} {final_doc_freq} {final_pointer}\n")
+        if binary:
+            # The dictionary also stores the byte length so the list can be fetched with one read
+            # The postings of very frequent terms are stored as compressed bitmaps, the others as blocks of gaps
+            data = postings_format.encode_postings_by_density(merged_postings,
+                                                              postings_format.CODECS[postings_encoding],
+                                                              skip_spacing)
+            final_posting.write(data)
+            if final_positions is not None:
+                positions_pointer = final_positions.tell()
+                positions_data = postings_format.encode_positions(merged_positions)
+                final_positions.write(positions_data)
+                if merged_postings[-1] >= len(document_lengths):
+                    document_lengths.extend([0] * (merged_postings[-1] + 1 - len(document_lengths)))
+                pos = 0
+                for doc_id in merged_postings:
+                    document_lengths[doc_id] += merged_positions[pos]
+                    pos += 1 + merged_positions[pos]
+                final_dictionary.write(f"{term} {len(merged_postings)} {final_pointer} {len(data)} "
+                                       f"{positions_pointer} {len(positions_data)}\n")
+            else:
+                final_dictionary.write(f"{term} {len(merged_postings)} {final_pointer} {len(data)}\n")
+        else:
+            # The text format keeps its skip count of sqrt(df), the skip spacing only applies to the binary formats
+            number_of_skips = str(round(math.sqrt(len(merged_postings))))
+            merged_postings_string = ' '.join(str(posting_id) for posting_id in merged_postings)
+            final_posting.write(number_of_skips + ' ' + merged_postings_string + '\n')
+            final_dictionary.write(f"{term} {len(merged_postings)} {final_pointer}\n")
+
+    merge(write_final_term)
+    final_dictionary.close()
+    final_posting.close()
+    if final_positions is not None:
+        final_positions.close()
+        with open(lengths_file or postings_format.lengths_path(write_postings_file), 'wb') as f:
+            f.write(document_lengths.tobytes())
+
+# Function that returns the doc ids of the full doc id list of an index
+def read_indexed_doc_ids(dictionary_file, postings_file):
+    with open(dictionary_file, 'r') as dict_file:
+        for line in dict_file:
+            term_info = line.split(' ')
+            if term_info[0] == lexicon.FULL_SET_TERM:
+                reader = PostingsReader(postings_file)
+                doc_ids = reader.read_postings(tuple(int(number) for number in term_info[1:]), has_skip_count=False)
+                reader.close()
+                return doc_ids
+    return array('i')
+
+# Function that indexes the documents of in_dir that are not in an existing index yet into a new delta segment
+# The words memoised for the delta segment are added to the stemming memo of the base index
+# None is returned if there is no new document, otherwise the stats of build_index
+def add_documents(in_dir, out_dict, out_postings, postings_encoding='vbyte', memory_limit=MEMORY_LIMIT, workers=1,
+                  skip_spacing=postings_format.DEFAULT_SKIP_SPACING, temp_dir=None, temp_limit=None, resume=False):
+    indexed = set()
+    for dictionary_file, postings_file in [(out_dict, out_postings)] + segments.read_manifest(out_dict):
+        indexed.update(read_indexed_doc_ids(dictionary_file, postings_file))
+    new_filenames = [filename for filename in os.listdir(in_dir) if int(filename) not in indexed]
+    if not new_filenames:
+        return None
+
+    # The delta segment has positions if the base index has them
+    segment_dict, segment_postings = segments.next_segment_paths(out_dict, out_postings)
+    stats = build_index(in_dir, segment_dict, segment_postings, postings_encoding, memory_limit, workers,
+                        new_filenames, os.path.exists(postings_format.positions_path(out_postings)), skip_spacing,
+                        temp_dir, temp_limit, resume)
+    memo = TermNormaliser()
+    memo.load(memo_path(out_dict))
+    memo.load(memo_path(segment_dict))
+    memo.save(memo_path(out_dict))
+    os.remove(memo_path(segment_dict))
+    # The segment is only searched once it is complete and listed in the manifest
+    # The k-gram index of the base index covers the terms of all the segments
+    os.remove(wildcard.kgrams_path(segment_dict))
+    segments.add_to_manifest(out_dict, segment_dict, segment_postings)
+    wildcard.write_kgram_index(out_dict)
+    return stats
+
+# Function that builds an index of the documents of in_dir partitioned into number_of_shards shards by doc id range
+# (see shards.py), every shard is built by build_index with the given arguments and has its own full doc id list
+# The stats of the shards are added up
+def build_shards(in_dir, out_dict, out_postings, number_of_shards, postings_encoding='vbyte', memory_limit=MEMORY_LIMIT,
+                 workers=1, positional=False, skip_spacing=postings_format.DEFAULT_SKIP_SPACING, temp_dir=None,
+                 temp_limit=None):
+    shard_list = []
+    total = {'documents': 0, 'bytes': 0, 'blocks': 0, 'stemming': '', 'phases': {}}
+    for number, filenames in enumerate(shards.partition(os.listdir(in_dir), number_of_shards), 1):
+        shard_dict, shard_postings = shards.shard_paths(out_dict, out_postings, number)
+        stats = build_index(in_dir, shard_dict, shard_postings, postings_encoding, memory_limit, workers, filenames,
+                            positional, skip_spacing, temp_dir, temp_limit)
+        shard_list.append((shard_dict, shard_postings, int(filenames[0]), int(filenames[-1])))
+        for key in ('documents', 'bytes', 'blocks'):
+            total[key] += stats[key]
+        for phase, seconds in stats['phases'].items():
+            total['phases'][phase] = total['phases'].get(phase, 0.0) + seconds
+        total['stemming'] += ('\n' if number > 1 else '') + f"shard {number}: {stats['stemming']}"
+    # The index is only searched as a sharded index once every shard is complete
+    shards.write_manifest(out_dict, shard_list)
+    return total
+
+# Function that merges the delta segments of an index back into its base dictionary and postings file and drops the
+# documents deleted with tombstones.py from the postings
+# The compacted index is written next to the base index and then moved over it, searches that have already opened the
+# index keep reading the old files, so the compaction can run in the background of a search server. Searches started
+# while the files are being moved should be retried.
+# The postings are written with postings_encoding, by default the encoding of the base postings file
+# A dict with the number of delta segments merged and the number of deleted documents dropped is returned
+def compact_index(out_dict, out_postings, postings_encoding=None, skip_spacing=postings_format.DEFAULT_SKIP_SPACING):
+    delta_segments = segments.read_manifest(out_dict)
+    deleted = load_tombstones(out_dict)
+    if not delta_segments and deleted is None:
+        return {'segments': 0, 'deleted': 0}
+    if postings_encoding is None:
+        postings_encoding = postings_format.read_encoding(out_postings)
+    all_segments = [(out_dict, out_postings)] + delta_segments
+    doc_ids = set()
+    for dictionary_file, postings_file in all_segments:
+        doc_ids.update(read_indexed_doc_ids(dictionary_file, postings_file))
+    dropped = [doc_id for doc_id in deleted.doc_ids() if doc_id in doc_ids] if deleted is not None else []
+    doc_ids.difference_update(dropped)
+
+    positions_file = postings_format.positions_path(out_postings)
+    positional = os.path.exists(positions_file)
+    lengths_file = postings_format.lengths_path(out_postings)
+    compact_dict, compact_postings, compact_positions, compact_lengths = (
+        out_dict + '.compact', out_postings + '.compact', positions_file + '.compact', lengths_file + '.compact')
+    for path in (compact_dict, compact_postings, compact_positions, compact_lengths):
+        if os.path.exists(path):
+            os.remove(path)
+    cursors = [SegmentCursor(dictionary_file, postings_file, positional)
+               for dictionary_file, postings_file in all_segments]
+
+    def merge(write_term):
+        # The segments hold disjoint doc ids, the concatenated postings only need sorting when a segment holds
+        # lower doc ids than an older one
+        # Terms found only in deleted documents are left out
+        def write_sorted_term(term, doc_ids, positions):
+            if positions is not None:
+                write_positional_term(write_term, term, doc_ids, positions)
+                return
+            if deleted is not None:
+                doc_ids = deleted.filter(doc_ids)
+                if not doc_ids:
+                    return
+            if any(doc_ids[i - 1] > doc_ids[i] for i in range(1, len(doc_ids))):
+                doc_ids.sort()
+            write_term(term, doc_ids)
+
+        # The positions of every document are moved and dropped with its doc id
+        def write_positional_term(write_term, term, doc_ids, positions):
+            documents = []
+            pos = 0
+            for doc_id in doc_ids:
+                count = positions[pos]
+                if deleted is None or doc_id not in deleted:
+                    documents.append((doc_id, positions[pos:pos + 1 + count]))
+                pos += 1 + count
+            if not documents:
+                return
+            documents.sort(key=lambda document: document[0])
+            merged_positions = []
+            for _, document_positions in documents:
+                merged_positions.extend(document_positions)
+            write_term(term, [doc_id for doc_id, _ in documents], merged_positions)
+
+        merge_cursors(cursors, write_sorted_term)
+
+    write_final_files(merge, compact_dict, compact_postings, postings_encoding, positional, compact_positions,
+                      compact_lengths, skip_spacing)
+    write_full_set(compact_dict, compact_postings, sorted(doc_ids), postings_encoding)
+
+    if positional:
+        os.replace(compact_lengths, lengths_file)
+        os.replace(compact_positions, positions_file)
+    os.replace(compact_postings, out_postings)
+    os.replace(compact_dict, out_dict)
+    segments.remove_segments(out_dict)
+    lexicon.write_lexicon(out_dict, os.path.splitext(out_dict)[0] + '.lex')
+    wildcard.write_kgram_index(out_dict)
+    # Documents deleted while the compaction was running stay in the bitmap
+    if dropped:
+        deleted = load_tombstones(out_dict)
+        deleted.clear(dropped)
+        save_tombstones(out_dict, deleted)
+    return {'segments': len(delta_segments), 'deleted': len(dropped)}
 
-    for handle in block_handles + posting_handles:
-        handle.close()
-        
 def main():
     # Set default values
     input_directory = output_file_dictionary = output_file_postings = None
+    # Set below: vbyte for a build, the encoding of the index for --compact
+    postings_encoding = None
+    memory_limit = MEMORY_LIMIT
+    workers = 1
+    # -a adds the new documents of the directory to the index as a delta segment, --compact merges the delta segments
+    # into the base index and drops the deleted documents
+    incremental = compact = False
+    # --positions also writes the positions of the terms, for phrase and NEAR queries
+    positional = False
+    # --skips is the spacing of the skip entries of the binary postings lists: n doc ids, sqrt or multi (two levels)
+    skip_spacing = postings_format.DEFAULT_SKIP_SPACING
+    # --shards partitions the documents by doc id range into the given number of shards, each an index of its own
+    number_of_shards = 0
+    # --temp-dir holds the run directory of the build instead of the directory of the dictionary, --temp-limit bounds
+    # its bytes and --resume continues an interrupted build from its checkpoint
+    temp_dir = temp_limit = None
+    resume = False
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:f:w:a', ['memory-limit=', 'workers=', 'compact', 'positions',
+                                                                 'skips=', 'shards=', 'temp-dir=', 'temp-limit=',
+                                                                 'resume'])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -223,17 +655,116 @@ def main():
             output_file_dictionary = a
         elif o == '-p':  # postings file
             output_file_postings = a
+        elif o == '-f':  # postings encoding
+            postings_encoding = a
+        elif o == '--memory-limit':  # bytes of the in-memory block
+            memory_limit = int(a)
+        elif o in ('-w', '--workers'):  # processes tokenizing and stemming the documents
+            workers = int(a)
+        elif o == '-a':
+            incremental = True
+        elif o == '--compact':
+            compact = True
+        elif o == '--positions':
+            positional = True
+        elif o == '--skips':
+            skip_spacing = a
+        elif o == '--shards':
+            number_of_shards = int(a)
+        elif o == '--temp-dir':
+            temp_dir = a
+        elif o == '--temp-limit':  # bytes of the run files
+            temp_limit = int(a)
+        elif o == '--resume':
+            resume = True
         else:
             assert False, "unhandled option"
 
     # Check if required arguments are provided
-    if input_directory is None or output_file_postings is None or output_file_dictionary is None:
+    if (input_directory is None and not compact) or output_file_postings is None or output_file_dictionary is None:
+        usage()
+        sys.exit(2)
+
+    if postings_encoding is None and not compact:
+        postings_encoding = 'vbyte'
+    if postings_encoding not in (None, 'text') and postings_encoding not in postings_format.CODECS:
         usage()
         sys.exit(2)
 
+    if not postings_format.is_skip_spacing(skip_spacing):
+        usage()
+        sys.exit(2)
+
+    # Positions are only written with binary postings
+    if positional and postings_encoding == 'text':
+        usage()
+        sys.exit(2)
+
+    # The shards of a sharded index are rebuilt as a whole, delta segments are only added to a single index
+    if number_of_shards < 0 or (number_of_shards and (incremental or compact)) or (
+            (incremental or compact) and shards.read_manifest(output_file_dictionary)):
+        usage()
+        sys.exit(2)
+
+    # Every shard is a build of its own, a sharded build is restarted rather than resumed
+    if resume and (number_of_shards or compact):
+        usage()
+        sys.exit(2)
+
+    if compact:
+        start = time.perf_counter()
+        merged = compact_index(output_file_dictionary, output_file_postings, postings_encoding, skip_spacing)
+        result_cache.write_version(output_file_dictionary)
+        print(f"Compacted {merged['segments']} delta segments and dropped {merged['deleted']} deleted documents "
+              f"in {time.perf_counter() - start:.1f} s.")
+        return
+
     # Build index
-    build_index(input_directory, output_file_dictionary, output_file_postings)
+    start = time.perf_counter()
+    try:
+        if incremental:
+            stats = add_documents(input_directory, output_file_dictionary, output_file_postings, postings_encoding,
+                                  memory_limit, workers, skip_spacing, temp_dir, temp_limit, resume)
+            if stats is None:
+                print("No new documents to index.")
+                return
+        else:
+            # A full build replaces the delta segments, the deleted documents, the positions and the shards of an
+            # earlier index
+            segments.remove_segments(output_file_dictionary)
+            save_tombstones(output_file_dictionary, Tombstones())
+            for path in (postings_format.positions_path(output_file_postings),
+                         postings_format.lengths_path(output_file_postings)):
+                if os.path.exists(path):
+                    os.remove(path)
+            shards.remove_shards(output_file_dictionary)
+            if number_of_shards:
+                stats = build_shards(input_directory, output_file_dictionary, output_file_postings, number_of_shards,
+                                     postings_encoding, memory_limit, workers, positional, skip_spacing, temp_dir,
+                                     temp_limit)
+            else:
+                stats = build_index(input_directory, output_file_dictionary, output_file_postings, postings_encoding,
+                                    memory_limit, workers, positional=positional, skip_spacing=skip_spacing,
+                                    temp_dir=temp_dir, temp_limit=temp_limit, resume=resume)
+    except OSError as e:
+        # The run files went past --temp-limit, or the disk is full
+        if e.errno != errno.ENOSPC:
+            raise
+        print(f"Indexing stopped: {e.strerror} ({e.filename}). Run index.py again with --resume and a larger "
+              f"--temp-limit or more space to continue from the last checkpoint.")
+        sys.exit(1)
+    # The results cached by search.py --result-cache for the earlier version of the index are no longer used
+    result_cache.write_version(output_file_dictionary)
+    elapsed = time.perf_counter() - start
     print("Indexing completed.")
+    if stats.get('resumed'):
+        print(f"Resumed after the {stats['resumed']} documents of the checkpoint.")
+    # Indexing throughput
+    print(f"{stats['documents']} documents, {stats['bytes'] / 1e6:.1f} MB in {elapsed:.1f} s "
+          f"({stats['documents'] / elapsed:.0f} documents/s, {stats['bytes'] / 1e6 / elapsed:.2f} MB/s), "
+          f"{stats['blocks']} blocks")
+    print("phases: " + ", ".join(f"{phase} {seconds:.1f} s" for phase, seconds in stats['phases'].items()))
+    print(stats['stemming'])
 
 if __name__ == "__main__":
     main()
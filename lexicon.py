@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+import sys
+import time
+import mmap
+import struct
+import getopt
+import tracemalloc
+from array import array
+from bisect import bisect_right
+import postings_format
+
+# Binary lexicon: the dictionary as a sorted, front coded term table plus parallel arrays of the document frequency,
+# postings offset and postings length of every term
+# search.py memory maps the lexicon and looks terms up with a binary search, so no Python dict is built at start up
+# and the lexicon pages are shared by all the search processes of a host.
+#
+# Layout (little endian):
+#   MAGIC, padded to 8 bytes
+#   header: term count, block size, block count, the df, offset and length of the full doc id list,
+#           start and length of the term table
+#   block offsets: the byte position of every block inside the term table (uint32)
+#   dfs (uint32), offsets (uint64), lengths (uint32): one entry per term, in term order
+#   for an index with positions (MAGIC_POSITIONAL), positions offsets (uint64) and positions lengths (uint32) as well
+#   term table: the terms in blocks of block size terms, the first term of a block is stored whole
+#               (vbyte length + UTF-8 bytes), every other term as the length of the prefix it shares with the
+#               previous term, the length of the rest, and the rest (front coding)
+MAGIC = b'BRLEX1'
+MAGIC_POSITIONAL = b'BRLEXP'
+HEADER = struct.Struct('<8Q')
+HEADER_START = 8
+TERMS_PER_BLOCK = 16
+FULL_SET_TERM = 'Full_doc_id_pointer'
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -l lexicon-file [-m]")
+
+# Function that pads a bytearray with zeros to a multiple of 8 bytes
+def pad(data):
+    data.extend(b'\0' * (-len(data) % 8))
+
+# Function that writes the lexicon of a text dictionary file
+# Every line of the dictionary is term, df, offset and, for binary postings, length,
+# followed by the offset and length of the positions of the term for an index with positions
+def write_lexicon(dictionary_path, lexicon_path, block_size=TERMS_PER_BLOCK):
+    entries = []
+    full_set = (0, 0, 0)
+    positional = False
+    with open(dictionary_path, 'r') as dict_file:
+        for line in dict_file.read().split('\n'):
+            if line == '':
+                continue
+            term, frequency, *pointers = line.split(' ')
+            entry = (int(frequency), int(pointers[0]), int(pointers[1]) if len(pointers) > 1 else 0)
+            if len(pointers) > 3:
+                positional = True
+                entry += (int(pointers[2]), int(pointers[3]))
+            if term == FULL_SET_TERM:
+                full_set = entry
+            else:
+                entries.append((term.encode(), entry))
+    # UTF-8 byte order is the same as the order of the terms as str
+    entries.sort(key=lambda item: item[0])
+
+    terms = bytearray()
+    block_offsets = array('I')
+    previous = b''
+    for i, (term, entry) in enumerate(entries):
+        if i % block_size == 0:
+            block_offsets.append(len(terms))
+            terms.extend(postings_format.vbyte_encode([len(term)]))
+            terms.extend(term)
+        else:
+            prefix = 0
+            while prefix < min(len(term), len(previous)) and term[prefix] == previous[prefix]:
+                prefix += 1
+            terms.extend(postings_format.vbyte_encode([prefix, len(term) - prefix]))
+            terms.extend(term[prefix:])
+        previous = term
+
+    body = bytearray()
+    sections = [block_offsets, array('I', [entry[0] for _, entry in entries]),
+                array('Q', [entry[1] for _, entry in entries]), array('I', [entry[2] for _, entry in entries])]
+    if positional:
+        sections += [array('Q', [entry[3] for _, entry in entries]), array('I', [entry[4] for _, entry in entries])]
+    for section in sections:
+        body.extend(section.tobytes())
+        pad(body)
+    terms_start = HEADER_START + HEADER.size + len(body)
+
+    with open(lexicon_path, 'wb') as lexicon_file:
+        lexicon_file.write((MAGIC_POSITIONAL if positional else MAGIC).ljust(HEADER_START, b'\0'))
+        lexicon_file.write(HEADER.pack(len(entries), block_size, len(block_offsets), *full_set, terms_start,
+                                       len(terms)))
+        lexicon_file.write(body)
+        lexicon_file.write(terms)
+
+# Function that tells whether a file is a lexicon rather than a text dictionary
+def is_lexicon(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) in (MAGIC, MAGIC_POSITIONAL)
+
+# Read-only, memory mapped lexicon
+# It can be used in place of the dictionary dict of search.py: term in lexicon, lexicon[term] and lexicon.get(term)
+# return the same (df, offset, length) entries, without the terms ever being loaded into memory.
+class Lexicon:
+    def __init__(self, lexicon_path):
+        self.file = open(lexicon_path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.buffer)
+        self.positional = self.buffer[:len(MAGIC_POSITIONAL)] == MAGIC_POSITIONAL
+        (self.term_count, self.block_size, block_count, full_df, full_offset, full_length, terms_start,
+         terms_length) = HEADER.unpack_from(self.buffer, HEADER_START)
+        self.full_set = (full_df, full_offset, full_length)
+
+        # The parallel arrays are cast straight out of the mapping, nothing is copied
+        position = HEADER_START + HEADER.size
+        sections = []
+        layout = [('I', block_count), ('I', self.term_count), ('Q', self.term_count), ('I', self.term_count)]
+        if self.positional:
+            layout += [('Q', self.term_count), ('I', self.term_count)]
+        for type_code, count in layout:
+            size = struct.calcsize(type_code) * count
+            sections.append(view[position:position + size].cast(type_code))
+            position += size + (-size % 8)
+        self.block_offsets, self.dfs, self.offsets, self.lengths = sections[:4]
+        self.positions_offsets, self.positions_lengths = sections[4:] if self.positional else (None, None)
+        self.terms = view[terms_start:terms_start + terms_length]
+        self.views = sections + [self.terms, view]
+        # The first term of every block, decoded lazily by the binary search
+        self.block_first_terms = BlockFirstTerms(self)
+
+    # Function that decodes the whole term stored at position pos of the term table
+    def read_first_term(self, pos):
+        (length,), pos = postings_format.vbyte_decode(self.terms, pos, 1)
+        return bytes(self.terms[pos:pos + length])
+
+    # Function that returns the index of a term in the parallel arrays, or -1 if the term is not in the lexicon
+    def find(self, term):
+        key = term.encode()
+        block = bisect_right(self.block_first_terms, key) - 1
+        if block < 0:
+            return -1
+        pos = self.block_offsets[block]
+        (length,), pos = postings_format.vbyte_decode(self.terms, pos, 1)
+        current = bytes(self.terms[pos:pos + length])
+        pos += length
+        index = block * self.block_size
+        last = min(index + self.block_size, self.term_count) - 1
+        while True:
+            if current == key:
+                return index
+            # The terms of a block are sorted, so the term can not come after a larger one
+            if current > key or index == last:
+                return -1
+            (prefix, length), pos = postings_format.vbyte_decode(self.terms, pos, 2)
+            current = current[:prefix] + bytes(self.terms[pos:pos + length])
+            pos += length
+            index += 1
+
+    def get(self, term, default=None):
+        if term == FULL_SET_TERM:
+            return self.full_set
+        index = self.find(term)
+        if index < 0:
+            return default
+        if self.positional:
+            return (self.dfs[index], self.offsets[index], self.lengths[index], self.positions_offsets[index],
+                    self.positions_lengths[index])
+        return (self.dfs[index], self.offsets[index], self.lengths[index])
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return self.term_count + 1
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.buffer.close()
+        self.file.close()
+
+# Sequence of the first terms of the blocks of a lexicon, so that bisect can search the blocks directly
+class BlockFirstTerms:
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+
+    def __len__(self):
+        return len(self.lexicon.block_offsets)
+
+    def __getitem__(self, block):
+        return self.lexicon.read_first_term(self.lexicon.block_offsets[block])
+
+# Function that measures the start up time and the memory allocated to load a text dictionary as a dict
+# and to open the lexicon built from it
+def measure(dictionary_path, lexicon_path):
+    import search
+    for name, load in (('text dictionary', search.load_dictionary), ('lexicon', Lexicon)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        dictionary = load(dictionary_path if name == 'text dictionary' else lexicon_path)
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'{name}: loaded in {1000 * elapsed:.1f} ms, {memory / 1024:.0f} KB allocated, {len(dictionary)} entries')
+
+def main():
+    dictionary_file = lexicon_file = None
+    measure_startup = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:l:m')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-l':
+            lexicon_file = a
+        elif o == '-m':
+            measure_startup = True
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file is None or lexicon_file is None:
+        usage()
+        sys.exit(2)
+
+    write_lexicon(dictionary_file, lexicon_file)
+    if measure_startup:
+        measure(dictionary_file, lexicon_file)
+
+if __name__ == "__main__":
+    main()
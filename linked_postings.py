@@ -0,0 +1,203 @@
+import math
+import heapq
+
+# Reference implementation of the set operations on postings lists stored as linked lists with skip pointers
+# search.py uses the array based operations of postings_ops.py, this module exposes the same interface
+# (from_doc_ids, to_doc_ids and the set operations) so the two can be swapped to check they return the same results
+
+# Define a Node class to represent each element in the linked list
+class Node:
+    def __init__(self, doc_id):
+        self.doc_id = doc_id
+        self.next = None
+        self.skip = None  # Pointer to the skip node
+
+# Function that builds a linked list with skip pointers every sqrt(n) nodes from a sorted list of doc ids
+def from_doc_ids(doc_ids):
+    return construct_linked_list(round(math.sqrt(len(doc_ids))), doc_ids)
+
+# Function that collects the doc ids of a linked list into a list
+def to_doc_ids(head):
+    doc_ids = []
+    current_node = head
+    while current_node:
+        doc_ids.append(current_node.doc_id)
+        current_node = current_node.next
+    return doc_ids
+
+# Function that counts the nodes of a linked list
+def count_doc_ids(head):
+    count = 0
+    current_node = head
+    while current_node:
+        count += 1
+        current_node = current_node.next
+    return count
+
+# Function of constructing a linked list from document IDs and skip count
+def construct_linked_list(skip_count, posting_list):
+    head = None
+    current = None
+    current_skip = None
+    counter = 0  # Start counter at 0
+    for doc_id in posting_list:
+        if head is None:
+            head = Node(doc_id)
+            current = head
+        else:
+            current.next = Node(doc_id)
+            current = current.next
+        # Set skip pointer and reset counter when it reaches skip_count
+        if counter == skip_count and skip_count > 1:
+            if current_skip is not None:
+                current_skip.skip = current
+                current_skip = current
+            counter = 1  # Reset counter to 1 after setting skip to count correctly for the next skip interval
+        else:
+            counter += 1
+        # Initialize current_skip after the first node is created to ensure the first skip starts from the head
+        if current_skip is None:
+            current_skip = head
+            counter = 1  # Start counting for skip from the first node
+    return head
+
+# Function that adds the skip pointers taken and the linear steps (next pointers) of an operation to an optional
+# stats dict
+def count_steps(stats, skips, steps):
+    if stats is not None:
+        stats['skips'] = stats.get('skips', 0) + skips
+        stats['steps'] = stats.get('steps', 0) + steps
+
+# Function that computes the intersection of two posting lists with skip pointers
+# stats is an optional dict counting the skip pointers taken and the linear steps
+def intersect_postings(p1, p2, stats=None):
+    dummy = Node(None)  # Dummy head to simplify insertion
+    current = dummy
+    skips = steps = 0
+
+    while p1 and p2:
+        # If the document IDs match, add the current document ID to the result list
+        if p1.doc_id == p2.doc_id:
+            current.next = Node(p1.doc_id)
+            current = current.next
+            p1 = p1.next
+            p2 = p2.next
+            steps += 1
+        elif p1.doc_id < p2.doc_id:
+            # Use skip pointer if it's beneficial; otherwise, move to the next
+            if p1.skip and p1.skip.doc_id < p2.doc_id:
+                while p1.skip and p1.skip.doc_id < p2.doc_id:
+                    p1 = p1.skip
+                    skips += 1
+            else:
+                p1 = p1.next
+                steps += 1
+        else:
+            # Use skip pointer if it's beneficial; otherwise, move to the next
+            if p2.skip and p2.skip.doc_id < p1.doc_id:
+                while p2.skip and p2.skip.doc_id < p1.doc_id:
+                    p2 = p2.skip
+                    skips += 1
+            else:
+                p2 = p2.next
+                steps += 1
+    count_steps(stats, skips, steps)
+    return dummy.next
+
+# Function that computes the union of two posting lists
+def union_postings(p1, p2):
+    dummy = Node(None)
+    current = dummy
+
+    while p1 or p2:
+        if p1 is not None and (p2 is None or p1.doc_id < p2.doc_id):
+            # p1 is the next node to add
+            current.next = Node(p1.doc_id)
+            p1 = p1.next
+        elif p2 is not None and (p1 is None or p2.doc_id < p1.doc_id):
+            # p2 is the next node to add
+            current.next = Node(p2.doc_id)
+            p2 = p2.next
+        elif p1 is not None and p2 is not None and p1.doc_id == p2.doc_id:
+            # Both p1 and p2 have the same doc_id, add either one and advance both
+            current.next = Node(p1.doc_id)
+            p1 = p1.next
+            p2 = p2.next
+
+        current = current.next
+
+    return dummy.next
+
+# Function that computes the union of any number of posting lists with a heap of their current nodes
+def union_many(postings_lists):
+    dummy = Node(None)
+    current = dummy
+    heap = [(head.doc_id, i, head) for i, head in enumerate(postings_lists) if head is not None]
+    heapq.heapify(heap)
+    while heap:
+        doc_id, i, node = heap[0]
+        if current is dummy or current.doc_id != doc_id:
+            current.next = Node(doc_id)
+            current = current.next
+        if node.next is not None:
+            heapq.heapreplace(heap, (node.next.doc_id, i, node.next))
+        else:
+            heapq.heappop(heap)
+    return dummy.next
+
+# Function that computes the negation of a posting list (to the full set)
+# This is written under the assumption that the full set is a superset of the posting list
+def negate_postings(p, full_set, stats=None):
+    dummy = Node(None)
+    current = dummy
+    steps = 0
+
+    while p or full_set:
+        steps += 1
+        # If the current document ID is in the full set but not in the posting list, add it to the result
+        if full_set and (not p or full_set.doc_id < p.doc_id):
+            current.next = Node(full_set.doc_id)
+            current = current.next
+            full_set = full_set.next
+        # If the current document ID is in both the posting list and the full set, skip both
+        elif p.doc_id == full_set.doc_id:
+            p = p.next
+            full_set = full_set.next
+        # If the current document ID is in the posting list but not in the full set, skip it
+        # However, this case should not happen because the full set should be a superset of the posting list
+        else:
+            p = p.next
+    count_steps(stats, 0, steps)
+    return dummy.next
+
+# Function that computes the AND NOT operation between two posting lists
+# stats is an optional dict counting the skip pointers taken and the linear steps
+def and_not_postings(p1, p2, stats=None):
+    dummy = Node(None)
+    current = dummy
+    skips = steps = 0
+
+    while p1 or p2:
+        # If p2 is None or p1 is not None and p1's doc_id is less than p2's doc_id
+        if p2 is None or (p1 is not None and p1.doc_id < p2.doc_id):
+            current.next = Node(p1.doc_id)
+            current = current.next
+            # Every node of p1 before p2's doc_id is part of the result, so p1 can not use its skip pointers
+            p1 = p1.next
+            steps += 1
+        # If both p1 and p2 are not None and have the same doc_id
+        elif p1 is not None and p2 is not None and p1.doc_id == p2.doc_id:
+            p1 = p1.next
+            p2 = p2.next
+            steps += 1
+        # If p1 is None or p2's doc_id is less than p1's doc_id
+        else:
+            # If p2 has a skip pointer and it points to a doc_id that is still less than p1's doc_id
+            if p2.skip and (p1 is None or p2.skip.doc_id < p1.doc_id):
+                p2 = p2.skip
+                skips += 1
+            else:
+                p2 = p2.next
+                steps += 1
+    count_steps(stats, skips, steps)
+    return dummy.next
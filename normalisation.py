@@ -0,0 +1,83 @@
+import os
+import time
+import pickle
+from nltk.stem import PorterStemmer
+
+# Normalisation of words into terms, shared by index.py and search.py
+# A word is case-folded and then stemmed with NLTK's Porter stemmer. As the vocabulary is very skewed, most words are
+# seen many times, so the term of every word is memoised. The memo is bounded: once it holds max_entries words,
+# new words are still normalised but no longer remembered. index.py saves the memo next to the index so that
+# search.py starts with the terms of the whole collection already known.
+
+# Default number of words remembered
+MAX_ENTRIES = 200000
+
+class TermNormaliser:
+    # With record_updates, the words memoised are also recorded until the next call of take_updates
+    def __init__(self, max_entries=MAX_ENTRIES, record_updates=False):
+        self.max_entries = max_entries
+        self.stemmer = PorterStemmer()
+        self.terms = {}  # word -> term
+        self.new_terms = {} if record_updates else None
+        self.hits = 0
+        self.misses = 0
+        self.stem_time = 0.0  # Seconds spent normalising the words that were not memoised
+
+    # Function that returns the term of a word
+    def normalise(self, word):
+        term = self.terms.get(word)
+        if term is not None:
+            self.hits += 1
+            return term
+        self.misses += 1
+        start = time.perf_counter()
+        term = self.stemmer.stem(word.lower())
+        self.stem_time += time.perf_counter() - start
+        if len(self.terms) < self.max_entries:
+            self.terms[word] = term
+            if self.new_terms is not None:
+                self.new_terms[word] = term
+        return term
+
+    # Function that returns the words memoised and the counters since the last call and resets them,
+    # so that a worker process can pass them on to the normaliser of the main process
+    def take_updates(self):
+        updates = (self.new_terms, self.hits, self.misses, self.stem_time)
+        self.new_terms = {}
+        self.hits = self.misses = 0
+        self.stem_time = 0.0
+        return updates
+
+    # Function that adds the words memoised and the counters of another normaliser, e.g. one of a worker process
+    def merge(self, terms, hits, misses, stem_time):
+        for word, term in terms.items():
+            if len(self.terms) >= self.max_entries:
+                break
+            self.terms.setdefault(word, term)
+        self.hits += hits
+        self.misses += misses
+        self.stem_time += stem_time
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self.terms, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Function that loads the words saved by save, it does nothing if the file does not exist
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            self.merge(pickle.load(f), 0, 0, 0.0)
+
+    # Function that describes the hit rate of the memo and an estimate of the time it saved,
+    # each hit is counted as the average time taken to normalise a word that was not memoised
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        time_saved = self.hits * self.stem_time / self.misses if self.misses else 0
+        return (f"stemming cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{len(self.terms)} words, about {time_saved:.2f} s of stemming saved")
+
+# Function that returns the path of the saved memo of the index whose dictionary is dictionary_path
+def memo_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.stems'
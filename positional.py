@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+import os
+import re
+import sys
+import time
+import getopt
+from bisect import bisect_left, bisect_right
+from nltk.tokenize import word_tokenize
+
+# Phrase and proximity matching on the positions written by index.py --positions
+# A phrase "a b c" matches a document where a, b and c occur at consecutive positions, a NEAR/k b matches a document
+# where the terms or phrases a and b occur with at most k words between them, in either order. The candidate
+# documents are found with the postings only, as the AND of every term of the expression, and the positions are only
+# decoded for the candidates, one document at a time.
+# Run as a script, it benchmarks the positional index against post-filtering the candidates by re-reading and
+# re-tokenizing the documents, and checks that both give the same results.
+
+NEAR_PATTERN = re.compile(r'NEAR/(\d+)$')
+PHRASE_PATTERN = re.compile(r'PHRASE/(\d+)$')
+# Tokens that word_tokenize turns the opening and the closing double quotes of a phrase into
+OPEN_QUOTE = '``'
+CLOSE_QUOTE = "''"
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -i directory-of-documents")
+
+# Function that returns the maximum distance of a NEAR/k token, None if the token is not a NEAR operator
+def near_distance(token):
+    match = NEAR_PATTERN.match(token) if isinstance(token, str) else None
+    return int(match.group(1)) if match else None
+
+# Function that returns the number of terms of a PHRASE/n token of a postfix expression, None for any other token
+def phrase_length(token):
+    match = PHRASE_PATTERN.match(token)
+    return int(match.group(1)) if match else None
+
+# Function that groups the words between double quotes into tuples, the other tokens are returned as they are
+# None is returned if a quote is not closed or a phrase is empty
+def group_phrases(tokens):
+    grouped = []
+    phrase = None
+    for token in tokens:
+        if token == OPEN_QUOTE and phrase is None:
+            phrase = []
+        elif token in (CLOSE_QUOTE, OPEN_QUOTE) and phrase is not None:
+            if not phrase:
+                return None
+            grouped.append(tuple(phrase))
+            phrase = None
+        elif phrase is not None:
+            phrase.append(token)
+        elif token in (CLOSE_QUOTE, OPEN_QUOTE):
+            return None
+        else:
+            grouped.append(token)
+    return grouped if phrase is None else None
+
+# Function that returns the terms of a PHRASE or NEAR plan node, in order and with repetitions
+def leaf_terms(node):
+    if node.operator == 'TERM':
+        return [node.term]
+    terms = []
+    for child in node.children:
+        terms.extend(leaf_terms(child))
+    return terms
+
+# Function that returns the (first, last) positions of the occurrences of a TERM or PHRASE node in a document,
+# sorted by first position
+# positions maps every term to an object whose get(doc_id) returns its sorted positions in the document
+def spans(node, doc_id, positions):
+    if node.operator == 'TERM':
+        return [(position, position) for position in positions[node.term].get(doc_id)]
+    starts = None
+    for offset, child in enumerate(node.children):
+        child_starts = {position - offset for position in positions[child.term].get(doc_id)}
+        starts = child_starts if starts is None else starts & child_starts
+        if not starts:
+            return []
+    last = len(node.children) - 1
+    return [(start, start + last) for start in sorted(starts)]
+
+# Function that tells whether two lists of spans have a pair of spans that do not overlap and are at most distance
+# positions apart
+# The spans of a list all have the same length, so their last positions are sorted as well as their first ones
+def is_near(left_spans, right_spans, distance):
+    right_starts = [start for start, _ in right_spans]
+    right_ends = [end for _, end in right_spans]
+    for start, end in left_spans:
+        # The first right span starting after the left one and the last one ending before it
+        after = bisect_right(right_starts, end)
+        if after < len(right_starts) and right_starts[after] - end - 1 <= distance:
+            return True
+        before = bisect_left(right_ends, start) - 1
+        if before >= 0 and start - right_ends[before] - 1 <= distance:
+            return True
+    return False
+
+# Function that tells whether a document matches a PHRASE or NEAR node
+def matches(node, doc_id, positions):
+    if node.operator == 'NEAR':
+        left_spans = spans(node.children[0], doc_id, positions)
+        if not left_spans:
+            return False
+        return is_near(left_spans, spans(node.children[1], doc_id, positions), node.distance)
+    return bool(spans(node, doc_id, positions))
+
+# Function that keeps the candidate doc ids that match a PHRASE or NEAR node
+def filter_matches(node, candidates, positions):
+    return [doc_id for doc_id in candidates if matches(node, doc_id, positions)]
+
+# Function that keeps the candidate doc ids that match a PHRASE or NEAR node by re-reading the documents,
+# the post-filtering the positional index is benchmarked against
+def filter_by_reading(node, candidates, in_dir, normalise):
+    matched = []
+    for doc_id in candidates:
+        with open(os.path.join(in_dir, str(doc_id)), 'r') as f:
+            words = word_tokenize(f.read())
+        document_positions = {}
+        for position, word in enumerate(words):
+            document_positions.setdefault(normalise(word), []).append(position)
+        positions = {term: {doc_id: document_positions.get(term, [])} for term in leaf_terms(node)}
+        if matches(node, doc_id, positions):
+            matched.append(doc_id)
+    return matched
+
+# Function that times the phrase and NEAR expressions of the queries with the positional index and by re-reading
+# the documents of the candidates
+def benchmark(dict_file, postings_file, queries_file, in_dir):
+    import search
+    import query_planner
+    import postings_ops
+
+    dictionary, reader = search.open_index(dict_file, postings_file)
+    search.load_stemming_memo(dict_file)
+    with open(queries_file, 'r') as f:
+        queries = [query for query in f.read().split('\n') if query.strip() != '']
+
+    # The PHRASE and NEAR nodes of every query
+    nodes = []
+    for query in queries:
+        postfix = search.parse_query(query)
+        if postfix is None:
+            continue
+        stack = [query_planner.build_tree(postfix)]
+        while stack:
+            node = stack.pop()
+            if node.operator in ('PHRASE', 'NEAR'):
+                nodes.append(node)
+            else:
+                stack.extend(node.children)
+
+    index_time = reading_time = 0.0
+    candidate_count = match_count = 0
+    for node in nodes:
+        terms = sorted(set(leaf_terms(node)))
+        candidates = None
+        for term in terms:
+            postings = search.get_postings(term, dictionary, reader)
+            candidates = postings if candidates is None else postings_ops.intersect_postings(candidates, postings)
+        candidates = postings_ops.to_doc_ids(candidates)
+        candidate_count += len(candidates)
+
+        start = time.perf_counter()
+        positions = {term: reader.read_positions(dictionary[term]) for term in terms} if candidates else {}
+        matched = filter_matches(node, candidates, positions)
+        index_time += time.perf_counter() - start
+        # The positions are slices of the memory mapped positions file, which cannot be closed while they exist
+        del positions
+
+        start = time.perf_counter()
+        read_matched = filter_by_reading(node, candidates, in_dir, search.normaliser.normalise)
+        reading_time += time.perf_counter() - start
+
+        if matched != read_matched:
+            print(f"mismatch for {leaf_terms(node)}: {len(matched)} documents with positions, "
+                  f"{len(read_matched)} by re-reading")
+        match_count += len(matched)
+
+    print(f"{len(nodes)} phrase and NEAR expressions, {candidate_count} candidate documents, {match_count} matches")
+    print(f"positional index: {index_time:.3f} s, re-reading the documents: {reading_time:.3f} s")
+    reader.close()
+
+def main():
+    dictionary_file = postings_file = queries_file = input_directory = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:i:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            queries_file = a
+        elif o == '-i':
+            input_directory = a
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file is None or postings_file is None or queries_file is None or input_directory is None:
+        usage()
+        sys.exit(2)
+
+    benchmark(dictionary_file, postings_file, queries_file, input_directory)
+
+if __name__ == "__main__":
+    main()
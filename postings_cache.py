@@ -0,0 +1,62 @@
+from collections import OrderedDict, Counter
+
+# Size bounded LRU cache of postings lists, shared by all the queries of a batch
+# The keys are the canonical keys of query_planner, so the decoded postings of a term and the result of a
+# sub-expression are found again whichever query of the batch they come from and whatever order their operands
+# were typed in. The size of the cache is the total number of doc ids it holds, once it is exceeded the least
+# recently used entries are evicted.
+class PostingsCache:
+    def __init__(self, max_doc_ids, count_doc_ids=len):
+        self.max_doc_ids = max_doc_ids
+        self.count_doc_ids = count_doc_ids  # Function that returns the number of doc ids of a cached postings list
+        self.entries = OrderedDict()  # key -> (postings, number of doc ids)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Number of times every sub-expression occurs in the batch
+        self.occurrences = Counter()
+
+    # Function that counts the sub-expressions of every plan of the batch
+    # Only terms and the sub-expressions that occur more than once are worth keeping in the cache
+    def count_expressions(self, plans):
+        for plan in plans:
+            nodes = [plan]
+            while nodes:
+                node = nodes.pop()
+                self.occurrences[node.key] += 1
+                nodes.extend(node.children)
+
+    # Function that tells whether the result of a plan node should be looked up in and stored to the cache
+    def is_cacheable(self, node):
+        return node.operator == 'TERM' or self.occurrences[node.key] > 1
+
+    # Function that returns the cached postings of a key, or None if the key is not cached
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    # Function that stores the postings of a key, evicting the least recently used entries to stay within the size
+    def put(self, key, postings):
+        doc_id_count = self.count_doc_ids(postings)
+        if doc_id_count > self.max_doc_ids:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (postings, doc_id_count)
+        self.size += doc_id_count
+        while self.size > self.max_doc_ids:
+            evicted_postings, evicted_count = self.entries.popitem(last=False)[1]
+            self.size -= evicted_count
+            self.evictions += 1
+
+    # Function that describes the hit rate and the content of the cache
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        return (f"postings cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {len(self.entries)} entries holding {self.size} doc ids")
@@ -0,0 +1,280 @@
+import heapq
+from bisect import bisect_left
+import postings_format
+from bitmap_postings import RoaringBitmap, CONTAINER_BITS, dense_positions
+from postings_ops import gallop_to
+
+# Lazy evaluation of a query with cursors
+# Every postings list is read through a cursor pointing at one of its doc ids: doc_id() returns it (None once the
+# list is exhausted), next() moves to the next one and skip_to(doc_id) moves to the first doc id not smaller than
+# doc_id. An operator is a cursor over the cursors of its operands: AND leapfrogs its children with skip_to, OR
+# keeps them in a heap, AND NOT skips the excluded cursor to every kept doc id. The doc ids of a query come out of
+# the cursor of its plan one at a time, so no intermediate list is built, and the blocks of a binary postings list
+# are only decoded when the cursor moves into them: a block whose doc ids are skipped over is never decoded.
+
+# Cursor over a list that has no doc id
+class EmptyCursor:
+    def doc_id(self):
+        return None
+
+    def next(self):
+        pass
+
+    def skip_to(self, doc_id):
+        pass
+
+# Cursor over a sorted array of doc ids, for the ASCII postings format
+class ArrayCursor:
+    def __init__(self, doc_ids):
+        self.doc_ids = doc_ids
+        self.position = 0
+
+    def doc_id(self):
+        return self.doc_ids[self.position] if self.position < len(self.doc_ids) else None
+
+    def next(self):
+        self.position += 1
+
+    def skip_to(self, doc_id):
+        self.position = gallop_to(self.doc_ids, doc_id, self.position)
+
+# Cursor over a postings list in the binary block format, its blocks are decoded one at a time
+# skip_to finds the block holding a doc id in the skip table stored with the list, without decoding the blocks before
+# it, and with a second skip level only the group of skip entries of that block is decoded
+class BlockCursor:
+    def __init__(self, data, codec):
+        self.data = data
+        self.codec = codec
+        self.skips = postings_format.SkipTable(data)
+        self.block_number = -1
+        self.values = []
+        self.position = 0
+        self.blocks_decoded = 0
+        if self.skips.number_of_blocks:
+            self.load(0)
+
+    # Function that decodes a block and moves the cursor to its first doc id
+    def load(self, block_number):
+        first, start, end = self.skips.block(block_number)
+        block_size = self.skips.block_size
+        block_length = min(block_size, self.skips.count - block_number * block_size)
+        values = [first]
+        doc_id = first
+        for gap in postings_format.decode_gaps(self.data[start:end], block_length - 1, self.codec):
+            doc_id += gap
+            values.append(doc_id)
+        self.block_number = block_number
+        self.values = values
+        self.position = 0
+        self.blocks_decoded += 1
+
+    def doc_id(self):
+        return self.values[self.position] if self.position < len(self.values) else None
+
+    def next(self):
+        self.position += 1
+        if self.position == len(self.values) and self.block_number + 1 < self.skips.number_of_blocks:
+            self.load(self.block_number + 1)
+
+    def skip_to(self, doc_id):
+        if self.position == len(self.values) or self.values[self.position] >= doc_id:
+            return
+        if self.values[-1] < doc_id:
+            # The last block whose first doc id is not larger than doc_id, the doc id is in it or at the start of
+            # the next one
+            block_number = self.skips.find(doc_id, self.block_number + 1)
+            if block_number <= self.block_number:
+                if self.block_number + 1 == self.skips.number_of_blocks:
+                    self.position = len(self.values)
+                    return
+                block_number = self.block_number + 1
+            self.load(block_number)
+        self.position = bisect_left(self.values, doc_id, self.position)
+        if self.position == len(self.values) and self.block_number + 1 < self.skips.number_of_blocks:
+            self.load(self.block_number + 1)
+
+# Cursor over a compressed bitmap, its containers are turned into doc ids one at a time
+class BitmapCursor:
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.container_number = -1
+        self.values = []
+        self.position = 0
+        if bitmap.keys:
+            self.load(0)
+
+    def load(self, container_number):
+        key = self.bitmap.keys[container_number]
+        container = self.bitmap.containers[container_number]
+        base = key << CONTAINER_BITS
+        if isinstance(container, int):
+            self.values = dense_positions(container, base)
+        else:
+            self.values = [base + value for value in container]
+        self.container_number = container_number
+        self.position = 0
+
+    def doc_id(self):
+        return self.values[self.position] if self.position < len(self.values) else None
+
+    def next(self):
+        self.position += 1
+        if self.position == len(self.values) and self.container_number + 1 < len(self.bitmap.keys):
+            self.load(self.container_number + 1)
+
+    def skip_to(self, doc_id):
+        if self.position == len(self.values) or self.values[self.position] >= doc_id:
+            return
+        if self.values[-1] < doc_id:
+            container_number = bisect_left(self.bitmap.keys, doc_id >> CONTAINER_BITS, self.container_number + 1)
+            if container_number == len(self.bitmap.keys):
+                self.position = len(self.values)
+                return
+            self.load(container_number)
+        self.position = bisect_left(self.values, doc_id, self.position)
+
+# Function that returns the cursor of a postings list in the binary format
+def open_binary_cursor(data, codec):
+    (count, block_size), pos = postings_format.vbyte_decode(data, 0, 2)
+    if not count:
+        return EmptyCursor()
+    if block_size == postings_format.BITMAP_BLOCK_SIZE:
+        return BitmapCursor(postings_format.decode_postings(data, codec))
+    return BlockCursor(data, codec)
+
+# Function that returns the cursor of a decoded postings list, an array of doc ids or a bitmap
+def open_decoded_cursor(postings):
+    if isinstance(postings, RoaringBitmap):
+        return BitmapCursor(postings)
+    return ArrayCursor(postings)
+
+# Doc ids found in every child, the children are best given smallest first
+# The first child proposes a doc id, the others skip to it, and whenever one of them lands past it, its doc id
+# becomes the new proposal
+class AndCursor:
+    def __init__(self, children):
+        self.children = children
+        self.current = None
+        self.align(children[0].doc_id())
+
+    def align(self, target):
+        while target is not None:
+            for child in self.children:
+                child.skip_to(target)
+                doc_id = child.doc_id()
+                if doc_id is None:
+                    self.current = None
+                    return
+                if doc_id != target:
+                    target = doc_id
+                    break
+            else:
+                self.current = target
+                return
+        self.current = None
+
+    def doc_id(self):
+        return self.current
+
+    def next(self):
+        if self.current is None:
+            return
+        self.children[0].next()
+        self.align(self.children[0].doc_id())
+
+    def skip_to(self, doc_id):
+        if self.current is not None and self.current < doc_id:
+            self.align(doc_id)
+
+# Doc ids found in at least one child, the children are kept in a heap ordered by their current doc id
+class OrCursor:
+    def __init__(self, children):
+        self.children = children
+        self.heap = [(child.doc_id(), i) for i, child in enumerate(children) if child.doc_id() is not None]
+        heapq.heapify(self.heap)
+
+    def doc_id(self):
+        return self.heap[0][0] if self.heap else None
+
+    # Function that moves the children whose doc id is smaller than doc_id (or equal to it when inclusive is True)
+    def advance(self, doc_id, inclusive):
+        heap = self.heap
+        while heap and (heap[0][0] <= doc_id if inclusive else heap[0][0] < doc_id):
+            child = self.children[heap[0][1]]
+            if inclusive:
+                child.next()
+            else:
+                child.skip_to(doc_id)
+            if child.doc_id() is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (child.doc_id(), heap[0][1]))
+
+    def next(self):
+        if self.heap:
+            self.advance(self.heap[0][0], True)
+
+    def skip_to(self, doc_id):
+        self.advance(doc_id, False)
+
+# Doc ids of the kept cursor that are not in the excluded one, NOT a is the full doc id list AND NOT a
+class AndNotCursor:
+    def __init__(self, kept, excluded):
+        self.kept = kept
+        self.excluded = excluded
+        self.align()
+
+    def align(self):
+        doc_id = self.kept.doc_id()
+        while doc_id is not None:
+            self.excluded.skip_to(doc_id)
+            if self.excluded.doc_id() != doc_id:
+                return
+            self.kept.next()
+            doc_id = self.kept.doc_id()
+
+    def doc_id(self):
+        return self.kept.doc_id()
+
+    def next(self):
+        self.kept.next()
+        self.align()
+
+    def skip_to(self, doc_id):
+        self.kept.skip_to(doc_id)
+        self.align()
+
+# Doc ids of a cursor for which accept returns True, e.g. the candidates of a phrase that match its positions
+class FilterCursor:
+    def __init__(self, child, accept):
+        self.child = child
+        self.accept = accept
+        self.align()
+
+    def align(self):
+        doc_id = self.child.doc_id()
+        while doc_id is not None and not self.accept(doc_id):
+            self.child.next()
+            doc_id = self.child.doc_id()
+
+    def doc_id(self):
+        return self.child.doc_id()
+
+    def next(self):
+        self.child.next()
+        self.align()
+
+    def skip_to(self, doc_id):
+        self.child.skip_to(doc_id)
+        self.align()
+
+# Function that returns the doc ids of a cursor, at most limit of them if limit is given
+# The doc ids are produced as the cursor finds them, so a caller that stops early never evaluates the rest
+def stream(cursor, limit=None):
+    count = 0
+    doc_id = cursor.doc_id()
+    while doc_id is not None and (limit is None or count < limit):
+        yield doc_id
+        count += 1
+        cursor.next()
+        doc_id = cursor.doc_id()
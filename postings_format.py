@@ -0,0 +1,391 @@
+import os
+import math
+from array import array
+from bisect import bisect_right
+import bitmap_postings
+
+# Every binary postings file starts with this magic string followed by one byte naming the codec,
+# so that search.py can tell a binary postings file apart from the ASCII one
+MAGIC = b'BRPOST'
+CODEC_VBYTE = 1
+CODEC_GAMMA = 2
+CODECS = {'vbyte': CODEC_VBYTE, 'gamma': CODEC_GAMMA}
+HEADER_SIZE = len(MAGIC) + 1
+
+# Number of doc ids stored in each block of a postings list, every block gets one skip entry
+BLOCK_SIZE = 128
+# Block size written in place of the real one for a list stored as a compressed bitmap
+BITMAP_BLOCK_SIZE = 0
+# Spacing of the skip entries of the postings lists, chosen with index.py --skips:
+#   a number n: a block, and one skip entry, every n doc ids,
+#   sqrt: a block every sqrt(length) doc ids, the classic spacing that balances skips against steps in a block,
+#   multi: small blocks of MULTI_BLOCK_SIZE doc ids, whose skip entries are grouped by SKIP_FANOUT under a second level
+DEFAULT_SKIP_SPACING = str(BLOCK_SIZE)
+MULTI_BLOCK_SIZE = 16
+SKIP_FANOUT = 16
+
+# Function that tells whether a string names a skip spacing
+def is_skip_spacing(spacing):
+    return spacing in ('sqrt', 'multi') or (spacing.isdigit() and int(spacing) > 0)
+
+# Function that returns the (block size, fanout of the second skip level) of a list of count doc ids
+def skip_layout(count, spacing=DEFAULT_SKIP_SPACING):
+    if spacing == 'sqrt':
+        return max(1, round(math.sqrt(count))), 0
+    if spacing == 'multi':
+        return MULTI_BLOCK_SIZE, SKIP_FANOUT
+    return int(spacing), 0
+
+# Function that writes the header of a binary postings file
+def write_header(postings_file, codec):
+    postings_file.write(MAGIC + bytes([codec]))
+
+# Function that reads the header of a postings file opened in binary mode
+# It returns the codec of the file, or None if the file is in the ASCII format
+# The file pointer is moved back to the start of the file either way
+def read_header(postings_file):
+    postings_file.seek(0)
+    header = postings_file.read(HEADER_SIZE)
+    postings_file.seek(0)
+    if len(header) == HEADER_SIZE and header[:len(MAGIC)] == MAGIC and header[-1] in CODECS.values():
+        return header[-1]
+    return None
+
+# Function that returns the encoding of the postings file at path, as given to index.py -f: the name of its codec, or
+# text for a file without a header
+def read_encoding(path):
+    with open(path, 'rb') as postings_file:
+        codec = read_header(postings_file)
+    if codec is None:
+        return 'text'
+    return next(name for name, number in CODECS.items() if number == codec)
+
+# Function that encodes a list of non-negative integers with variable byte encoding
+# The lower 7 bits of every byte carry data and the high bit marks the last byte of a number
+def vbyte_encode(numbers):
+    encoded = bytearray()
+    for number in numbers:
+        chunk = []
+        while True:
+            chunk.append(number & 0x7F)
+            number >>= 7
+            if number == 0:
+                break
+        chunk[0] |= 0x80
+        encoded.extend(reversed(chunk))
+    return encoded
+
+# Function that decodes count numbers from data starting at position pos
+# The decoded numbers and the position right after the last byte read are returned
+def vbyte_decode(data, pos, count):
+    numbers = []
+    number = 0
+    while len(numbers) < count:
+        byte = data[pos]
+        pos += 1
+        if byte & 0x80:
+            numbers.append((number << 7) | (byte & 0x7F))
+            number = 0
+        else:
+            number = (number << 7) | byte
+    return numbers, pos
+
+# Function that encodes a list of positive integers with Elias gamma encoding
+# The bit string is padded to a whole number of bytes, the padding is never read as the count is always known
+def gamma_encode(numbers):
+    bits = []
+    for number in numbers:
+        offset = bin(number)[3:]  # Binary representation without the leading 1
+        bits.append('1' * len(offset) + '0' + offset)
+    bit_string = ''.join(bits)
+    if not bit_string:
+        return b''
+    padding = -len(bit_string) % 8
+    bit_string += '1' * padding
+    return int(bit_string, 2).to_bytes(len(bit_string) // 8, 'big')
+
+# Function that decodes count numbers from Elias gamma encoded data
+def gamma_decode(data, count):
+    if count == 0:
+        return []
+    bit_string = bin(int.from_bytes(data, 'big'))[2:].zfill(len(data) * 8)
+    numbers = []
+    pos = 0
+    while len(numbers) < count:
+        length = bit_string.index('0', pos) - pos
+        pos += length + 1
+        numbers.append(int('1' + bit_string[pos:pos + length], 2))
+        pos += length
+    return numbers
+
+# Function that encodes the gaps of one block with the given codec
+def encode_gaps(gaps, codec):
+    if codec == CODEC_GAMMA:
+        return gamma_encode(gaps)
+    return vbyte_encode(gaps)
+
+# Function that decodes count gaps of one block with the given codec
+def decode_gaps(data, count, codec):
+    if count == 0:
+        return []
+    if codec == CODEC_GAMMA:
+        return gamma_decode(data, count)
+    return vbyte_decode(data, 0, count)[0]
+
+# Function that encodes a sorted list of doc ids into the binary postings format
+# Layout (all header numbers are variable byte encoded):
+#   number of doc ids, block size, fanout of the second skip level (0 when there is none),
+#   for a second skip level: the byte lengths of the second level and of the first level,
+#   second level: for every group of fanout blocks, the gaps to the previous group of the first doc id of its first
+#                 block, of the byte offset of its entries in the first level and of the byte offset of its data,
+#   first level (skip table): for every block, the gap between its first doc id and the previous block's first doc id
+#                             and the number of bytes of its encoded data, i.e. the gap between the byte offsets,
+#   block data: for every block, the gaps between consecutive doc ids after its first doc id
+# With a second level, a doc id is found by decoding the second level and the fanout entries of a single group of
+# the first level, instead of the whole first level
+def encode_postings(doc_ids, codec=CODEC_VBYTE, block_size=BLOCK_SIZE, fanout=0):
+    entries = []
+    blocks = []
+    previous_first = 0
+    for start in range(0, len(doc_ids), block_size):
+        block = doc_ids[start:start + block_size]
+        data = encode_gaps([block[i] - block[i - 1] for i in range(1, len(block))], codec)
+        entries.append(vbyte_encode([block[0] - previous_first, len(data)]))
+        blocks.append(data)
+        previous_first = block[0]
+    if fanout and len(blocks) > fanout:
+        level_two = []
+        previous = (0, 0, 0)
+        entries_offset = data_offset = 0
+        for i, block_entry in enumerate(entries):
+            if i % fanout == 0:
+                group = (doc_ids[i * block_size], entries_offset, data_offset)
+                level_two.extend(current - last for current, last in zip(group, previous))
+                previous = group
+            entries_offset += len(block_entry)
+            data_offset += len(blocks[i])
+        level_two_data = vbyte_encode(level_two)
+        header = vbyte_encode([len(doc_ids), block_size, fanout, len(level_two_data), entries_offset]) + level_two_data
+    else:
+        header = vbyte_encode([len(doc_ids), block_size, 0])
+    return bytes(header) + b''.join(entries) + b''.join(blocks)
+
+# Function that encodes a sorted list of doc ids as a compressed bitmap (see bitmap_postings.py)
+# Layout: number of doc ids and BITMAP_BLOCK_SIZE as variable byte numbers, then the serialized bitmap
+# The codec does not apply to bitmaps, so a dense list is read back the same way from a vbyte or a gamma file
+def encode_bitmap_postings(doc_ids):
+    bitmap = bitmap_postings.RoaringBitmap.from_sorted(doc_ids)
+    return bytes(vbyte_encode([len(doc_ids), BITMAP_BLOCK_SIZE])) + bitmap_postings.serialize(bitmap, vbyte_encode)
+
+# Function that encodes a sorted list of doc ids, as a compressed bitmap if it is dense, as blocks of gaps otherwise
+# spacing sets the size of the blocks and the skip levels, see skip_layout
+def encode_postings_by_density(doc_ids, codec=CODEC_VBYTE, spacing=DEFAULT_SKIP_SPACING):
+    if bitmap_postings.is_dense(doc_ids):
+        return encode_bitmap_postings(doc_ids)
+    block_size, fanout = skip_layout(len(doc_ids), spacing)
+    return encode_postings(doc_ids, codec, block_size, fanout)
+
+# Skip table of an encoded postings list, the first doc id and the byte range of the data of every block
+# Without a second level the whole first level is decoded at once. With one, only the second level is decoded at
+# first, and a group of the first level is decoded the first time one of its blocks is needed.
+# entries_decoded counts the skip entries decoded, of both levels
+class SkipTable:
+    def __init__(self, data):
+        (self.count, self.block_size, self.fanout), pos = vbyte_decode(data, 0, 3)
+        self.data = data
+        self.number_of_blocks = math.ceil(self.count / self.block_size)
+        self.firsts = [None] * self.number_of_blocks
+        self.starts = [None] * self.number_of_blocks
+        self.ends = [None] * self.number_of_blocks
+        if not self.fanout:
+            self.entries_decoded = self.number_of_blocks
+            self.groups = None
+            raw_table, pos = vbyte_decode(data, pos, 2 * self.number_of_blocks)
+            self.fill(0, raw_table, pos)
+            return
+        (level_two_length, level_one_length), pos = vbyte_decode(data, pos, 2)
+        number_of_groups = math.ceil(self.number_of_blocks / self.fanout)
+        raw_groups, _ = vbyte_decode(data, pos, 3 * number_of_groups)
+        self.entries_decoded = number_of_groups
+        self.level_one_start = pos + level_two_length
+        self.data_start = self.level_one_start + level_one_length
+        # (first doc id, byte offset in the first level, byte offset in the data) of every group, None once decoded
+        self.groups = []
+        self.group_firsts = []
+        first = entries_offset = data_offset = 0
+        for i in range(number_of_groups):
+            first += raw_groups[3 * i]
+            entries_offset += raw_groups[3 * i + 1]
+            data_offset += raw_groups[3 * i + 2]
+            self.groups.append((first, entries_offset, data_offset))
+            self.group_firsts.append(first)
+
+    # Function that fills the entries of the blocks from block_number on from their raw skip entries, the data of
+    # the first of them starting at byte position start
+    def fill(self, block_number, raw_table, start):
+        first = 0
+        for i in range(len(raw_table) // 2):
+            first += raw_table[2 * i]
+            self.firsts[block_number + i] = first
+            self.starts[block_number + i] = start
+            start += raw_table[2 * i + 1]
+            self.ends[block_number + i] = start
+
+    # Function that decodes the first level entries of a group
+    def load_group(self, group_number):
+        group = self.groups[group_number]
+        if group is None:
+            return
+        first, entries_offset, data_offset = group
+        block_number = group_number * self.fanout
+        length = min(self.fanout, self.number_of_blocks - block_number)
+        raw_table, _ = vbyte_decode(self.data, self.level_one_start + entries_offset, 2 * length)
+        # The first doc id of the group comes from the second level, in place of its gap to the previous block
+        raw_table[0] = first
+        self.fill(block_number, raw_table, self.data_start + data_offset)
+        self.entries_decoded += length
+        self.groups[group_number] = None
+
+    # Function that returns the (first doc id, start, end) of a block
+    def block(self, block_number):
+        if self.groups is not None:
+            self.load_group(block_number // self.fanout)
+        return self.firsts[block_number], self.starts[block_number], self.ends[block_number]
+
+    # Function that returns the last block from low on whose first doc id is not larger than doc_id,
+    # low - 1 if there is none
+    def find(self, doc_id, low=0):
+        if self.groups is None:
+            return bisect_right(self.firsts, doc_id, low) - 1
+        group_number = bisect_right(self.group_firsts, doc_id, low // self.fanout) - 1
+        if group_number < 0:
+            return low - 1
+        self.load_group(group_number)
+        group_start = max(low, group_number * self.fanout)
+        group_end = min(self.number_of_blocks, (group_number + 1) * self.fanout)
+        if group_start >= group_end:
+            return low - 1
+        return max(low - 1, bisect_right(self.firsts, doc_id, group_start, group_end) - 1)
+
+# Function that reads the header and skip table of an encoded postings list
+# It returns the number of doc ids, the block size, a list of (first doc id, start, end) for every block
+# where start and end are the byte positions of the block data inside data
+def decode_skip_table(data):
+    table = SkipTable(data)
+    return table.count, table.block_size, [table.block(i) for i in range(table.number_of_blocks)]
+
+# Function that decodes an encoded postings list back into an array of doc ids,
+# or into a RoaringBitmap if the list was stored as a compressed bitmap
+# data can be bytes or a memoryview, slicing a memoryview does not copy the underlying buffer
+def decode_postings(data, codec=CODEC_VBYTE):
+    (count, block_size), pos = vbyte_decode(data, 0, 2)
+    if block_size == BITMAP_BLOCK_SIZE and count:
+        return bitmap_postings.deserialize(data, pos, vbyte_decode)
+    count, block_size, blocks = decode_skip_table(data)
+    doc_ids = array('i')
+    for i, (first, start, end) in enumerate(blocks):
+        block_length = min(block_size, count - i * block_size)
+        doc_id = first
+        doc_ids.append(doc_id)
+        for gap in decode_gaps(data[start:end], block_length - 1, codec):
+            doc_id += gap
+            doc_ids.append(doc_id)
+    return doc_ids
+
+# Positions of the terms in the documents, written by index.py --positions to a positions file next to the postings
+# file (postings.txt -> postings.positions). The positions of a term are stored in the order of the doc ids of its
+# postings list, as the flat list [count, position, ..., count, position, ...] of every document.
+# Layout (variable byte numbers):
+#   number of documents, block size, largest count, byte length of the counts, byte length of every block of block
+#   size documents,
+#   counts: the number of positions of every document, which is the term frequency used by ranked retrieval,
+#   block data: for every document, the first position and the gaps between the others
+# The term frequencies are read without touching the positions, and a single document is read by skipping whole
+# blocks, so only the block holding it is decoded
+
+# Function that returns the path of the positions file of a postings file
+def positions_path(postings_path):
+    return os.path.splitext(postings_path)[0] + '.positions'
+
+# Function that returns the path of the document lengths of a postings file, written with the positions
+# The file is an array of unsigned 32 bit numbers (native byte order) holding the number of tokens of every doc id
+def lengths_path(postings_path):
+    return os.path.splitext(postings_path)[0] + '.lengths'
+
+def encode_positions(flat_positions, block_size=BLOCK_SIZE):
+    counts = []
+    blocks = []
+    block = bytearray()
+    pos = 0
+    while pos < len(flat_positions):
+        count = flat_positions[pos]
+        positions = flat_positions[pos + 1:pos + 1 + count]
+        counts.append(count)
+        block.extend(vbyte_encode([positions[0]] + [positions[i] - positions[i - 1] for i in range(1, count)]))
+        pos += 1 + count
+        if len(counts) % block_size == 0:
+            blocks.append(bytes(block))
+            block = bytearray()
+    if block:
+        blocks.append(bytes(block))
+    counts_data = vbyte_encode(counts)
+    header = vbyte_encode([len(counts), block_size, max(counts, default=0), len(counts_data)] +
+                          [len(data) for data in blocks])
+    return bytes(header) + bytes(counts_data) + b''.join(blocks)
+
+# Function that decodes the header of the positions of a term
+# The number of documents, the block size, the largest count, the byte offset of the counts and the byte offset of
+# the data of every block are returned
+def decode_positions_header(data):
+    (number_of_documents, block_size, max_count, counts_length), pos = vbyte_decode(data, 0, 4)
+    lengths, pos = vbyte_decode(data, pos, math.ceil(number_of_documents / block_size))
+    counts_offset = pos
+    pos += counts_length
+    block_offsets = []
+    for length in lengths:
+        block_offsets.append(pos)
+        pos += length
+    return number_of_documents, block_size, max_count, counts_offset, block_offsets
+
+# Function that returns the largest number of positions of a term in a document, its largest term frequency
+def decode_max_count(data):
+    return vbyte_decode(data, 0, 3)[0][2]
+
+# Function that decodes the number of positions of every document of a term, its term frequencies
+def decode_counts(data, header=None):
+    number_of_documents, _, _, counts_offset, _ = header or decode_positions_header(data)
+    return vbyte_decode(data, counts_offset, number_of_documents)[0]
+
+# Function that decodes the positions of the documents of the block starting at byte offset, counts holds the number
+# of positions of each of them
+def decode_positions_block(data, offset, counts):
+    block = []
+    pos = offset
+    for count in counts:
+        positions, pos = vbyte_decode(data, pos, count)
+        for i in range(1, count):
+            positions[i] += positions[i - 1]
+        block.append(positions)
+    return block
+
+# Function that decodes the positions of the document at position index of the postings list
+def decode_positions(data, index):
+    header = decode_positions_header(data)
+    block_size, block_offsets = header[1], header[4]
+    block = index // block_size
+    counts = decode_counts(data, header)[block * block_size:index + 1]
+    return decode_positions_block(data, block_offsets[block], counts)[-1]
+
+# Function that decodes the positions of every document of a term back into the flat list
+def decode_all_positions(data):
+    header = decode_positions_header(data)
+    counts = decode_counts(data, header)
+    flat_positions = array('i')
+    pos = header[4][0] if header[4] else 0
+    for count in counts:
+        positions, pos = vbyte_decode(data, pos, count)
+        for i in range(1, count):
+            positions[i] += positions[i - 1]
+        flat_positions.append(count)
+        flat_positions.extend(positions)
+    return flat_positions
@@ -0,0 +1,195 @@
+from array import array
+from bisect import bisect_left
+from bitmap_postings import RoaringBitmap, union_all
+
+# Set operations on postings lists stored as sorted arrays of doc ids or as compressed bitmaps
+# The postings of very frequent terms and the full doc id list are read from the postings file as RoaringBitmaps
+# (see bitmap_postings.py), every other list as an array('i'). Each operation picks the implementation for the
+# representations of its two operands: two bitmaps are combined container by container, an array is checked
+# against a bitmap with one membership test per doc id of the array, and two arrays are merged as sorted arrays.
+# Every operation returns a new array or bitmap, the operands are never modified
+# linked_postings.py holds the original linked list implementation with the same interface
+
+# When one list is this many times longer than the other, galloping through the longer list
+# is cheaper than touching each of its doc ids once
+GALLOP_RATIO = 8
+
+# Doc id past the end of every postings list, where the linear merges put a list once they have read all of it
+END_OF_LIST = float('inf')
+
+# Function that turns the doc ids read from the postings file into the representation used by the operations
+def from_doc_ids(doc_ids):
+    return doc_ids if isinstance(doc_ids, (array, RoaringBitmap)) else array('i', doc_ids)
+
+# Function that returns the doc ids of a postings list, arrays are already plain sequences of doc ids
+def to_doc_ids(postings):
+    return postings.to_array() if isinstance(postings, RoaringBitmap) else postings
+
+# Function that returns a postings list as a bitmap
+def to_bitmap(postings):
+    return postings if isinstance(postings, RoaringBitmap) else RoaringBitmap.from_sorted(postings)
+
+# Function that returns the number of doc ids of a postings list
+def count_doc_ids(postings):
+    return len(postings)
+
+# Function that returns the first position at or after low whose doc id is not smaller than target
+# The position is found by probing ahead in steps of 1, 2, 4, ... and then binary searching the last step,
+# so finding a doc id d positions ahead costs O(log d) instead of O(d)
+def gallop_to(postings, target, low):
+    step = 1
+    high = low
+    while high < len(postings) and postings[high] < target:
+        low = high + 1
+        high = low + step
+        step *= 2
+    return bisect_left(postings, target, low, min(high, len(postings)))
+
+# Function that adds the skips and linear steps of an operation to an optional stats dict
+# A skip is a gallop over a run of doc ids of the longer list, a linear step a doc id looked at one at a time
+def count_steps(stats, skips, steps):
+    if stats is not None:
+        stats['skips'] = stats.get('skips', 0) + skips
+        stats['steps'] = stats.get('steps', 0) + steps
+
+# Function that computes the intersection of two posting lists
+# stats is an optional dict counting the skips and linear steps taken (see count_steps), the bitmaps count neither
+def intersect_postings(p1, p2, stats=None):
+    if isinstance(p1, RoaringBitmap) and isinstance(p2, RoaringBitmap):
+        return p1.intersection(p2)
+    if isinstance(p1, RoaringBitmap):
+        return p1.filter(p2)
+    if isinstance(p2, RoaringBitmap):
+        return p2.filter(p1)
+    # Always walk the shorter list
+    if len(p1) > len(p2):
+        p1, p2 = p2, p1
+    if len(p2) > GALLOP_RATIO * len(p1):
+        result = array('i')
+        position = 0
+        for doc_id in p1:
+            position = gallop_to(p2, doc_id, position)
+            if position == len(p2):
+                break
+            if p2[position] == doc_id:
+                result.append(doc_id)
+        # One gallop per doc id of p1 up to the last one looked up, counted once the loop is over
+        if stats is not None and p1:
+            count_steps(stats, bisect_left(p1, doc_id) + 1, 0)
+        return result
+    # Lists of similar length: one linear merge, p2 is read alongside p1 and moved past every doc id of p1
+    count_steps(stats, 0, len(p1) + len(p2))
+    result = array('i')
+    rest = iter(p2)
+    doc_id2 = next(rest, END_OF_LIST)
+    for doc_id in p1:
+        while doc_id2 < doc_id:
+            doc_id2 = next(rest, END_OF_LIST)
+        if doc_id2 == doc_id:
+            result.append(doc_id)
+        elif doc_id2 == END_OF_LIST:
+            break
+    return result
+
+# Function that computes the union of two posting lists
+def union_postings(p1, p2):
+    if isinstance(p1, RoaringBitmap) or isinstance(p2, RoaringBitmap):
+        return to_bitmap(p1).union(to_bitmap(p2))
+    if not p1 or not p2:
+        return array('i', p1 or p2)
+    if len(p1) > len(p2):
+        p1, p2 = p2, p1
+    result = array('i')
+    if len(p2) > GALLOP_RATIO * len(p1):
+        # Gallop to every doc id of the shorter p1 in p2 and copy the runs of p2 in between as slices
+        start = 0
+        for doc_id in p1:
+            position = gallop_to(p2, doc_id, start)
+            result.extend(p2[start:position])
+            result.append(doc_id)
+            start = position + 1 if position < len(p2) and p2[position] == doc_id else position
+        result.extend(p2[start:])
+        return result
+    # Lists of similar length: one linear merge, the doc ids of p2 smaller than the next doc id of p1 come first
+    rest = iter(p2)
+    doc_id2 = next(rest)
+    for doc_id in p1:
+        while doc_id2 < doc_id:
+            result.append(doc_id2)
+            doc_id2 = next(rest, END_OF_LIST)
+        if doc_id2 == doc_id:
+            doc_id2 = next(rest, END_OF_LIST)
+        result.append(doc_id)
+    # p1 is exhausted, the rest of p2 is copied as it is
+    if doc_id2 != END_OF_LIST:
+        result.append(doc_id2)
+        result.extend(rest)
+    return result
+
+# Function that merges any number of sorted arrays into one sorted array without duplicates
+# The doc ids go through a single set that is then sorted, both in C. Sorting the concatenated arrays as runs still
+# had to hash every doc id to drop the duplicates and took twice as long, a heapq.merge of the arrays five times as long
+def merge_arrays(arrays):
+    if len(arrays) <= 1:
+        return array('i', arrays[0] if arrays else [])
+    return array('i', sorted(set().union(*arrays)))
+
+# Function that computes the union of any number of posting lists in one pass, e.g. the terms of a wildcard
+# Folding union_postings over the lists would copy the growing result once per list, here the lists are merged at once:
+# arrays are merged through a single set (merge_arrays) and bitmaps container by container
+def union_many(postings_lists):
+    bitmaps = [p for p in postings_lists if isinstance(p, RoaringBitmap)]
+    arrays = [p for p in postings_lists if not isinstance(p, RoaringBitmap) and p]
+    if not bitmaps:
+        return merge_arrays(arrays)
+    if arrays:
+        bitmaps.append(RoaringBitmap.from_sorted(merge_arrays(arrays)))
+    return union_all(bitmaps)
+
+# Function that computes the AND NOT operation between two posting lists
+# stats is an optional dict counting the skips and linear steps taken
+def and_not_postings(p1, p2, stats=None):
+    if isinstance(p1, RoaringBitmap):
+        return p1.difference(to_bitmap(p2))
+    if isinstance(p2, RoaringBitmap):
+        return p2.filter(p1, keep=False)
+    result = array('i')
+    if len(p2) > GALLOP_RATIO * len(p1):
+        # Gallop to every doc id of the shorter p1 in p2, the doc ids it does not find are kept
+        position = 0
+        for doc_id in p1:
+            position = gallop_to(p2, doc_id, position)
+            if position == len(p2) or p2[position] != doc_id:
+                result.append(doc_id)
+        count_steps(stats, len(p1), 0)
+        return result
+    if len(p1) <= GALLOP_RATIO * len(p2):
+        # Lists of similar length: one linear merge, the doc ids of p1 that p2 passes over are kept
+        count_steps(stats, 0, len(p1) + len(p2))
+        rest = iter(p2)
+        doc_id2 = next(rest, END_OF_LIST)
+        for doc_id in p1:
+            while doc_id2 < doc_id:
+                doc_id2 = next(rest, END_OF_LIST)
+            if doc_id2 != doc_id:
+                result.append(doc_id)
+        return result
+    # Gallop to every doc id of the much shorter p2 in p1 and copy the runs of p1 in between as slices
+    start = position = 0
+    for doc_id in p2:
+        position = gallop_to(p1, doc_id, position)
+        if position == len(p1):
+            break
+        if p1[position] == doc_id:
+            result.extend(p1[start:position])
+            start = position + 1
+    if stats is not None and p2:
+        count_steps(stats, bisect_left(p2, doc_id) + 1, 0)
+    result.extend(p1[start:])
+    return result
+
+# Function that computes the negation of a posting list (to the full set)
+# This is written under the assumption that the full set is a superset of the posting list
+# The full set is a bitmap when it is read from a binary postings file, so NOT never builds a list of every doc id
+def negate_postings(p, full_set, stats=None):
+    return and_not_postings(full_set, p, stats)
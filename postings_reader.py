@@ -0,0 +1,129 @@
+import os
+import mmap
+from array import array
+from bisect import bisect_left
+import postings_format
+import postings_cursors
+
+# Read-only view of a postings file backed by mmap
+# The postings lists are sliced straight out of the mapped buffer, so a lookup needs no seek or read system call
+# and never builds an intermediate str. The mapping is read-only and backed by the page cache, so any number of
+# search processes on the same host that open the same postings file share a single copy of it in memory.
+class PostingsReader:
+    def __init__(self, postings_path):
+        self.file = open(postings_path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.buffer)
+        # The codec is None for the ASCII format
+        self.codec = postings_format.read_header(self.buffer)
+        # The positions file only exists for an index built with index.py --positions
+        self.positions_file = None
+        self.positions_view = None
+        path = postings_format.positions_path(postings_path)
+        if self.codec is not None and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.positions_file = open(path, 'rb')
+            self.positions_buffer = mmap.mmap(self.positions_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.positions_view = memoryview(self.positions_buffer)
+        # Number of tokens of every doc id, written with the positions
+        self.document_lengths = None
+        if self.positions_view is not None and os.path.exists(postings_format.lengths_path(postings_path)):
+            self.document_lengths = array('I')
+            with open(postings_format.lengths_path(postings_path), 'rb') as f:
+                self.document_lengths.frombytes(f.read())
+
+    # Function that returns the doc ids of the postings list of a dictionary entry as an array of ints
+    # The entry is (frequency, offset) for the ASCII format and (frequency, offset, length) for the binary format
+    # ASCII lists of terms start with a skip count, which is not part of the doc ids, the full doc id list does not
+    def read_postings(self, entry, has_skip_count=True):
+        offset = entry[1]
+        if self.codec is not None:
+            length = entry[2]
+            return postings_format.decode_postings(self.view[offset:offset + length], self.codec)
+        end = self.buffer.find(b'\n', offset)
+        if end == -1:
+            end = len(self.buffer)
+        # int() accepts bytes directly, so the line is never decoded into a str
+        doc_ids = array('i', map(int, self.buffer[offset:end].split()))
+        return doc_ids[1:] if has_skip_count else doc_ids
+
+    # Function that returns the number of bytes of the postings list of a dictionary entry in the postings file
+    def postings_length(self, entry):
+        if self.codec is not None:
+            return entry[2]
+        end = self.buffer.find(b'\n', entry[1])
+        return (end if end != -1 else len(self.buffer)) - entry[1]
+
+    # Function that returns a cursor over the postings list of a dictionary entry (see postings_cursors.py)
+    # A list in the binary block format is decoded lazily, one block at a time, the ASCII format is read at once
+    def open_cursor(self, entry, has_skip_count=True):
+        if self.codec is not None:
+            offset = entry[1]
+            return postings_cursors.open_binary_cursor(self.view[offset:offset + entry[2]], self.codec)
+        return postings_cursors.ArrayCursor(self.read_postings(entry, has_skip_count))
+
+    def has_positions(self):
+        return self.positions_view is not None
+
+    # Function that returns the positions data of a dictionary entry of a positional index,
+    # the entry is (frequency, offset, length, positions offset, positions length)
+    def positions_data(self, entry):
+        if self.positions_view is None or len(entry) < 5:
+            raise ValueError("the index has no positions, build it with index.py --positions")
+        return self.positions_view[entry[3]:entry[3] + entry[4]]
+
+    # Function that returns the positions of every document of a dictionary entry as the flat list
+    # [count, position, ..., count, position, ...], in the order of the doc ids of the postings list
+    def read_flat_positions(self, entry):
+        return postings_format.decode_all_positions(self.positions_data(entry))
+
+    # Function that returns the doc ids of a dictionary entry as an array and their term frequencies,
+    # the numbers of positions of the term in the documents
+    def read_term_frequencies(self, entry):
+        doc_ids = self.read_postings(entry)
+        doc_ids = doc_ids.to_array() if hasattr(doc_ids, 'to_array') else doc_ids
+        return doc_ids, postings_format.decode_counts(self.positions_data(entry))
+
+    # Function that returns the largest term frequency of a dictionary entry, read from the header of its positions
+    def max_term_frequency(self, entry):
+        return postings_format.decode_max_count(self.positions_data(entry))
+
+    # Function that returns the positions of a dictionary entry, looked up one document at a time
+    def read_positions(self, entry):
+        return TermPositions(self.read_postings(entry), self.positions_data(entry))
+
+    def close(self):
+        if self.positions_view is not None:
+            self.positions_view.release()
+            self.positions_buffer.close()
+            self.positions_file.close()
+        self.view.release()
+        self.buffer.close()
+        self.file.close()
+
+# Positions of one term, only the positions of the documents that are asked for are decoded
+# The documents are usually asked for in doc id order, so the last block decoded is kept for the next lookups
+class TermPositions:
+    def __init__(self, doc_ids, data):
+        self.doc_ids = doc_ids.to_array() if hasattr(doc_ids, 'to_array') else doc_ids
+        self.data = data
+        self.header = None
+        self.counts = None
+        self.block_number = None
+        self.block = None
+
+    # Function that returns the positions of the term in a document, an empty list if the term is not in it
+    def get(self, doc_id):
+        index = bisect_left(self.doc_ids, doc_id)
+        if index == len(self.doc_ids) or self.doc_ids[index] != doc_id:
+            return []
+        if self.header is None:
+            self.header = postings_format.decode_positions_header(self.data)
+            self.counts = postings_format.decode_counts(self.data, self.header)
+        block_size, block_offsets = self.header[1], self.header[4]
+        block_number = index // block_size
+        if block_number != self.block_number:
+            start = block_number * block_size
+            self.block = postings_format.decode_positions_block(self.data, block_offsets[block_number],
+                                                                self.counts[start:start + block_size])
+            self.block_number = block_number
+        return self.block[index - block_number * block_size]
@@ -0,0 +1,186 @@
+# Cost based query planner
+# The postfix expression produced by the shunting yard algorithm is turned into a tree, the n-ary AND / OR chains
+# are flattened, NOT is pushed into AND_NOT where possible, and the operands of every chain are ordered so that the
+# smallest postings lists are combined first. The size of every intermediate result is estimated from the document
+# frequencies in the dictionary, the cost of a plan is the estimated number of doc ids read and compared.
+# Phrases and NEAR expressions are leaves of the plan: their terms are matched on positions, see positional.py.
+# A wildcard is a leaf as well, the OR of the terms it was expanded into, see wildcard.py.
+
+import positional
+import wildcard
+
+# Number of terms of a wildcard listed by explain
+EXPLAINED_TERMS = 10
+
+class PlanNode:
+    def __init__(self, operator, children=None, term=None, distance=None):
+        self.operator = operator  # 'TERM', 'AND', 'OR', 'NOT', 'AND_NOT', 'PHRASE', 'NEAR' or 'WILDCARD'
+        # AND_NOT has exactly two children, the kept and the excluded operand, PHRASE has the terms of the phrase in
+        # order, NEAR has two TERM or PHRASE children and WILDCARD has the terms its pattern was expanded into
+        self.children = children or []
+        self.term = term  # The term of TERM, the pattern of WILDCARD
+        self.distance = distance  # Maximum number of words between the operands of NEAR
+        self.size = 0  # Estimated number of doc ids in the result
+        self.cost = 0  # Estimated number of doc ids read and compared to compute the result
+        self.key = None  # Canonical key, equal for all nodes that compute the same result
+
+# Function that turns a postfix expression into a tree of PlanNode
+def build_tree(postfix):
+    operand_stack = []
+    for token in postfix:
+        if token == 'NOT':
+            operand_stack.append(PlanNode('NOT', [operand_stack.pop()]))
+        elif token in {'AND', 'OR', 'AND_NOT'}:
+            right_operand = operand_stack.pop()
+            operand_stack.append(PlanNode(token, [operand_stack.pop(), right_operand]))
+        elif positional.near_distance(token) is not None:
+            right_operand = operand_stack.pop()
+            operand_stack.append(PlanNode('NEAR', [operand_stack.pop(), right_operand],
+                                          distance=positional.near_distance(token)))
+        elif wildcard.parse_expansion_token(token) is not None:
+            count, pattern = wildcard.parse_expansion_token(token)
+            terms = operand_stack[len(operand_stack) - count:]
+            del operand_stack[len(operand_stack) - count:]
+            operand_stack.append(PlanNode('WILDCARD', terms, term=pattern))
+        elif positional.phrase_length(token) is not None:
+            length = positional.phrase_length(token)
+            terms = operand_stack[-length:]
+            del operand_stack[-length:]
+            operand_stack.append(PlanNode('PHRASE', terms))
+        else:
+            operand_stack.append(PlanNode('TERM', term=token))
+    return operand_stack.pop()
+
+# Function that rewrites a tree so that it only contains flat AND / OR chains, AND_NOT and as few NOT as possible
+# a AND NOT b becomes AND_NOT, NOT a AND NOT b becomes NOT (a OR b) and a OR NOT b becomes NOT (b AND NOT a),
+# so that the full doc id list is only scanned once per chain instead of once per negated operand
+def rewrite(node):
+    if node.operator in {'TERM', 'PHRASE', 'NEAR', 'WILDCARD'}:
+        return node
+    children = [rewrite(child) for child in node.children]
+    if node.operator == 'NOT':
+        # NOT NOT a is a
+        if children[0].operator == 'NOT':
+            return children[0].children[0]
+        return PlanNode('NOT', children)
+    if node.operator == 'AND_NOT':
+        children = [children[0], negate(children[1])]
+        operator = 'AND'
+    else:
+        operator = node.operator
+
+    # Flatten nested chains of the same operator, a nested AND_NOT is part of an AND chain as well
+    flat_children = []
+    for child in children:
+        if child.operator == operator:
+            flat_children.extend(child.children)
+        elif operator == 'AND' and child.operator == 'AND_NOT':
+            kept, excluded = child.children
+            flat_children.extend(kept.children if kept.operator == 'AND' else [kept])
+            flat_children.append(negate(excluded))
+        else:
+            flat_children.append(child)
+    positives = [child for child in flat_children if child.operator != 'NOT']
+    negatives = [child.children[0] for child in flat_children if child.operator == 'NOT']
+    if not negatives:
+        return PlanNode(operator, positives)
+
+    if operator == 'AND':
+        # a AND NOT b AND NOT c is a AND NOT (b OR c), NOT b AND NOT c is NOT (b OR c)
+        excluded = chain('OR', negatives)
+        if not positives:
+            return PlanNode('NOT', [excluded])
+        return PlanNode('AND_NOT', [chain('AND', positives), excluded])
+    # a OR NOT b OR NOT c is NOT ((b AND c) AND NOT a), NOT b OR NOT c is NOT (b AND c)
+    kept = chain('AND', negatives)
+    if not positives:
+        return PlanNode('NOT', [kept])
+    return PlanNode('NOT', [PlanNode('AND_NOT', [kept, chain('OR', positives)])])
+
+# Function that negates a node, removing a double negation
+def negate(node):
+    if node.operator == 'NOT':
+        return node.children[0]
+    return PlanNode('NOT', [node])
+
+# Function that combines nodes with an n-ary operator, a single node is returned as it is
+def chain(operator, nodes):
+    if len(nodes) == 1:
+        return nodes[0]
+    flat_nodes = []
+    for node in nodes:
+        if node.operator == operator:
+            flat_nodes.extend(node.children)
+        else:
+            flat_nodes.append(node)
+    return PlanNode(operator, flat_nodes)
+
+# Function that computes the canonical key of a node from the keys of its children
+# The operands of AND, OR and NEAR are sorted, so a AND b and b AND a get the same key, AND_NOT and PHRASE keep
+# their order
+def canonical_key(node):
+    if node.operator == 'TERM':
+        return node.term
+    child_keys = [child.key for child in node.children]
+    if node.operator in {'AND', 'OR', 'NEAR', 'WILDCARD'}:
+        child_keys.sort(key=repr)
+    if node.operator == 'NEAR':
+        return (f'NEAR/{node.distance}',) + tuple(child_keys)
+    return (node.operator,) + tuple(child_keys)
+
+# Function that estimates the size and cost of every node, orders the operands of the AND / OR chains
+# and computes the canonical key of every node
+# term_frequency returns the document frequency of a term and collection_size is the number of documents
+def estimate(node, term_frequency, collection_size):
+    for child in node.children:
+        estimate(child, term_frequency, collection_size)
+    node.key = canonical_key(node)
+    if node.operator == 'TERM':
+        node.size = term_frequency(node.term)
+        node.cost = node.size
+        return node
+    node.cost = sum(child.cost for child in node.children)
+    if node.operator in {'AND', 'OR'}:
+        # Intersecting the smallest lists first keeps every intermediate result as small as possible,
+        # and merging the smallest lists first keeps the doc ids copied by the pairwise unions to a minimum
+        node.children.sort(key=lambda child: child.size)
+        size = node.children[0].size
+        for child in node.children[1:]:
+            node.cost += size + child.size
+            size = min(size, child.size) if node.operator == 'AND' else min(size + child.size, collection_size)
+        node.size = size
+    elif node.operator == 'NOT':
+        node.size = max(collection_size - node.children[0].size, 0)
+        node.cost += collection_size
+    elif node.operator == 'AND_NOT':
+        node.size = node.children[0].size
+        node.cost += node.children[0].size + node.children[1].size
+    elif node.operator in {'PHRASE', 'NEAR'}:
+        # The candidates are the AND of the terms, their positions are then read one document at a time
+        node.size = min(child.size for child in node.children)
+        node.cost += node.size
+    elif node.operator == 'WILDCARD':
+        # All the lists are merged in one pass
+        node.size = min(sum(child.size for child in node.children), collection_size)
+        node.cost += sum(child.size for child in node.children)
+    return node
+
+# Function that builds the plan of a postfix expression
+def plan_query(postfix, term_frequency, collection_size):
+    return estimate(rewrite(build_tree(postfix)), term_frequency, collection_size)
+
+# Function that describes a plan as an indented tree, one line per node with its estimated size and cost
+def explain(node, depth=0):
+    label = node.term if node.operator == 'TERM' else node.operator
+    if node.operator == 'NEAR':
+        label = f'NEAR/{node.distance}'
+    elif node.operator == 'WILDCARD':
+        # Only the first terms of a wildcard are listed, there can be hundreds of them
+        terms = ' '.join(child.term for child in node.children[:EXPLAINED_TERMS])
+        if len(node.children) > EXPLAINED_TERMS:
+            terms += ' ...'
+        label = f'WILDCARD {node.term} -> {len(node.children)} terms {terms}'
+    lines = ['  ' * depth + f'{label} (size {node.size}, cost {node.cost})']
+    for child in node.children if node.operator != 'WILDCARD' else []:
+        lines.append(explain(child, depth + 1))
+    return '\n'.join(lines)
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import math
+import time
+import getopt
+
+# Per-query instrumentation of search.py
+# search.py --trace file records, for every query, the time spent parsing it (tokenizing, normalising and stemming its
+# words, expanding its wildcards), planning it and evaluating it, the postings lists read and their bytes in the
+# postings file, and every set operation with the sizes of its operands and of its result, its time, and the skips
+# and linear steps it took (gallops or skip pointers against doc ids looked at one at a time). The record of a query
+# is written as one JSON line of the trace file once the query is answered, and when the search is done a summary of
+# the trace with the 50th, 95th and 99th percentiles of these numbers is printed and written next to it. Without
+# --trace the operations module and the postings reader are used as they are, the only cost is a test per query.
+# query_trace.py -t trace-file prints the summary of a trace file and its slowest queries.
+
+PERCENTILES = (50, 95, 99)
+# Numbers of a trace record that are summarised
+FIELDS = ['seconds', 'parse_seconds', 'plan_seconds', 'evaluate_seconds', 'postings_lists', 'postings_bytes',
+          'cursors', 'operations', 'skips', 'steps', 'results']
+SLOWEST = 10
+
+def usage():
+    print("usage: " + sys.argv[0] + " -t trace-file [-n number-of-slowest-queries]")
+
+# Function that returns the p-th percentile of a sorted list of values
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+# Function that returns the path of the summary of a trace file, e.g. trace.summary.json for trace.jsonl
+def summary_path(trace_path):
+    return os.path.splitext(trace_path)[0] + '.summary.json'
+
+# Records of the queries of a search, written as JSON lines to trace_file
+# The phases of a query are not always consecutive (a batch parses and plans every query before evaluating any), so
+# select makes the record of a query the current one, and the postings read and the operations done are added to it
+# first_query is the number of the first query, for a chunk of queries searched by a worker process
+class QueryTrace:
+    def __init__(self, trace_file, first_query=0):
+        self.trace_file = trace_file
+        self.first_query = first_query
+        self.records = {}
+        self.record = None
+        self.phase = None
+        self.phase_start = 0.0
+
+    # Function that makes the record of query number i the current one and returns the trace
+    def select(self, i, query):
+        if i not in self.records:
+            self.records[i] = {'query': self.first_query + i + 1, 'text': query.strip(), 'parse_seconds': 0.0,
+                               'plan_seconds': 0.0, 'evaluate_seconds': 0.0, 'postings_lists': 0,
+                               'postings_bytes': 0, 'cursors': 0, 'skips': 0, 'steps': 0, 'operators': []}
+        self.record = self.records[i]
+        return self
+
+    # Function that calls function and adds its time to the given phase of the current query
+    def time(self, phase, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.record[phase + '_seconds'] += time.perf_counter() - start
+        return result
+
+    # Function that starts timing a phase of the current query, until finish is called
+    def start(self, phase):
+        self.phase = phase
+        self.phase_start = time.perf_counter()
+
+    # Function that completes the record of the current query with its number of results and writes it
+    def finish(self, results):
+        record = self.record
+        if self.phase is not None:
+            record[self.phase + '_seconds'] += time.perf_counter() - self.phase_start
+            self.phase = None
+        record['results'] = results
+        record['operations'] = len(record['operators'])
+        record['seconds'] = record['parse_seconds'] + record['plan_seconds'] + record['evaluate_seconds']
+        self.trace_file.write(json.dumps(record) + '\n')
+        del self.records[record['query'] - self.first_query - 1]
+        self.record = None
+
+    # The postings read outside of a query, e.g. the full doc id list read once to count the documents, are not
+    # recorded
+    def add_postings(self, length, cursor=False):
+        if self.record is not None:
+            self.record['postings_lists'] += 1
+            self.record['postings_bytes'] += length
+            self.record['cursors'] += cursor
+
+    def add_operation(self, operator, inputs, output, seconds, stats):
+        skips = stats.get('skips', 0)
+        steps = stats.get('steps', 0)
+        self.record['operators'].append({'operator': operator, 'inputs': inputs, 'output': output,
+                                         'seconds': seconds, 'skips': skips, 'steps': steps})
+        self.record['skips'] += skips
+        self.record['steps'] += steps
+
+# Operations module of search.py (postings_ops or linked_postings) whose set operations are recorded in a trace
+# The sizes of the operands and of the result are counted outside of the time of the operation
+class TracedOperations:
+    def __init__(self, operations, trace):
+        self.operations = operations
+        self.trace = trace
+
+    # from_doc_ids, to_doc_ids, count_doc_ids, ... are those of the operations module
+    def __getattr__(self, name):
+        return getattr(self.operations, name)
+
+    # Function that calls an operation on its operands, counted tells whether it takes a stats dict
+    def operation(self, operator, function, operands, counted=True):
+        stats = {}
+        start = time.perf_counter()
+        result = function(*operands, stats) if counted else function(*operands)
+        seconds = time.perf_counter() - start
+        count = self.operations.count_doc_ids
+        self.trace.add_operation(operator, [count(operand) for operand in operands], count(result), seconds, stats)
+        return result
+
+    def intersect_postings(self, p1, p2):
+        return self.operation('AND', self.operations.intersect_postings, [p1, p2])
+
+    def union_postings(self, p1, p2):
+        return self.operation('OR', self.operations.union_postings, [p1, p2], False)
+
+    def union_many(self, postings_lists):
+        return self.operation('UNION', lambda *lists: self.operations.union_many(list(lists)), postings_lists, False)
+
+    def and_not_postings(self, p1, p2):
+        return self.operation('AND_NOT', self.operations.and_not_postings, [p1, p2])
+
+    # The full doc id list is not counted as an operand, only the negated list is
+    def negate_postings(self, p, full_set):
+        return self.operation('NOT', lambda p, stats: self.operations.negate_postings(p, full_set, stats), [p])
+
+# Postings reader (PostingsReader or segments.SegmentedReader) whose postings lists read are recorded in a trace
+class TracedReader:
+    def __init__(self, reader, trace):
+        self.reader = reader
+        self.trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def read_postings(self, entry, has_skip_count=True):
+        self.trace.add_postings(self.reader.postings_length(entry))
+        return self.reader.read_postings(entry, has_skip_count)
+
+    # A cursor may stop before the end of its list, the bytes counted are those of the whole list
+    def open_cursor(self, entry, has_skip_count=True):
+        self.trace.add_postings(self.reader.postings_length(entry), cursor=True)
+        return self.reader.open_cursor(entry, has_skip_count)
+
+    def read_term_frequencies(self, entry):
+        self.trace.add_postings(self.reader.postings_length(entry))
+        return self.reader.read_term_frequencies(entry)
+
+# Function that returns the records of a trace file
+def read_trace(trace_path):
+    with open(trace_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip() != '']
+
+# Function that returns the summary of trace records: the total and the percentiles of every number of FIELDS, and
+# the count, total time and skips and steps of every operator
+def summarise(records):
+    summary = {'queries': len(records), 'fields': {}, 'operators': {}}
+    for field in FIELDS:
+        values = sorted(record[field] for record in records)
+        summary['fields'][field] = dict({'total': sum(values), 'max': values[-1] if values else 0},
+                                        **{f"p{p}": percentile(values, p) for p in PERCENTILES})
+    for record in records:
+        for operation in record['operators']:
+            operator = summary['operators'].setdefault(operation['operator'],
+                                                       {'count': 0, 'seconds': 0.0, 'skips': 0, 'steps': 0})
+            operator['count'] += 1
+            operator['seconds'] += operation['seconds']
+            operator['skips'] += operation['skips']
+            operator['steps'] += operation['steps']
+    return summary
+
+# Function that describes a summary in a few lines
+def report(summary):
+    fields = summary['fields']
+    lines = [f"trace: {summary['queries']} queries, latency p50 {1000 * fields['seconds']['p50']:.2f} ms, "
+             f"p95 {1000 * fields['seconds']['p95']:.2f} ms, p99 {1000 * fields['seconds']['p99']:.2f} ms",
+             f"  parse {fields['parse_seconds']['total']:.3f} s, plan {fields['plan_seconds']['total']:.3f} s, "
+             f"evaluate {fields['evaluate_seconds']['total']:.3f} s, {fields['postings_lists']['total']} postings "
+             f"lists read ({fields['postings_bytes']['total']} bytes, p99 {fields['postings_bytes']['p99']} "
+             f"per query), {fields['skips']['total']} skips, {fields['steps']['total']} linear steps"]
+    for operator, stats in sorted(summary['operators'].items()):
+        lines.append(f"  {operator}: {stats['count']} operations, {stats['seconds']:.3f} s, {stats['skips']} skips, "
+                     f"{stats['steps']} linear steps")
+    return '\n'.join(lines)
+
+# Function that summarises a trace file, writes its summary next to it and returns the description of the summary
+def write_summary(trace_path):
+    summary = summarise(read_trace(trace_path))
+    with open(summary_path(trace_path), 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return report(summary)
+
+def main():
+    trace_path = None
+    slowest = SLOWEST
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 't:n:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-t':
+            trace_path = a
+        elif o == '-n':
+            slowest = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if trace_path is None:
+        usage()
+        sys.exit(2)
+
+    records = read_trace(trace_path)
+    print(report(summarise(records)))
+    print("slowest queries:")
+    for record in sorted(records, key=lambda record: record['seconds'], reverse=True)[:slowest]:
+        print(f"  {record['query']}: {1000 * record['seconds']:.2f} ms, {record['postings_bytes']} bytes, "
+              f"{record['operations']} operations, {record['results']} results  {record['text']}")
+
+if __name__ == "__main__":
+    main()
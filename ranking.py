@@ -0,0 +1,178 @@
+import math
+import heapq
+from itertools import accumulate
+from postings_ops import gallop_to
+
+# Ranked retrieval
+# search.py -r scores the documents of a query with BM25 (or tf-idf) and returns the top k of them, best first.
+# The term frequencies are the numbers of positions of the terms in the documents and the document lengths are their
+# numbers of tokens, both written by index.py --positions. The documents are scored one at a time in doc id order with
+# the MaxScore algorithm: every term has an upper bound on the score it can add to a document, computed from its
+# largest term frequency and the shortest document. The terms are sorted by upper bound, and once the top k heap is
+# full, the terms whose bounds add up to less than the score of the k-th document are non-essential: a document
+# containing only them cannot enter the top k, so only the documents of the essential terms are visited, and the
+# non-essential terms are looked up by galloping (skip_to) and only while the document can still make it.
+# A Boolean query is evaluated first as a filter: only its result is scored, with the terms that are not negated.
+
+TOP_K = 10
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+class BM25:
+    def __init__(self, collection_size, average_length, k1=K1, b=B):
+        self.collection_size = collection_size
+        self.average_length = average_length or 1
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, df):
+        return math.log(1 + (self.collection_size - df + 0.5) / (df + 0.5))
+
+    def score(self, tf, length, idf):
+        return idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.average_length))
+
+class TfIdf:
+    def __init__(self, collection_size, average_length):
+        self.collection_size = collection_size
+
+    def idf(self, df):
+        return math.log10(self.collection_size / df) if df else 0.0
+
+    # The log of the term frequency, the document length is not used
+    def score(self, tf, length, idf):
+        return (1 + math.log10(tf)) * idf
+
+SCORERS = {'bm25': BM25, 'tfidf': TfIdf}
+
+# Postings of one query term with their term frequencies, walked in doc id order
+class TermCursor:
+    def __init__(self, doc_ids, frequencies, idf, upper_bound):
+        self.doc_ids = doc_ids
+        self.frequencies = frequencies
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self.position = 0
+
+    def doc_id(self):
+        return self.doc_ids[self.position] if self.position < len(self.doc_ids) else None
+
+    def next(self):
+        self.position += 1
+
+    # Function that moves the cursor to the first doc id not smaller than doc_id
+    def skip_to(self, doc_id):
+        self.position = gallop_to(self.doc_ids, doc_id, self.position)
+
+# Function that returns the terms scored for a plan: every term that is not under a NOT or the excluded side of an
+# AND_NOT, terms of phrases, NEAR and wildcards included
+def scoring_terms(node):
+    if node.operator == 'TERM':
+        return [node.term]
+    if node.operator == 'NOT':
+        return []
+    children = node.children[:1] if node.operator == 'AND_NOT' else node.children
+    terms = []
+    for child in children:
+        for term in scoring_terms(child):
+            if term not in terms:
+                terms.append(term)
+    return terms
+
+# Function that returns the cursors of the terms of a query, sorted by increasing upper bound
+# min_length is the length of the shortest document, the upper bound of a term is its score for its largest term
+# frequency in a document of that length
+def term_cursors(terms, dictionary, postings_file, scorer, min_length):
+    cursors = []
+    for term in terms:
+        entry = dictionary.get(term)
+        if entry is None:
+            continue
+        idf = scorer.idf(entry[0])
+        doc_ids, frequencies = postings_file.read_term_frequencies(entry)
+        upper_bound = scorer.score(postings_file.max_term_frequency(entry), min_length, idf)
+        cursors.append(TermCursor(doc_ids, frequencies, idf, upper_bound))
+    cursors.sort(key=lambda cursor: cursor.upper_bound)
+    return cursors
+
+# Function that returns the top k (doc id, score) pairs of the documents containing at least one of the cursors'
+# terms, best first (ties by increasing doc id)
+# accept is an optional function telling whether a doc id may be returned, e.g. whether it is in the result of the
+# Boolean filter and not deleted. With pruning False every document is scored, for comparison.
+# stats is an optional dict counting the documents scored and the postings skipped
+def top_k(cursors, document_lengths, scorer, k=TOP_K, accept=None, pruning=True, stats=None):
+    heap = []  # (score, -doc_id) of the best documents so far, the worst one first
+    threshold = 0.0
+    # bounds[i] is the sum of the upper bounds of cursors[0..i], the first essential cursor is the first whose
+    # bound sum reaches the threshold. A document scoring as much as the k-th one can still replace it if its doc id
+    # is lower, so only the bounds strictly below the threshold are pruned
+    bounds = list(accumulate(cursor.upper_bound for cursor in cursors))
+    first_essential = 0
+    scored = 0
+    while True:
+        essential = cursors[first_essential:]
+        doc_ids = [cursor.doc_id() for cursor in essential]
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id is not None]
+        if not doc_ids:
+            break
+        doc_id = min(doc_ids)
+        if accept is not None and not accept(doc_id):
+            for cursor in essential:
+                if cursor.doc_id() == doc_id:
+                    cursor.next()
+            continue
+        scored += 1
+        length = document_lengths[doc_id]
+        score = 0.0
+        for cursor in essential:
+            if cursor.doc_id() == doc_id:
+                score += scorer.score(cursor.frequencies[cursor.position], length, cursor.idf)
+                cursor.next()
+        # The non-essential terms, highest bound first, while the document can still enter the top k
+        for i in range(first_essential - 1, -1, -1):
+            if score + bounds[i] < threshold:
+                break
+            cursor = cursors[i]
+            cursor.skip_to(doc_id)
+            if cursor.doc_id() == doc_id:
+                score += scorer.score(cursor.frequencies[cursor.position], length, cursor.idf)
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -doc_id))
+        elif (score, -doc_id) > heap[0]:
+            heapq.heapreplace(heap, (score, -doc_id))
+        else:
+            continue
+        if len(heap) == k and pruning:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and bounds[first_essential] < threshold:
+                first_essential += 1
+    if stats is not None:
+        stats['scored'] = stats.get('scored', 0) + scored
+        stats['postings'] = stats.get('postings', 0) + sum(len(cursor.doc_ids) for cursor in cursors)
+    return [(-negative_doc_id, score) for score, negative_doc_id in sorted(heap, reverse=True)]
+
+# Scorer and top k settings of the ranked search, shared by all the queries of a process
+# N is the number of documents of the collection and the average and minimum lengths are those of the documents that
+# have at least one token
+class Ranker:
+    def __init__(self, postings_file, collection_size, scoring='bm25', k=TOP_K, pruning=True):
+        self.document_lengths = postings_file.document_lengths
+        if self.document_lengths is None:
+            raise ValueError("ranked retrieval needs term frequencies, build the index with index.py --positions")
+        lengths = [length for length in self.document_lengths if length]
+        self.min_length = min(lengths) if lengths else 1
+        self.scorer = SCORERS[scoring](collection_size, sum(lengths) / len(lengths) if lengths else 1)
+        self.k = k
+        self.pruning = pruning
+        self.stats = {}
+
+    # Function that returns the top k doc ids of a query, best first
+    def rank(self, terms, dictionary, postings_file, accept=None):
+        cursors = term_cursors(terms, dictionary, postings_file, self.scorer, self.min_length)
+        results = top_k(cursors, self.document_lengths, self.scorer, self.k, accept, self.pruning, self.stats)
+        return [doc_id for doc_id, _ in results]
+
+    # Function that describes the number of documents scored out of the postings of the query terms
+    def report(self):
+        return (f"ranking: {self.stats.get('scored', 0)} documents scored for "
+                f"{self.stats.get('postings', 0)} postings")
@@ -0,0 +1,152 @@
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+import postings_format
+import postings_ops
+import segments
+
+# Persistent cache of the results of the Boolean queries
+# search.py --result-cache directory keeps the doc ids of the result of every query in a file of the directory, so a
+# query asked again, by the same search or by a later one, is answered without reading any postings. The key of a
+# query is the canonical key of its plan (query_planner.canonical_key), built from its stemmed postfix expression, so
+# A AND B and b and a share one entry. The doc ids are stored in the binary postings format: gaps in variable byte
+# blocks, or a compressed bitmap for a dense result. Every index has a sub directory of its own, named after the hash
+# of the absolute path of its dictionary, so any number of indexes can share a cache directory, and its entries live
+# in a sub directory of it named after the version of the index, which combines the version stamp written by index.py
+# next to the dictionary (dictionary.version) every time it builds or changes the index with the sizes and
+# modification times of the index files, so a search on a changed index starts with an empty cache and the entries of
+# the older versions are removed. The results are cached before the deleted documents are removed from them, so
+# deleting documents does not invalidate them. The entries of an index are bounded in bytes, the least recently used
+# ones are removed first.
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+ENTRY_EXTENSION = '.result'
+
+# Function that returns the path of the version stamp of the index whose dictionary is dictionary_path
+def version_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.version'
+
+# Function that writes a new version stamp for an index, called by index.py whenever it changes the index
+# The stamp is written to a new file that is moved over the old one, so a search never reads half a stamp
+def write_version(dictionary_path):
+    path = version_path(dictionary_path)
+    with open(path + '.tmp', 'w') as f:
+        f.write(uuid.uuid4().hex + '\n')
+    os.replace(path + '.tmp', path)
+
+# Function that returns the version of an index, which changes whenever index.py rewrites it or any of its files
+# (dictionary, postings file, delta segments) changes size or modification time
+def index_version(dictionary_path, postings_path):
+    version = hashlib.sha1()
+    if os.path.exists(version_path(dictionary_path)):
+        with open(version_path(dictionary_path), 'rb') as f:
+            version.update(f.read())
+    paths = [dictionary_path, postings_path, segments.manifest_path(dictionary_path)]
+    for segment_dictionary_path, segment_postings_path in segments.read_manifest(dictionary_path):
+        paths.extend([segment_dictionary_path, segment_postings_path])
+    for path in paths:
+        if os.path.exists(path):
+            status = os.stat(path)
+            version.update(f"{path} {status.st_size} {status.st_mtime_ns}\n".encode())
+    return version.hexdigest()[:16]
+
+# Function that returns the sub directory of a cache directory holding the versions of the index whose dictionary is
+# dictionary_path
+def index_directory(directory, dictionary_path):
+    return os.path.join(directory, hashlib.sha1(os.path.abspath(dictionary_path).encode()).hexdigest()[:16])
+
+# Size bounded LRU cache of query results on disk, for one version of an index
+# directory is the sub directory of the index (index_directory), the other versions of the index found in it are
+# removed
+# Every entry is a file holding the key of its query, to tell apart two keys with the same hash, followed by the
+# encoded doc ids. Any number of search processes can share the directory: the entries are written to temporary files
+# moved into place, and an entry removed by another process is a miss. The modification time of an entry is the time it
+# was last used, and the size of the cache is that of the entries found in the directory, so max_bytes bounds the
+# entries written by all the processes together.
+class ResultCache:
+    def __init__(self, directory, version, max_bytes=MAX_CACHE_BYTES):
+        self.directory = os.path.join(directory, version)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name != version and os.path.isdir(os.path.join(directory, name)):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Function that returns the file name of the entry of a key
+    def entry_name(self, key):
+        return hashlib.sha1(repr(key).encode()).hexdigest() + ENTRY_EXTENSION
+
+    # Function that returns the entries in the directory, least recently used first, as (file name, size in bytes)
+    # An entry removed by another process while the directory is read is left out
+    def list_entries(self):
+        found = []
+        with os.scandir(self.directory) as directory_entries:
+            for entry in directory_entries:
+                if entry.name.endswith(ENTRY_EXTENSION):
+                    try:
+                        status = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((status.st_mtime_ns, entry.name, status.st_size))
+        return [(name, size) for _, name, size in sorted(found)]
+
+    # Function that returns the cached doc ids of a key, or None if the key is not cached
+    def get(self, key):
+        path = os.path.join(self.directory, self.entry_name(key))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        stored_key, _, encoded = data.partition(b'\n')
+        if stored_key != repr(key).encode():
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return postings_ops.to_doc_ids(postings_format.decode_postings(encoded))
+
+    # Function that stores the doc ids of a key, evicting the least recently used entries to stay within max_bytes
+    # The entries are listed from the directory on every store, so the entries written by the other processes sharing
+    # it are counted and evicted as well. A store only follows the evaluation of a query, which costs more.
+    def put(self, key, doc_ids):
+        data = repr(key).encode() + b'\n' + postings_format.encode_postings_by_density(doc_ids)
+        if len(data) > self.max_bytes:
+            return
+        name = self.entry_name(key)
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, os.path.join(self.directory, name))
+        entries = self.list_entries()
+        size = sum(entry_size for _, entry_size in entries)
+        for evicted_name, evicted_size in entries:
+            if size <= self.max_bytes:
+                break
+            # The entry just stored is kept even when another process used an entry after it was written
+            if evicted_name == name:
+                continue
+            size -= evicted_size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, evicted_name))
+            except FileNotFoundError:
+                pass
+
+    # Function that describes the hit rate and the content of the cache
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        entries = self.list_entries()
+        return (f"result cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {len(entries)} entries holding "
+                f"{sum(size for _, size in entries)} bytes")
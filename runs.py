@@ -0,0 +1,238 @@
+import os
+import gzip
+import errno
+import hashlib
+import shutil
+import struct
+from array import array
+from operator import sub
+from itertools import accumulate, chain
+
+# Sorted runs of the SPIMI index construction
+# index.py writes every block of its in-memory index to a run file of its own in the run directory of the index
+# (dictionary.txt -> dictionary.runs, next to the dictionary or in the directory given with index.py --temp-dir): the
+# terms of the block in term order, each with its doc id gaps and, for a positional index, its flat positions list, as
+# arrays of 32 bit integers compressed with gzip. After every run, the run directory gets a checkpoint listing the
+# runs in doc id order and the last doc id they cover, so index.py --resume continues an interrupted build after its
+# last run instead of from the first document. The runs are merged with a bounded fan in: while there are more runs
+# than the fan in, the consecutive runs holding the fewest bytes are merged into a new run and removed, and the
+# remaining runs are merged into the final files. The run directory is bounded by the temp limit (index.py
+# --temp-limit): a run growing past it is removed and the build stops with an ENOSPC OSError, the checkpoint still
+# describes the runs written before, so the build can be resumed with a larger limit or more space. The stemming memo
+# is saved to the run directory every MEMO_INTERVAL runs and when the build is interrupted.
+
+# Header of every term of a run: length of the term in bytes, number of doc ids, number of positions
+TERM_HEADER = struct.Struct('<HII')
+CHECKPOINT = 'checkpoint'
+MEMO = 'memo.stems'
+RUN_BUFFER_SIZE = 1024 * 1024
+# Number of runs between two saves of the stemming memo, which is also saved when the build is interrupted
+MEMO_INTERVAL = 16
+
+# Function that returns the run directory of the index whose dictionary is dictionary_path, in temp_dir if given
+def run_directory_path(dictionary_path, temp_dir=None):
+    root = os.path.splitext(dictionary_path)[0]
+    if temp_dir is None:
+        return root + '.runs'
+    return os.path.join(temp_dir, os.path.basename(root) + '.runs')
+
+# Function that returns the gaps between consecutive doc ids, the first doc id is its own gap
+# Small gaps compress much better than the doc ids themselves
+def gaps(doc_ids):
+    return chain(doc_ids[:1], map(sub, doc_ids[1:], doc_ids))
+
+# Writes the terms of one run, in term order
+# The bytes written are checked against the bytes left under the temp limit after every term
+class RunWriter:
+    def __init__(self, path, bytes_left=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.bytes_left = bytes_left
+        self.raw_file = open(path, 'wb', buffering=RUN_BUFFER_SIZE)
+        self.file = gzip.GzipFile(fileobj=self.raw_file, mode='wb', compresslevel=1, mtime=0)
+
+    # Function that writes one term with its doc ids and flat positions list (None for a run without positions)
+    def write_term(self, term, doc_ids, positions=None):
+        term_bytes = term.encode()
+        record = TERM_HEADER.pack(len(term_bytes), len(doc_ids), 0 if positions is None else len(positions))
+        record += term_bytes + array('i', gaps(doc_ids)).tobytes()
+        if positions is not None:
+            record += array('i', positions).tobytes()
+        self.file.write(record)
+        self.check_size()
+
+    def check_size(self):
+        if self.bytes_left is not None and self.raw_file.tell() > self.bytes_left:
+            self.file.close()
+            self.raw_file.close()
+            os.remove(self.path)
+            raise OSError(errno.ENOSPC, f"the run files would exceed the temp limit ({self.bytes_left} bytes left)",
+                          self.path)
+
+    # Function that completes the run and writes it to the disk, the number of bytes of the run is returned
+    def close(self):
+        self.file.close()
+        self.check_size()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        self.raw_file.close()
+        return os.path.getsize(self.path)
+
+# Reads the terms of a run in order, the doc ids and positions of the current term are arrays
+class RunCursor:
+    def __init__(self, path, positional=False):
+        self.raw_file = open(path, 'rb', buffering=RUN_BUFFER_SIZE)
+        self.file = gzip.GzipFile(fileobj=self.raw_file, mode='rb')
+        self.positional = positional
+        self.term = None
+        self.doc_ids = None
+        self.positions = None
+        self.advance()
+
+    # Function that moves the cursor to the next term of the run, term is None once the run has ended
+    def advance(self):
+        header = self.file.read(TERM_HEADER.size)
+        if len(header) < TERM_HEADER.size:
+            self.term = None
+            self.close()
+            return
+        term_length, count, positions_count = TERM_HEADER.unpack(header)
+        self.term = self.file.read(term_length).decode()
+        doc_id_gaps = array('i')
+        doc_id_gaps.frombytes(self.file.read(count * doc_id_gaps.itemsize))
+        self.doc_ids = array('i', accumulate(doc_id_gaps))
+        if self.positional:
+            self.positions = array('i')
+            self.positions.frombytes(self.file.read(positions_count * self.positions.itemsize))
+
+    def close(self):
+        self.file.close()
+        self.raw_file.close()
+
+# Function that writes a file to a temporary file moved over it, so that a crash leaves either the old or the new file
+def write_atomically(path, text):
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+# Function that returns the source of a build, which identifies the runs it writes: the input directory, a hash of
+# the file names of the documents indexed, the positions and the memory limit of the blocks
+# A build over another subset of the documents, or cutting its blocks at other documents, has another source
+def build_source(in_dir, filenames, positional, memory_limit):
+    documents = hashlib.sha1('\n'.join(filenames).encode()).hexdigest()[:16]
+    return f"{os.path.abspath(in_dir)} {documents} {int(positional)} {memory_limit}"
+
+# Runs of one build and its checkpoint
+# source identifies the build (see build_source), a checkpoint of another build is not resumed
+# documents, bytes_read and last_doc_id describe the documents covered by the runs
+class RunDirectory:
+    def __init__(self, path, source, temp_limit=None, resume=False):
+        self.path = path
+        self.source = source
+        self.temp_limit = temp_limit
+        self.runs = []
+        self.run_bytes = {}
+        self.next_run = 1
+        self.documents = 0
+        self.bytes_read = 0
+        self.last_doc_id = -1
+        self.resumed = resume and self.read_checkpoint()
+        if not self.resumed:
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+        else:
+            # Runs written after the checkpoint, e.g. the output of an interrupted merge, are not part of the build
+            for name in os.listdir(path):
+                if name not in self.run_bytes and name not in (CHECKPOINT, MEMO):
+                    os.remove(os.path.join(path, name))
+
+    # Function that loads the checkpoint of the run directory, False is returned if there is none for this build
+    def read_checkpoint(self):
+        checkpoint_path = os.path.join(self.path, CHECKPOINT)
+        if not os.path.exists(checkpoint_path):
+            return False
+        with open(checkpoint_path, 'r') as f:
+            fields = dict(line.split(' ', 1) for line in f.read().split('\n') if line != '')
+        if fields['source'] != self.source:
+            return False
+        self.documents = int(fields['documents'])
+        self.bytes_read = int(fields['bytes'])
+        self.last_doc_id = int(fields['last'])
+        self.next_run = int(fields['next'])
+        self.runs = fields['runs'].split()
+        self.run_bytes = {name: os.path.getsize(os.path.join(self.path, name)) for name in self.runs}
+        return True
+
+    def write_checkpoint(self):
+        lines = [f"source {self.source}", f"documents {self.documents}", f"bytes {self.bytes_read}",
+                 f"last {self.last_doc_id}", f"next {self.next_run}", "runs " + ' '.join(self.runs)]
+        write_atomically(os.path.join(self.path, CHECKPOINT), '\n'.join(lines) + '\n')
+
+    def memo_path(self):
+        return os.path.join(self.path, MEMO)
+
+    # Function that saves the memo of the normaliser to the run directory, for a resumed build to start with
+    # It is only a cache of the stems, so a resumed build with an older memo still writes the same index
+    def save_memo(self, memo):
+        memo.save(self.memo_path() + '.tmp')
+        os.replace(self.memo_path() + '.tmp', self.memo_path())
+
+    # Function that returns the bytes used in the run directory
+    def used_bytes(self):
+        used = sum(self.run_bytes.values())
+        for name in (CHECKPOINT, MEMO):
+            if os.path.exists(os.path.join(self.path, name)):
+                used += os.path.getsize(os.path.join(self.path, name))
+        return used
+
+    # Function that returns a writer for a new run
+    def create_run(self):
+        name = f"run{self.next_run}.gz"
+        self.next_run += 1
+        bytes_left = None if self.temp_limit is None else self.temp_limit - self.used_bytes()
+        return RunWriter(os.path.join(self.path, name), bytes_left)
+
+    # Function that adds the run of writer after the other runs and checkpoints the documents it covers
+    # The memo of the normaliser is saved every MEMO_INTERVAL runs, replacing it takes longer than writing a small run
+    def add_run(self, writer, documents, bytes_read, last_doc_id, memo):
+        self.run_bytes[writer.name] = writer.close()
+        self.runs.append(writer.name)
+        self.documents += documents
+        self.bytes_read += bytes_read
+        self.last_doc_id = last_doc_id
+        if self.next_run % MEMO_INTERVAL == 0:
+            self.save_memo(memo)
+        self.write_checkpoint()
+
+    # Function that returns the (start, end) of the fan_in or fewer consecutive runs to merge next, the ones with the
+    # fewest bytes among the merges that leave at most fan_in runs once repeated
+    def merge_window(self, fan_in):
+        size = min(fan_in, len(self.runs) - fan_in + 1)
+        sizes = [self.run_bytes[name] for name in self.runs]
+        start = min(range(len(sizes) - size + 1), key=lambda i: sum(sizes[i:i + size]))
+        return start, start + size
+
+    def open_cursors(self, start, end, positional=False):
+        return [RunCursor(os.path.join(self.path, name), positional) for name in self.runs[start:end]]
+
+    # Function that replaces the runs from start to end with the run of writer, their merge
+    def replace_runs(self, start, end, writer):
+        self.run_bytes[writer.name] = writer.close()
+        merged = self.runs[start:end]
+        self.runs[start:end] = [writer.name]
+        self.write_checkpoint()
+        for name in merged:
+            os.remove(os.path.join(self.path, name))
+            del self.run_bytes[name]
+
+    # Function that prepares the final files for the last merge, which appends to them
+    # The files are emptied, so neither the files of an earlier index nor those of an interrupted final merge remain
+    def start_final_merge(self, paths):
+        for path in paths:
+            open(path, 'wb').close()
+
+    # Function that removes the run directory once the build is complete
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
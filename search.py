@@ -1,405 +1,977 @@
 #!/usr/bin/python3
+import os
 import re
 import nltk
 import sys
 import getopt
-from nltk import PorterStemmer
+import io
+import math
+import asyncio
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from array import array
 from nltk.tokenize import word_tokenize
-
-class Node:
-    def __init__(self, doc_id):
-        self.doc_id = doc_id
-        self.next = None
-        self.skip = None  # Pointer to the skip node
+from postings_reader import PostingsReader
+from lexicon import Lexicon, is_lexicon
+import postings_ops
+import linked_postings
+import query_planner
+import positional
+import wildcard
+import ranking
+import postings_cursors
+from postings_cache import PostingsCache
+from result_cache import ResultCache, index_directory, index_version, MAX_CACHE_BYTES
+from normalisation import TermNormaliser, memo_path
+import segments
+import shards
+import query_trace
+from tombstones import load_tombstones
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
-
-def run_search(dict_file, postings_file, queries_file, results_file):
-    """
-    using the given dictionary file and postings file,
-    perform searching on the given queries file and output the results to a file
-    """
-    print('running search on the queries...')
-
-    """
-    Below part of the code is the declaration of the functions that will be used in the search process
-    """
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-l] [-n] [-x] [-c cache-size] [-w workers] [--max-expansions n] [-r [-k top-k] [--scoring bm25|tfidf] [--exhaustive]] [-s] [--limit n] [--trace trace-file] [--shard-servers address,address,...] [--result-cache directory [--result-cache-size bytes]]")
+
+# Function to retrieve the posting list of the full set
+# The full doc id list is written without a skip count, so every number on its line is a doc id
+def get_full_set_postings(dictionary, postings_file):
+    return postings_file.read_postings(dictionary['Full_doc_id_pointer'], has_skip_count=False)
+
+# Function of looking up for the posting list of a certain term giving the address of the term
+# The postings file is a PostingsReader, which slices the list out of the memory mapped postings file
+# The doc ids are returned as an array, which is empty if the term is not in the dictionary
+def get_postings(term, dictionary, postings_file):
+    if term in dictionary:
+        return postings_file.read_postings(dictionary[term])
+    else:
+        return array('i')
 
-    # Function to retrieve the posting list of the full set
-    def get_full_set_postings(dictionary, postings_file):
-        frequency, offset = dictionary['Full_doc_id_pointer']
-        postings_file.seek(offset)
-        posting_list_raw = postings_file.readline().split()
-        skip_count = int(posting_list_raw[0])
-        posting_list = construct_linked_list(skip_count, [int(i) for i in posting_list_raw[1:]])
-        return posting_list
-
-    # Function of looking up for the posting list of a certain term giving the address of the term
-    # The posting list is reconsctructed as a linked list with skip pointers, the head of the linked list is returned
-    def get_postings(term, dictionary, postings_file):
-        if term in dictionary:
-            frequency, offset = dictionary[term]
-            postings_file.seek(offset)
-            posting_list_raw = postings_file.readline().split()
-            if len(posting_list_raw) == 0:
-                postings_file.seek(17)
-                print(postings_file.readline())
-                posting_list_raw = postings_file.readline().split()
-            skip_count = int(posting_list_raw[0])
-            posting_list = [int(i) for i in posting_list_raw[1:]]
-            posting_linked_list = construct_linked_list(skip_count, posting_list)
-            return posting_linked_list
-        else:
-            return None
-
-    # Function of constructing a linked list from document IDs and skip count
-    def construct_linked_list(skip_count, posting_list):
-        head = None
-        current = None
-        current_skip = None
-        counter = 0  # Start counter at 0
-        for doc_id in posting_list:
-            if head is None:
-                head = Node(doc_id)
-                current = head
+# Function of searching up for the term frequency from the dictionary
+def get_term_frequency(term, dictionary):
+    if term in dictionary:
+        return dictionary[term][0]
+    else:
+        return 0
+
+# This Function uses shunting yard algorithm to convert the infix expression to postfix expression
+# A phrase (a tuple of terms) becomes its terms followed by PHRASE/n, a single word phrase is just the term
+# NEAR/k binds tighter than every other operator and only takes terms and phrases, it is output after its right operand
+def shunting_yard(infix_tokens):
+    # Define operator precedence
+    precedence = {'NOT': 3, 'AND_NOT': 3, 'AND': 2, 'OR': 1}
+    # Define which operators are binary (take two operands)
+    binary_operators = {'AND', 'OR', 'AND_NOT'}
+
+    # Output queue and operator stack
+    output_queue = []
+    operator_stack = []
+    pending_near = None
+
+    # Process each token
+    i = 0
+    while i < len(infix_tokens):
+        token = infix_tokens[i]
+        # Consider the special case of 'AND NOT' as a single operator
+        # Convert 'AND NOT' to 'AND_NOT' as a single operator to optimise the search speed
+        if token == 'AND' and i + 1 < len(infix_tokens) and infix_tokens[i + 1] == 'NOT':
+            token = 'AND_NOT'
+            i += 1  # Skip the next 'NOT' token
+
+        if positional.near_distance(token) is not None:
+            pending_near = token
+        elif token in precedence:  # Operator
+            # While there's an operator on the stack with higher precedence, pop it to the output queue
+            while (operator_stack and precedence.get(operator_stack[-1], 0) > precedence[token] and
+                   operator_stack[-1] != '('):
+                output_queue.append(operator_stack.pop())
+            operator_stack.append(token)
+        elif token == '(':  # Left parenthesis
+            operator_stack.append(token)
+        elif token == ')':  # Right parenthesis
+            # Pop operators from stack to queue until we hit the left parenthesis
+            while operator_stack and operator_stack[-1] != '(':
+                output_queue.append(operator_stack.pop())
+            operator_stack.pop()  # Remove the left parenthesis
+        else:  # Operand
+            if isinstance(token, tuple):
+                output_queue.extend(token)
+                if len(token) > 1:
+                    output_queue.append(f'PHRASE/{len(token)}')
             else:
-                current.next = Node(doc_id)
-                current = current.next
-            # Set skip pointer and reset counter when it reaches skip_count
-            if counter == skip_count and skip_count > 1:
-                if current_skip is not None:
-                    current_skip.skip = current
-                    current_skip = current
-                counter = 1  # Reset counter to 1 after setting skip to count correctly for the next skip interval
+                output_queue.append(token)
+            if pending_near is not None:
+                output_queue.append(pending_near)
+                pending_near = None
+        i += 1
+
+    # Pop any remaining operators from the stack to the queue
+    while operator_stack:
+        output_queue.append(operator_stack.pop())
+
+    # Return the postfix expression as a list of tokens
+    return output_queue
+
+# Memoising normaliser shared by all the queries of the process, load_stemming_memo warms it with the words of the index
+normaliser = TermNormaliser()
+
+# Function that loads the memo saved by index.py next to the dictionary, if there is one
+def load_stemming_memo(dict_file):
+    normaliser.load(memo_path(dict_file))
+
+# k-gram index used to expand the wildcards of the queries, set by load_wildcard_index
+wildcards = None
+
+# Function that loads the k-gram index written by index.py next to the dictionary, if there is one
+# A wildcard is expanded into at most max_expansions terms
+def load_wildcard_index(dict_file, max_expansions=wildcard.MAX_EXPANSIONS):
+    global wildcards
+    wildcards = wildcard.load_kgram_index(dict_file, max_expansions)
+
+# Function that replaces every wildcard pattern of a postfix expression with the terms it matches, followed by
+# WILDCARD/n/pattern
+def expand_wildcards(postfix):
+    expanded = []
+    for token in postfix:
+        if not wildcard.is_wildcard(token):
+            expanded.append(token)
+            continue
+        if wildcards is None:
+            raise ValueError("the index has no k-gram index, rebuild it with index.py or write it with wildcard.py")
+        terms = wildcards.expand(token)
+        expanded.extend(terms)
+        expanded.append(wildcard.expansion_token(token, len(terms)))
+    return expanded
+
+# Function that tells whether an index, every shard of it for a sharded index, has a k-gram index
+def has_kgram_index(dict_file):
+    shard_list = shards.read_manifest(dict_file)
+    dict_files = [shard_dict for shard_dict, _, _, _ in shard_list] if shard_list else [dict_file]
+    return all(os.path.exists(wildcard.kgrams_path(path)) for path in dict_files)
+
+# Function that tells whether every postings file of an index, those of its delta segments and of its shards included,
+# has the positions that phrase and NEAR queries are matched on
+def has_positional_index(dict_file, postings_file):
+    shard_list = shards.read_manifest(dict_file)
+    if shard_list:
+        return all(has_positional_index(shard_dict, shard_postings) for shard_dict, shard_postings, _, _ in shard_list)
+    for path in [postings_file] + [segment_postings for _, segment_postings in segments.read_manifest(dict_file)]:
+        reader = PostingsReader(path)
+        has_positions = reader.has_positions()
+        reader.close()
+        if not has_positions:
+            return False
+    return True
+
+# Function that returns why a query can not be answered on an index, None if it can
+# has_kgrams tells whether the index has a k-gram index to expand the wildcards of the query with, has_positions
+# whether it has the positions to match its phrases (of more than one word) and NEAR operators on
+def unsupported_query(query, has_kgrams, has_positions):
+    tokens = tokenize_query(query)
+    if not has_kgrams and any(wildcard.is_wildcard(token) for token in tokens):
+        return "the index has no k-gram index, rebuild it with index.py or write it with wildcard.py"
+    if not has_positions and any((isinstance(token, tuple) and len(token) > 1) or positional.near_distance(token)
+                                 is not None for token in positional.group_phrases(tokens) or []):
+        return "the index has no positions for phrases and NEAR, build it with index.py --positions"
+    return None
+
+def normalise_and_stem(tokens):
+    Operator = ['AND', 'OR', 'NOT', '(', ')']
+    normalised_tokens = []
+    for token in tokens:
+        if token in Operator or positional.near_distance(token) is not None:
+            normalised_tokens.append(token)
+            continue
+        if wildcard.is_wildcard(token):
+            # A pattern is only case-folded, stemming a part of a word would not give the start of its term
+            normalised_tokens.append(token.lower())
+            continue
+        if isinstance(token, tuple):
+            # The words of a phrase are normalised like single words, operator words included
+            normalised_tokens.append(tuple(normaliser.normalise(word) for word in token))
+            continue
+        # Convert to lower case and stem
+        normalised_tokens.append(normaliser.normalise(token))
+    return normalised_tokens
+
+# This function evaluates the postfix expression in parse order and computes the final search result
+# operations is the module implementing the postings representation and its set operations,
+# postings_ops (sorted arrays) by default or linked_postings (linked lists with skip pointers)
+# The final result is returned in the representation of operations
+def evaluate_postfix(postfix, dictionary, postings_file, operations=postings_ops):
+    full_set = operations.from_doc_ids(get_full_set_postings(dictionary, postings_file))
+    operand_stack = []
+    # The plan node of every operand, so that the terms of a phrase or NEAR can be matched on their positions
+    node_stack = []
+    for token in postfix:
+        if wildcard.parse_expansion_token(token) is not None:
+            # Replace the terms of the wildcard with their union
+            count = wildcard.parse_expansion_token(token)[0]
+            result = operations.union_many(operand_stack[len(operand_stack) - count:])
+            del operand_stack[len(operand_stack) - count:]
+            del node_stack[len(node_stack) - count:]
+            operand_stack.append(result)
+            node_stack.append(None)
+        elif positional.phrase_length(token) is not None or positional.near_distance(token) is not None:
+            # Replace the operands of the phrase or NEAR with its result
+            distance = positional.near_distance(token)
+            length = 2 if distance is not None else positional.phrase_length(token)
+            if distance is not None:
+                node = query_planner.PlanNode('NEAR', node_stack[-2:], distance=distance)
             else:
-                counter += 1
-            # Initialize current_skip after the first node is created to ensure the first skip starts from the head
-            if current_skip is None:
-                current_skip = head
-                counter = 1  # Start counting for skip from the first node
-        return head
-
-    # Function of searching up for the term frequency from the dictionary
-    def get_term_frequency(term, dictionary):
-        if term in dictionary:
-            return dictionary[term][0]
+                node = query_planner.PlanNode('PHRASE', node_stack[-length:])
+            del operand_stack[-length:]
+            del node_stack[-length:]
+            operand_stack.append(evaluate_positional(node, dictionary, postings_file, operations))
+            node_stack.append(node)
+        elif token not in {'AND', 'OR', 'NOT', 'AND_NOT'}:
+            # If the token is an operand, push the posting list to the stack
+            operand_stack.append(operations.from_doc_ids(get_postings(token, dictionary, postings_file)))
+            node_stack.append(query_planner.PlanNode('TERM', term=token))
         else:
-            return 0
-
-    # Function that computes the intersection of two posting lists with skip pointers
-    def intersect_postings(p1, p2):
-        dummy = Node(None)  # Dummy head to simplify insertion
-        current = dummy
-
-        while p1 and p2:
-            # If the document IDs match, add the current document ID to the result list
-            if p1.doc_id == p2.doc_id:
-                current.next = Node(p1.doc_id)
-                current = current.next
-                p1 = p1.next
-                p2 = p2.next
-            elif p1.doc_id < p2.doc_id:
-                # Use skip pointer if it's beneficial; otherwise, move to the next
-                if p1.skip and p1.skip.doc_id < p2.doc_id:
-                    while p1.skip and p1.skip.doc_id < p2.doc_id:
-                        p1 = p1.skip
-                else:
-                    p1 = p1.next
-            else:
-                # Use skip pointer if it's beneficial; otherwise, move to the next
-                if p2.skip and p2.skip.doc_id < p1.doc_id:
-                    while p2.skip and p2.skip.doc_id < p1.doc_id:
-                        p2 = p2.skip
-                else:
-                    p2 = p2.next
-        return dummy.next
-
-    # Function that computes the union of two posting lists
-    def union_postings(p1, p2):
-        dummy = Node(None)
-        current = dummy
-
-        while p1 or p2:
-            if p1 is not None and (p2 is None or p1.doc_id < p2.doc_id):
-                # p1 is the next node to add
-                current.next = Node(p1.doc_id)
-                p1 = p1.next
-            elif p2 is not None and (p1 is None or p2.doc_id < p1.doc_id):
-                # p2 is the next node to add
-                current.next = Node(p2.doc_id)
-                p2 = p2.next
-            elif p1 is not None and p2 is not None and p1.doc_id == p2.doc_id:
-                # Both p1 and p2 have the same doc_id, add either one and advance both
-                current.next = Node(p1.doc_id)
-                p1 = p1.next
-                p2 = p2.next
-
-            current = current.next
-
-        return dummy.next
-
-    # Function that computes the negation of a posting list (to the full set)
-    # This is written under the assumption that the full set is a superset of the posting list
-    def negate_postings(p, full_set):
-        dummy = Node(None)
-        current = dummy
-
-        while p or full_set:
-            # If the current document ID is in the full set but not in the posting list, add it to the result
-            if full_set and (not p or full_set.doc_id < p.doc_id):
-                current.next = Node(full_set.doc_id)
-                current = current.next
-                full_set = full_set.next
-            # If the current document ID is in both the posting list and the full set, skip both
-            elif p.doc_id == full_set.doc_id:
-                p = p.next
-                full_set = full_set.next
-            # If the current document ID is in the posting list but not in the full set, skip it
-            # However, this case should not happen because the full set should be a superset of the posting list
+            # If the token is an operator, pop the required number of operands from the stack,
+            # perform the operation, and push the result back to the stack
+            if token == 'NOT':
+                right_operand = operand_stack.pop()
+                result = operations.negate_postings(right_operand, full_set)
+            elif token == 'AND':
+                right_operand = operand_stack.pop()
+                result = operations.intersect_postings(right_operand, operand_stack.pop())
+            elif token == 'AND_NOT':
+                right_operand = operand_stack.pop()
+                result = operations.and_not_postings(operand_stack.pop(), right_operand)
+            elif token == 'OR':
+                right_operand = operand_stack.pop()
+                result = operations.union_postings(right_operand, operand_stack.pop())
+            operand_stack.append(result)
+            del node_stack[-1 if token == 'NOT' else -2:]
+            node_stack.append(None)
+    return operand_stack.pop()
+
+# Function that evaluates a PHRASE or NEAR plan node
+# The candidates are the intersection of the postings of its terms, smallest first, then the positions of the terms
+# are decoded for the candidates only
+# evaluate_term returns the postings of a term, in the representation of operations
+def evaluate_positional(node, dictionary, postings_file, operations=postings_ops, evaluate_term=None):
+    if evaluate_term is None:
+        evaluate_term = lambda term: operations.from_doc_ids(get_postings(term, dictionary, postings_file))
+    terms = sorted(set(positional.leaf_terms(node)), key=lambda term: get_term_frequency(term, dictionary))
+    candidates = evaluate_term(terms[0])
+    for term in terms[1:]:
+        if not candidates:
+            break
+        candidates = operations.intersect_postings(candidates, evaluate_term(term))
+    if not candidates:
+        return candidates
+    positions = {term: postings_file.read_positions(dictionary[term]) for term in terms}
+    return operations.from_doc_ids(positional.filter_matches(node, operations.to_doc_ids(candidates), positions))
+
+# This function evaluates a plan built by query_planner and computes the final search result
+# The operands of a chain are evaluated in the order chosen by the planner, and an AND chain or AND_NOT stops
+# as soon as its intermediate result is empty, without reading the postings of the remaining operands
+# The full doc id list is only read if the plan contains a NOT
+# cache is an optional PostingsCache shared by the queries of a batch, it keeps the decoded postings of the terms,
+# the full doc id list and the results of the sub-expressions that occur more than once in the batch
+def evaluate_plan(plan, dictionary, postings_file, operations=postings_ops, cache=None):
+    full_set = []
+
+    def evaluate(node):
+        if cache is None or not cache.is_cacheable(node):
+            return evaluate_node(node)
+        result = cache.get(node.key)
+        if result is None:
+            result = evaluate_node(node)
+            cache.put(node.key, result)
+        return result
+
+    # Function that returns the postings of a term through the cache, for the terms of phrases and NEAR
+    def evaluate_term(term):
+        node = query_planner.PlanNode('TERM', term=term)
+        node.key = term
+        return evaluate(node)
+
+    def get_full_set():
+        if cache is None:
+            return operations.from_doc_ids(get_full_set_postings(dictionary, postings_file))
+        result = cache.get('Full_doc_id_pointer')
+        if result is None:
+            result = operations.from_doc_ids(get_full_set_postings(dictionary, postings_file))
+            cache.put('Full_doc_id_pointer', result)
+        return result
+
+    def evaluate_node(node):
+        if node.operator == 'TERM':
+            return operations.from_doc_ids(get_postings(node.term, dictionary, postings_file))
+        if node.operator in {'PHRASE', 'NEAR'}:
+            # The postings of the terms go through the cache like those of any other term
+            return evaluate_positional(node, dictionary, postings_file, operations, evaluate_term)
+        if node.operator == 'WILDCARD':
+            # The postings of all the terms are merged at once
+            return operations.union_many([evaluate(child) for child in node.children])
+        if node.operator == 'NOT':
+            if not full_set:
+                full_set.append(get_full_set())
+            return operations.negate_postings(evaluate(node.children[0]), full_set[0])
+        if node.operator == 'AND_NOT':
+            kept = evaluate(node.children[0])
+            if not kept:
+                return kept
+            return operations.and_not_postings(kept, evaluate(node.children[1]))
+        result = evaluate(node.children[0])
+        for child in node.children[1:]:
+            if node.operator == 'AND':
+                if not result:
+                    break
+                result = operations.intersect_postings(result, evaluate(child))
             else:
-                p = p.next
-        return dummy.next
-
-    # Function that computes the AND NOT operation between two posting lists
-    def and_not_postings(p1, p2):
-        dummy = Node(None)
-        current = dummy
-
-        while p1 or p2:
-            # If p2 is None or p1 is not None and p1's doc_id is less than p2's doc_id
-            if p2 is None or (p1 is not None and p1.doc_id < p2.doc_id):
-                current.next = Node(p1.doc_id)
-                current = current.next
-                # If p1 has a skip pointer and it points to a doc_id that is still less than p2's doc_id
-                if p1.skip and (p2 is None or p1.skip.doc_id < p2.doc_id):
-                    p1 = p1.skip
-                else:
-                    p1 = p1.next
-            # If both p1 and p2 are not None and have the same doc_id
-            elif p1 is not None and p2 is not None and p1.doc_id == p2.doc_id:
-                p1 = p1.next
-                p2 = p2.next
-            # If p1 is None or p2's doc_id is less than p1's doc_id
-            else:
-                # If p2 has a skip pointer and it points to a doc_id that is still less than p1's doc_id
-                if p2.skip and (p1 is None or p2.skip.doc_id < p1.doc_id):
-                    p2 = p2.skip
-                else:
-                    p2 = p2.next
-        return dummy.next
-
-    # This Function uses shunting yard algorithm to convert the infix expression to postfix expression
-    def shunting_yard(infix_tokens):
-        # Define operator precedence
-        precedence = {'NOT': 3, 'AND_NOT': 3, 'AND': 2, 'OR': 1}
-        # Define which operators are binary (take two operands)
-        binary_operators = {'AND', 'OR', 'AND_NOT'}
-
-        # Output queue and operator stack
-        output_queue = []
-        operator_stack = []
-
-        # Process each token
-        i = 0
-        while i < len(infix_tokens):
-            token = infix_tokens[i]
-            # Consider the special case of 'AND NOT' as a single operator
-            # Convert 'AND NOT' to 'AND_NOT' as a single operator to optimise the search speed
-            if token == 'AND' and i + 1 < len(infix_tokens) and infix_tokens[i + 1] == 'NOT':
-                token = 'AND_NOT'
-                i += 1  # Skip the next 'NOT' token
-
-            if token in precedence:  # Operator
-                # While there's an operator on the stack with higher precedence, pop it to the output queue
-                while (operator_stack and precedence.get(operator_stack[-1], 0) > precedence[token] and
-                       operator_stack[-1] != '('):
-                    output_queue.append(operator_stack.pop())
-                operator_stack.append(token)
-            elif token == '(':  # Left parenthesis
-                operator_stack.append(token)
-            elif token == ')':  # Right parenthesis
-                # Pop operators from stack to queue until we hit the left parenthesis
-                while operator_stack and operator_stack[-1] != '(':
-                    output_queue.append(operator_stack.pop())
-                operator_stack.pop()  # Remove the left parenthesis
-            else:  # Operand
-                output_queue.append(token)
-            i += 1
-
-        # Pop any remaining operators from the stack to the queue
-        while operator_stack:
-            output_queue.append(operator_stack.pop())
-
-        # Return the postfix expression as a list of tokens
-        return output_queue
-
-    def normalise_and_stem(tokens):
-        Operator = ['AND', 'OR', 'NOT', '(', ')']
-        normalised_tokens = []
-        stemmer = PorterStemmer()
-        for token in tokens:
-            if token in Operator:
-                normalised_tokens.append(token)
-                continue
-            # Convert to lower case
-            token = token.lower()
-            # Remove stop words
-            normalised_tokens.append(stemmer.stem(token))
-        return normalised_tokens
-
-    # This function evaluates the postfix expression and computes the final search result
-    # A linked list containing the final result if returned
-    def evaluate_postfix(postfix, dictionary, postings_file):
-        full_set = get_full_set_postings(dictionary, postings_file)
-        operand_stack = []
-        for token in postfix:
-            if token not in {'AND', 'OR', 'NOT', 'AND_NOT'}:
-                # If the token is an operand, push the posting list to the stack
-                operand_stack.append(get_postings(token, dictionary, postings_file))
-            else:
-                # If the token is an operator, pop the required number of operands from the stack,
-                # perform the operation, and push the result back to the stack
-                if token == 'NOT':
-                    right_operand = operand_stack.pop()
-                    result = negate_postings(right_operand, full_set)
-                elif token == 'AND':
-                    right_operand = operand_stack.pop()
-                    result = intersect_postings(right_operand, operand_stack.pop())
-                elif token == 'AND_NOT':
-                    right_operand = operand_stack.pop()
-                    result = and_not_postings(operand_stack.pop(), right_operand)
-                elif token == 'OR':
-                    right_operand = operand_stack.pop()
-                    result = union_postings(right_operand, operand_stack.pop())
-                operand_stack.append(result)
-        return operand_stack.pop()
-
-
-    # Function that checks if the input query is valid
-    # It returns FALSE if the query is invalid, otherwise it returns TRUE
-    # Cases such as 'AND AND', 'OR OR' are examined in this function to ensure the query is valid
-    def is_valid_query(tokens):
-        # Start with expecting a term, NOT, or '('
-        expected_tokens_start = {'TERM', 'NOT', '('}
-
-        # Rules for token sequences
-        valid_next_tokens = {
-            'TERM': {'AND', 'OR', ')'},
-            'AND': {'TERM', 'NOT', '('},
-            'OR': {'TERM', 'NOT', '('},
-            'NOT': {'TERM', '('},
-            '(': {'TERM', 'NOT', '('},
-            ')': {'AND', 'OR', ')'},
-        }
-
-        accepted_tokens = {'TERM', 'AND', 'OR', 'NOT', '(', ')'}
-
-        # Convert all non-operator tokens to 'TERM'
-        parsed_tokens = ['TERM' if token not in accepted_tokens else token for token in tokens]
-
-        for i, token in enumerate(parsed_tokens):
-            if token not in expected_tokens_start:
-                # print('Query: ', tokens, ' has invalid token')
-                # print(f'Unexpected token: {token}')
-                return False  # Found an unexpected token
-
-            # Update expected tokens based on the current token
-            expected_tokens_start = valid_next_tokens.get(token, set())
-
-        if parsed_tokens[-1] in {'AND', 'OR', 'NOT'}:
-            # print('The query should not end with an operator')
+                result = operations.union_postings(result, evaluate(child))
+        return result
+
+    return evaluate(plan)
+
+# Function that builds the cursor of a plan, which produces the doc ids of its result lazily, in increasing order
+# The children of an AND are given to it in the order chosen by the planner, smallest first, so the rarest term
+# proposes the doc ids and the postings of the others are mostly skipped over
+def plan_cursor(node, dictionary, postings_file):
+    def term_cursor(term):
+        entry = dictionary.get(term)
+        return postings_file.open_cursor(entry) if entry is not None else postings_cursors.EmptyCursor()
+
+    if node.operator == 'TERM':
+        return term_cursor(node.term)
+    if node.operator in {'PHRASE', 'NEAR'}:
+        # The candidates are the AND of the terms, their positions are only read once a candidate is found
+        terms = sorted(set(positional.leaf_terms(node)), key=lambda term: get_term_frequency(term, dictionary))
+        positions = {}
+
+        def accept(doc_id):
+            if not positions:
+                positions.update((term, postings_file.read_positions(dictionary[term])) for term in terms)
+            return positional.matches(node, doc_id, positions)
+
+        return postings_cursors.FilterCursor(postings_cursors.AndCursor([term_cursor(term) for term in terms]),
+                                             accept)
+    if node.operator == 'NOT':
+        full_set = postings_file.open_cursor(dictionary['Full_doc_id_pointer'], has_skip_count=False)
+        return postings_cursors.AndNotCursor(full_set, plan_cursor(node.children[0], dictionary, postings_file))
+    children = [plan_cursor(child, dictionary, postings_file) for child in node.children]
+    if node.operator == 'AND_NOT':
+        return postings_cursors.AndNotCursor(children[0], children[1])
+    if node.operator == 'AND':
+        return postings_cursors.AndCursor(children)
+    # OR and WILDCARD
+    return postings_cursors.OrCursor(children)
+
+# Function that checks if the input query is valid
+# It returns FALSE if the query is invalid, otherwise it returns TRUE
+# Cases such as 'AND AND', 'OR OR' are examined in this function to ensure the query is valid
+# A phrase (a tuple of words) is an operand like a term, NEAR/k must be between two terms or phrases and cannot be
+# chained, e.g. a NEAR/2 b NEAR/2 c is invalid
+# A wildcard is an operand as well, but it cannot be used with NEAR or in a phrase
+def is_valid_query(tokens):
+    # Start with expecting a term, NOT, or '('
+    expected_tokens_start = {'TERM', 'WILDCARD', 'NOT', '('}
+
+    # Rules for token sequences
+    valid_next_tokens = {
+        'TERM': {'AND', 'OR', ')', 'NEAR'},
+        'WILDCARD': {'AND', 'OR', ')'},
+        'NEAR': {'NEAR_TERM'},
+        'NEAR_TERM': {'AND', 'OR', ')'},
+        'AND': {'TERM', 'WILDCARD', 'NOT', '('},
+        'OR': {'TERM', 'WILDCARD', 'NOT', '('},
+        'NOT': {'TERM', 'WILDCARD', '('},
+        '(': {'TERM', 'WILDCARD', 'NOT', '('},
+        ')': {'AND', 'OR', ')'},
+    }
+
+    accepted_tokens = {'TERM', 'AND', 'OR', 'NOT', '(', ')'}
+
+    # Convert all non-operator tokens to 'TERM', and the right operand of NEAR to 'NEAR_TERM'
+    parsed_tokens = []
+    for token in tokens:
+        if positional.near_distance(token) is not None:
+            parsed_tokens.append('NEAR')
+        elif isinstance(token, tuple) and any(wildcard.is_wildcard(word) for word in token):
             return False
-
-        return True
-
-    # Function that process the query list and write the result to the result file
-    def process_query(queries, dictionary, postings_file, results_file):
-        for query in queries:
-            infix_tokens = word_tokenize(query)
-            # Check if the query is valid
-            if not is_valid_query(infix_tokens):
-                results_file.write('\n')
-                continue
-            # Normalise and stem the tokens
-            tokens = normalise_and_stem(infix_tokens)
-            # Convert the infix expression to postfix
-            postfix = shunting_yard(tokens)
+        elif wildcard.is_wildcard(token):
+            parsed_tokens.append('WILDCARD')
+        elif isinstance(token, tuple) or token not in accepted_tokens:
+            parsed_tokens.append('NEAR_TERM' if parsed_tokens and parsed_tokens[-1] == 'NEAR' else 'TERM')
+        else:
+            parsed_tokens.append(token)
+
+    for i, token in enumerate(parsed_tokens):
+        if token not in expected_tokens_start:
+            # print('Query: ', tokens, ' has invalid token')
+            # print(f'Unexpected token: {token}')
+            return False  # Found an unexpected token
+
+        # Update expected tokens based on the current token
+        expected_tokens_start = valid_next_tokens.get(token, set())
+
+    # An empty query has no term to search for
+    if not parsed_tokens:
+        return False
+
+    if parsed_tokens[-1] in {'AND', 'OR', 'NOT', 'NEAR'}:
+        # print('The query should not end with an operator')
+        return False
+
+    return True
+
+# Tokens of a query a wildcard is never joined with
+QUERY_DELIMITERS = ('(', ')', positional.OPEN_QUOTE, positional.CLOSE_QUOTE)
+
+# Function that tokenizes a query with word_tokenize, keeping every wildcard pattern (oil*, *friso, br*so) in one token
+# word_tokenize puts every * in a token of its own, so the tokens are found back in the query and every * is joined
+# with the tokens directly next to it. A * between spaces stays a token of its own, and parentheses and the double
+# quotes of a phrase are never joined
+def tokenize_query(query):
+    tokens = word_tokenize(query)
+    joined = []
+    position = end = 0
+    for token in tokens:
+        # word_tokenize turns the double quotes of a phrase into `` and ''
+        texts = [token, '"'] if token in (positional.OPEN_QUOTE, positional.CLOSE_QUOTE) else [token]
+        starts = [(query.find(text, position), len(text)) for text in texts if query.find(text, position) >= 0]
+        if not starts:
+            return tokens
+        start, length = min(starts)
+        if (joined and start == end and (token == wildcard.WILDCARD or joined[-1].endswith(wildcard.WILDCARD))
+                and token not in QUERY_DELIMITERS and joined[-1] not in QUERY_DELIMITERS):
+            joined[-1] += token
+        else:
+            joined.append(token)
+        position = end = start + length
+    return joined
+
+# Function that parses a query into a postfix expression of normalised and stemmed terms
+# The words of a phrase, between double quotes, are followed by PHRASE/n in the postfix expression
+# None is returned if the query is invalid
+def parse_query(query):
+    infix_tokens = positional.group_phrases(tokenize_query(query))
+    # Check if the query is valid
+    if infix_tokens is None or not is_valid_query(infix_tokens):
+        return None
+    # Normalise and stem the tokens
+    tokens = normalise_and_stem(infix_tokens)
+    # Convert the infix expression to postfix, with the wildcards expanded into the terms they match
+    return expand_wildcards(shunting_yard(tokens))
+
+# Function that answers a single query with the query planner and returns its doc ids
+# An invalid query has no result, cache is an optional PostingsCache kept between queries
+# deleted is the Tombstones of the index, if documents have been deleted from it
+def search_query(query, dictionary, postings_file, collection_size, operations=postings_ops, cache=None,
+                 deleted=None):
+    postfix = parse_query(query)
+    if postfix is None:
+        return []
+    plan = query_planner.plan_query(postfix, lambda term: get_term_frequency(term, dictionary), collection_size)
+    doc_ids = operations.to_doc_ids(evaluate_plan(plan, dictionary, postings_file, operations, cache))
+    return deleted.filter(doc_ids) if deleted is not None else doc_ids
+
+# Function that tells whether the tokens of a query are free text, words and wildcards without any operator,
+# parenthesis or phrase
+def is_free_text(tokens):
+    return not any(token in ('AND', 'OR', 'NOT', '(', ')', positional.OPEN_QUOTE, positional.CLOSE_QUOTE)
+                   or positional.near_distance(token) is not None for token in tokens)
+
+# Function that returns the terms of a free text query, its wildcards expanded into the terms they match
+def free_text_terms(tokens):
+    terms = []
+    for token in normalise_and_stem(tokens):
+        for term in expand_wildcards([token]) if wildcard.is_wildcard(token) else [token]:
+            if wildcard.parse_expansion_token(term) is None and term not in terms:
+                terms.append(term)
+    return terms
+
+# Function that answers a query with the ranked search and returns its top k doc ids, best first
+# A free text query scores every document containing one of its terms. Any other query is evaluated as a Boolean
+# query first, and only the documents of its result are scored, with the terms that are not negated. The documents
+# of the result that contain none of them have a score of 0 and come last, in doc id order.
+def rank_query(query, dictionary, postings_file, ranker, collection_size, operations=postings_ops, cache=None,
+               deleted=None):
+    tokens = tokenize_query(query)
+    if is_free_text(tokens):
+        terms = free_text_terms(tokens)
+        matched = None
+    else:
+        postfix = parse_query(query)
+        if postfix is None:
+            return []
+        plan = query_planner.plan_query(postfix, lambda term: get_term_frequency(term, dictionary), collection_size)
+        terms = ranking.scoring_terms(plan)
+        matched = set(operations.to_doc_ids(evaluate_plan(plan, dictionary, postings_file, operations, cache)))
+    if matched is None:
+        accept = (lambda doc_id: doc_id not in deleted) if deleted is not None else None
+    elif deleted is not None:
+        accept = lambda doc_id: doc_id in matched and doc_id not in deleted
+    else:
+        accept = matched.__contains__
+    doc_ids = ranker.rank(terms, dictionary, postings_file, accept)
+    if matched is not None and len(doc_ids) < ranker.k:
+        ranked = set(doc_ids)
+        for doc_id in sorted(matched):
+            if len(doc_ids) == ranker.k:
+                break
+            if doc_id not in ranked and accept(doc_id):
+                doc_ids.append(doc_id)
+    return doc_ids
+
+# Function that process the query list and write the result to the result file
+# The queries are planned by query_planner unless use_planner is False, in which case they are evaluated in parse order
+# When explain_plans is True, the plan of every query is printed with its estimated sizes and costs
+# When cache_size is not 0, the whole list is evaluated as one batch: every query is planned first,
+# and the postings and the results of repeated sub-expressions are shared through a PostingsCache of cache_size doc ids
+# The deleted documents are removed from the final results only, the postings and cached sub-expressions keep them,
+# so deleting documents adds one bit test per doc id of a result and nothing per deleted document
+# ranked holds the arguments of a ranking.Ranker (scoring, k, pruning) for the ranked search, every line of the
+# result file is then the top k doc ids of its query, best first
+# When streaming is True, the queries are evaluated lazily with cursors (plan_cursor) and the doc ids are written to
+# the result file as they are found, at most limit of them per query if limit is given, in which case the evaluation
+# stops as soon as the limit is reached
+# trace is an optional query_trace.QueryTrace, the operations and the postings read by every query are then recorded
+# in it along with the time of its phases
+# result_cache is an optional result_cache.ResultCache, the results of the Boolean queries are then looked up in it
+# and stored to it under the canonical key of their plan (the streaming and ranked searches do not use it)
+def process_query(queries, dictionary, postings_file, results_file, operations=postings_ops,
+                  use_planner=True, explain_plans=False, cache_size=0, deleted=None, ranked=None, streaming=False,
+                  limit=None, trace=None, result_cache=None):
+    if trace is not None:
+        operations = query_trace.TracedOperations(operations, trace)
+        postings_file = query_trace.TracedReader(postings_file, trace)
+
+    # Function that calls function for query i, timed as the given phase of the query when it is traced
+    def traced(i, phase, function, *args):
+        if trace is None:
+            return function(*args)
+        return trace.select(i, queries[i]).time(phase, function, *args)
+
+    # The number of documents is needed by the planner to estimate the size of NOT
+    collection_size = len(get_full_set_postings(dictionary, postings_file))
+    if ranked is not None:
+        ranker = ranking.Ranker(postings_file, collection_size, **ranked)
+        # The parsing of a ranked query is traced as part of its evaluation
+        for i, query in enumerate(queries):
+            doc_ids = traced(i, 'evaluate', rank_query, query, dictionary, postings_file, ranker, collection_size,
+                             operations, None, deleted)
+            results_file.write(' '.join(str(doc_id) for doc_id in doc_ids) + '\n')
+            if trace is not None:
+                trace.finish(len(doc_ids))
+        print(ranker.report())
+        return
+    postfixes = [traced(i, 'parse', parse_query, query) for i, query in enumerate(queries)]
+    cache = None
+    if use_planner:
+        plans = [traced(i, 'plan', query_planner.plan_query, postfix,
+                        lambda term: get_term_frequency(term, dictionary), collection_size)
+                 if postfix is not None else None for i, postfix in enumerate(postfixes)]
+        if cache_size and not streaming:
+            cache = PostingsCache(cache_size, operations.count_doc_ids)
+            cache.count_expressions([plan for plan in plans if plan is not None])
+
+    for i, query in enumerate(queries):
+        if trace is not None:
+            trace.select(i, query).start('evaluate')
+        if postfixes[i] is None:
+            results_file.write('\n')
+            if trace is not None:
+                trace.finish(0)
+            continue
+        if streaming:
+            plan = plans[i] if use_planner else query_planner.build_tree(postfixes[i])
+            if explain_plans:
+                print(query.strip())
+                print(query_planner.explain(plan))
+            cursor = plan_cursor(plan, dictionary, postings_file)
+            if deleted is not None and len(deleted):
+                cursor = postings_cursors.FilterCursor(cursor, lambda doc_id: doc_id not in deleted)
+            separator = ''
+            count = 0
+            for doc_id in postings_cursors.stream(cursor, limit):
+                results_file.write(separator + str(doc_id))
+                separator = ' '
+                count += 1
+            results_file.write('\n')
+            if trace is not None:
+                trace.finish(count)
+            # The cursors hold slices of the memory mapped postings file, which cannot be closed while they exist
+            del cursor
+            continue
+        doc_ids = None
+        if result_cache is not None:
+            key = (plans[i] if use_planner else query_planner.plan_query(
+                postfixes[i], lambda term: get_term_frequency(term, dictionary), collection_size)).key
+            doc_ids = result_cache.get(key)
+        if doc_ids is None:
             # Evaluate the postfix expression to get the final result
-            result = evaluate_postfix(postfix, dictionary, postings_file)
-            # Write the result to the result file
-            if result:
-                doc_ids = []
-                current_node = result
-                while current_node:
-                    doc_ids.append(str(current_node.doc_id))
-                    current_node = current_node.next
-                results_file.write(' '.join(doc_ids) + '\n')
+            if use_planner:
+                if explain_plans:
+                    print(query.strip())
+                    print(query_planner.explain(plans[i]))
+                result = evaluate_plan(plans[i], dictionary, postings_file, operations, cache)
             else:
-                results_file.write('\n')
-
-    # Function to read term, frequency and offset from a line in dictionary
-    def read_dictionary_line(line):
-        # Split the line by space to get term, frequency and offset
-        term, frequency, offset = line.split(' ')
-        term = term.strip()  # Remove leading/trailing white spaces
-        frequency = frequency.strip()  # Remove leading/trailing white spaces
-        offset = offset.strip()  # Remove leading/trailing white spaces
-
-        # Convert frequency and offset from strings to integers
-        frequency = int(frequency)
-        offset = int(offset)
-
-        return term, frequency, offset
+                result = evaluate_postfix(postfixes[i], dictionary, postings_file, operations)
+            doc_ids = operations.to_doc_ids(result)
+            if result_cache is not None:
+                result_cache.put(key, doc_ids)
+        # Write the result to the result file
+        if deleted is not None:
+            doc_ids = deleted.filter(doc_ids)
+        results_file.write(' '.join(str(doc_id) for doc_id in doc_ids) + '\n')
+        if trace is not None:
+            trace.finish(len(doc_ids))
+
+    if cache is not None:
+        print(cache.report())
+    if result_cache is not None:
+        print(result_cache.report())
+
+# Function to read term, frequency, offset and (for binary postings) length from a line in dictionary
+def read_dictionary_line(line):
+    # Split the line by space to get term, frequency, offset and the optional length
+    term, frequency, *pointers = line.split(' ')
+    term = term.strip()  # Remove leading/trailing white spaces
+    frequency = frequency.strip()  # Remove leading/trailing white spaces
+
+    # Convert frequency, offset and length from strings to integers
+    frequency = int(frequency)
+    pointers = tuple(int(pointer.strip()) for pointer in pointers)
+
+    return term, frequency, pointers
+
+# Function that reconstructs the dictionary from the file into memory
+# A binary lexicon written by index.py is memory mapped instead, it is looked up like the dict
+def load_dictionary(dict_file):
+    if is_lexicon(dict_file):
+        return Lexicon(dict_file)
+    dictionary = {}
+    with open(dict_file, 'r') as df:
+        dictionary_raw = df.read().split('\n')
+    for line in dictionary_raw:
+        if line != '':
+            term, frequency, pointers = read_dictionary_line(line)
+            dictionary[term] = (frequency,) + pointers
+    return dictionary
+
+# Function that opens the dictionary and the postings file of an index
+# When index.py -a has added delta segments to the index, they are opened as well and searched together with it
+# A lexicon given as the dictionary file is used for the delta segments too
+def open_index(dict_file, postings_file):
+    dictionary = load_dictionary(dict_file)
+    reader = PostingsReader(postings_file)
+    delta_segments = segments.read_manifest(dict_file)
+    if not delta_segments:
+        return dictionary, reader
+    use_lexicon = isinstance(dictionary, Lexicon)
+    dictionaries = [dictionary]
+    readers = [reader]
+    for segment_dict_file, segment_postings_file in delta_segments:
+        if use_lexicon:
+            segment_dict_file = os.path.splitext(segment_dict_file)[0] + '.lex'
+        dictionaries.append(load_dictionary(segment_dict_file))
+        readers.append(PostingsReader(segment_postings_file))
+    return segments.SegmentedDictionary(dictionaries), segments.SegmentedReader(readers)
+
+# Dictionary and postings reader of a worker process of the parallel search, set up once per worker by init_worker
+worker_state = {}
+
+# result_cache_args are the arguments of the result_cache.ResultCache the worker opens, if there is one: every worker
+# keeps its cache for all its chunks and the workers share its directory
+def init_worker(dict_file, postings_file, max_expansions=wildcard.MAX_EXPANSIONS, result_cache_args=None):
+    worker_state['dictionary'], worker_state['postings_file'] = open_index(dict_file, postings_file)
+    worker_state['deleted'] = load_tombstones(dict_file)
+    worker_state['result_cache'] = ResultCache(*result_cache_args) if result_cache_args is not None else None
+    load_stemming_memo(dict_file)
+    load_wildcard_index(dict_file, max_expansions)
+
+# Function that runs in a worker process and returns the results of a chunk of queries as the text of the result file
+# The operations module is passed by name because modules can not be sent to another process
+# When first_query is given, the queries are traced as well, numbered from first_query, and the lines of their trace
+# are returned with the results
+def search_chunk(queries, operations_name, use_planner, explain_plans, cache_size, ranked=None, streaming=False,
+                 limit=None, first_query=None):
+    results = io.StringIO()
+    trace_lines = io.StringIO()
+    trace = query_trace.QueryTrace(trace_lines, first_query) if first_query is not None else None
+    process_query(queries, worker_state['dictionary'], worker_state['postings_file'], results,
+                  importlib.import_module(operations_name), use_planner, explain_plans, cache_size,
+                  worker_state['deleted'], ranked, streaming, limit, trace, worker_state['result_cache'])
+    return results.getvalue(), trace_lines.getvalue()
+
+# Function that runs in a worker process and returns the lines of the results of the queries on one shard of a sharded
+# index, the shard is opened like any other index with its own memo, k-gram index and deleted documents
+def search_shard(shard_dict, shard_postings, queries, operations_name, use_planner, cache_size, streaming, limit,
+                 max_expansions=wildcard.MAX_EXPANSIONS):
+    dictionary, pf = open_index(shard_dict, shard_postings)
+    load_stemming_memo(shard_dict)
+    load_wildcard_index(shard_dict, max_expansions)
+    results = io.StringIO()
+    process_query(queries, dictionary, pf, results, importlib.import_module(operations_name), use_planner, False,
+                  cache_size, load_tombstones(shard_dict), None, streaming, limit)
+    pf.close()
+    return results.getvalue().split('\n')[:len(queries)]
+
+# Function that sends the queries to the search_server.py serving one shard and returns the lines of its answers
+# The address is host:port, or the path of a unix socket. The queries are all sent ahead of the answers, which the
+# server writes in query order, and the answers are read while the queries are being sent
+# Start of the line search_server.py answers a query with when the query fails, followed by the error
+SERVER_ERROR = 'error '
+
+async def search_shard_server(address, queries):
+    if ':' in address and '/' not in address:
+        host, port = address.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    else:
+        reader, writer = await asyncio.open_unix_connection(address)
 
-    """ 
-    Below part of the code is the main part of the function that executes the search
+    async def send_queries():
+        for query in queries:
+            writer.write((query.strip() + '\n').encode())
+            await writer.drain()
+
+    sender = asyncio.create_task(send_queries())
+    lines = [(await reader.readline()).decode() for _ in queries]
+    await sender
+    writer.close()
+    await writer.wait_closed()
+    return lines
+
+async def search_shard_servers(addresses, queries):
+    return await asyncio.gather(*[search_shard_server(address, queries) for address in addresses])
+
+# Function that answers the queries on a sharded index (see shards.py) as the coordinator of its shards
+# Every shard evaluates all the queries, in a pool of worker processes (one per shard by default) or, when
+# shard_servers is given, on the search_server.py serving each shard, listed in the order of the shards. The result
+# of a query is the concatenation of its results on the shards, in shard order, which is doc id order. The documents
+# deleted from the sharded index as a whole (tombstones.py -d dictionary-file) are removed from it as well.
+def run_sharded_search(shard_list, dict_file, queries, results_file, operations=postings_ops, use_planner=True,
+                       cache_size=0, workers=1, max_expansions=wildcard.MAX_EXPANSIONS, streaming=False, limit=None,
+                       shard_servers=None):
+    if shard_servers:
+        if len(shard_servers) != len(shard_list):
+            raise ValueError(f"the index has {len(shard_list)} shards but {len(shard_servers)} shard servers are given")
+        shard_results = asyncio.run(search_shard_servers(shard_servers, queries))
+    else:
+        with ProcessPoolExecutor(workers if workers > 1 else len(shard_list)) as executor:
+            futures = [executor.submit(search_shard, shard_dict, shard_postings, queries, operations.__name__,
+                                       use_planner, cache_size, streaming, limit, max_expansions)
+                       for shard_dict, shard_postings, _, _ in shard_list]
+            shard_results = [future.result() for future in futures]
+    deleted = load_tombstones(dict_file)
+    for i in range(len(queries)):
+        # A query failing on a shard server has no result, as the result of the other shards is not complete
+        errors = [(address, lines[i]) for address, lines in zip(shard_servers or [], shard_results)
+                  if lines[i].startswith(SERVER_ERROR)]
+        if errors:
+            for address, error in errors:
+                print(f'query {i + 1} failed on shard server {address}: {error[len(SERVER_ERROR):].strip()}')
+            results_file.write('\n')
+            continue
+        line = shards.concatenate_results(lines[i] for lines in shard_results)
+        if deleted is not None or limit is not None:
+            doc_ids = [int(doc_id) for doc_id in line.split()]
+            if deleted is not None:
+                doc_ids = deleted.filter(doc_ids)
+            line = ' '.join(str(doc_id) for doc_id in doc_ids[:limit]) + '\n'
+        results_file.write(line)
+
+def run_search(dict_file, postings_file, queries_file, results_file, operations=postings_ops,
+               use_planner=True, explain_plans=False, cache_size=0, workers=1,
+               max_expansions=wildcard.MAX_EXPANSIONS, ranked=None, streaming=False, limit=None, trace_file=None,
+               shard_servers=None, result_cache_dir=None, result_cache_size=MAX_CACHE_BYTES):
     """
+    using the given dictionary file and postings file,
+    perform searching on the given queries file and output the results to a file
+    """
+    print('running search on the queries...')
+
     # Read in the queries
     qf = open(queries_file, 'r')
     queries = qf.readlines()
 
-    # Reconstructing the dictionary from the file into memory
-    dictionary = {}
-    df = open(dict_file, 'r')
-    dictionary_raw = df.read().split('\n')
-    for line in dictionary_raw:
-        if line != '':
-            term, frequency, offset = read_dictionary_line(line)
-            dictionary[term] = (frequency, offset)
+    # A query the index can not answer, a wildcard without a k-gram index or a phrase or NEAR without positions, has
+    # no result and the other queries are still answered. A shard server checks its own shard and answers such a query
+    # with an error.
+    if not shard_servers:
+        has_kgrams, has_positions = has_kgram_index(dict_file), has_positional_index(dict_file, postings_file)
+        for i, query in enumerate(queries):
+            reason = unsupported_query(query, has_kgrams, has_positions)
+            if reason is not None:
+                print(f'query {i + 1} has no result: {reason}')
+                queries[i] = '\n'
+
+    # A sharded index is searched through its shards, the ranked search would need the statistics of the whole
+    # collection and is not supported on it
+    shard_list = shards.read_manifest(dict_file)
+    if shard_list:
+        if ranked is not None or trace_file is not None or result_cache_dir is not None:
+            raise ValueError("ranked retrieval, --trace and --result-cache are not supported on a sharded index")
+        with open(results_file, 'w') as rf:
+            run_sharded_search(shard_list, dict_file, queries, rf, operations, use_planner, cache_size, workers,
+                               max_expansions, streaming, limit, shard_servers)
+        return
 
     # Create a file to write the results
     rf = open(results_file, 'w')
-    pf = open(postings_file, 'r')
-
-    # Process the queries and write to the result file
-    process_query(queries, dictionary, pf, rf)
-
-
-
+    # The trace of the queries, written by query_trace when trace_file is given
+    tf = open(trace_file, 'w') if trace_file is not None else None
+    # The results cached on disk are those of the current version of the index
+    result_cache_args = None
+    if result_cache_dir is not None:
+        result_cache_args = (index_directory(result_cache_dir, dict_file), index_version(dict_file, postings_file),
+                             result_cache_size)
+
+    if workers > 1:
+        # The queries are split into chunks, a few per worker so that a chunk of slow queries does not hold up the rest
+        # Every worker loads the dictionary and maps the postings file once, map returns the results in query order
+        chunk_size = max(1, math.ceil(len(queries) / (workers * 4)))
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(dict_file, postings_file, max_expansions, result_cache_args)) as executor:
+            first_queries = [i * chunk_size if tf is not None else None for i in range(len(chunks))]
+            for results, trace_lines in executor.map(search_chunk, chunks, [operations.__name__] * len(chunks),
+                                                     [use_planner] * len(chunks), [explain_plans] * len(chunks),
+                                                     [cache_size] * len(chunks), [ranked] * len(chunks),
+                                                     [streaming] * len(chunks), [limit] * len(chunks),
+                                                     first_queries):
+                rf.write(results)
+                if tf is not None:
+                    tf.write(trace_lines)
+        rf.close()
+        if tf is not None:
+            tf.close()
+            print(query_trace.write_summary(trace_file))
+        return
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
+    # Reconstructing the dictionary from the file into memory
+    # The postings file is memory mapped, the reader detects whether it is in the ASCII or the binary format
+    dictionary, pf = open_index(dict_file, postings_file)
+    load_stemming_memo(dict_file)
+    load_wildcard_index(dict_file, max_expansions)
+    # Bitmap of the documents deleted with tombstones.py
+    deleted = load_tombstones(dict_file)
 
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    # Process the queries and write to the result file
+    process_query(queries, dictionary, pf, rf, operations, use_planner, explain_plans, cache_size, deleted, ranked,
+                  streaming, limit, query_trace.QueryTrace(tf) if tf is not None else None,
+                  ResultCache(*result_cache_args) if result_cache_args is not None else None)
+    rf.close()
+    pf.close()
+    if tf is not None:
+        tf.close()
+        print(query_trace.write_summary(trace_file))
+    print(normaliser.report())
+    if wildcards is not None and wildcards.expansions:
+        print(wildcards.report())
+
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = file_of_queries = file_of_output = None
+    # -l evaluates the queries with the linked list reference implementation instead of the arrays
+    operations = postings_ops
+    # -n evaluates the queries in parse order without the query planner, -x prints the plan of every query
+    use_planner = True
+    explain_plans = False
+    # -c evaluates the queries as one batch sharing a cache of the given number of doc ids
+    cache_size = 0
+    # -w / --workers splits the queries across a pool of the given number of processes
+    workers = 1
+    # --max-expansions is the largest number of terms a wildcard is expanded into
+    max_expansions = wildcard.MAX_EXPANSIONS
+    # -r ranks the results and keeps the -k best ones, scored with --scoring, --exhaustive scores every document
+    # instead of pruning with MaxScore
+    ranked = None
+    top_k = ranking.TOP_K
+    scoring = 'bm25'
+    pruning = True
+    # -s evaluates the queries lazily with cursors and writes the doc ids as they are found, --limit keeps the first
+    # n doc ids of every query and stops evaluating it there
+    streaming = False
+    limit = None
+    # --trace writes a record of every query to the given JSON lines file and prints a summary of them
+    trace_file = None
+    # --shard-servers searches a sharded index through the search_server.py of each of its shards
+    shard_servers = None
+    # --result-cache keeps the results of the queries in the given directory, at most --result-cache-size bytes of them
+    result_cache_dir = None
+    result_cache_size = MAX_CACHE_BYTES
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:lnxc:w:rk:s',
+                                   ['workers=', 'max-expansions=', 'scoring=', 'exhaustive', 'limit=', 'trace=',
+                                    'shard-servers=', 'result-cache=', 'result-cache-size='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-l':
+            operations = linked_postings
+        elif o == '-n':
+            use_planner = False
+        elif o == '-x':
+            explain_plans = True
+        elif o == '-c':
+            cache_size = int(a)
+        elif o in ('-w', '--workers'):
+            workers = int(a)
+        elif o == '--max-expansions':
+            max_expansions = int(a)
+        elif o == '-r':
+            ranked = {}
+        elif o == '-k':
+            top_k = int(a)
+        elif o == '--scoring':
+            scoring = a
+        elif o == '--exhaustive':
+            pruning = False
+        elif o == '-s':
+            streaming = True
+        elif o == '--limit':
+            streaming = True
+            limit = int(a)
+        elif o == '--trace':
+            trace_file = a
+        elif o == '--shard-servers':
+            shard_servers = a.split(',')
+        elif o == '--result-cache':
+            result_cache_dir = a
+        elif o == '--result-cache-size':
+            result_cache_size = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
+        usage()
+        sys.exit(2)
+
+    if ranked is not None:
+        if scoring not in ranking.SCORERS or top_k < 1:
+            usage()
+            sys.exit(2)
+        ranked = {'scoring': scoring, 'k': top_k, 'pruning': pruning}
+
+    # The ranked search, --trace and --result-cache are not supported on a sharded index, and a sharded index
+    # searched on shard servers needs one server per shard
+    shard_list = shards.read_manifest(dictionary_file)
+    if shard_list and (ranked is not None or trace_file is not None or result_cache_dir is not None
+                       or (shard_servers and len(shard_servers) != len(shard_list))):
+        usage()
+        sys.exit(2)
+
+    # The ranked search scores the documents with the term frequencies stored with the positions
+    if ranked is not None and not has_positional_index(dictionary_file, postings_file):
+        print("ranked retrieval needs term frequencies, build the index with index.py --positions")
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, operations, use_planner, explain_plans,
+               cache_size, workers, max_expansions, ranked, streaming, limit, trace_file, shard_servers,
+               result_cache_dir, result_cache_size)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import getopt
+import asyncio
+import tempfile
+import subprocess
+from search import SERVER_ERROR
+
+# Client of search_server.py
+# Sends every query of the queries file to the server and writes the answers to the results file in query order.
+# The queries the server failed to answer are printed with their error and get an empty line in the results file.
+# With -b, the latency of every query is measured instead, once through the server and once through a cold run of
+# search.py (which loads the dictionary for that single query), and a summary of both is printed.
+
+def usage():
+    print("usage: " + sys.argv[0] + " -q file-of-queries [-o output-file-of-results] [-H host] [-P port]"
+          " [-u unix-socket] [-k clients] [-b -d dictionary-file -p postings-file [-n cold-queries]]")
+
+async def connect(host, port, unix_socket):
+    if unix_socket is not None:
+        return await asyncio.open_unix_connection(unix_socket)
+    return await asyncio.open_connection(host, port)
+
+# Function that sends queries over one connection, one at a time, and returns the answers and the latency of each
+async def send_queries(queries, host, port, unix_socket):
+    reader, writer = await connect(host, port, unix_socket)
+    answers = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        writer.write((query.strip() + '\n').encode())
+        await writer.drain()
+        answers.append((await reader.readline()).decode())
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+    return answers, latencies
+
+# Function that spreads the queries over the given number of concurrent connections
+# The answers are returned in query order
+async def send_all(queries, host, port, unix_socket, clients):
+    chunk_size = -(-len(queries) // clients) or 1
+    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+    replies = await asyncio.gather(*[send_queries(chunk, host, port, unix_socket) for chunk in chunks])
+    answers = [answer for chunk_answers, _ in replies for answer in chunk_answers]
+    latencies = [latency for _, chunk_latencies in replies for latency in chunk_latencies]
+    return answers, latencies
+
+# Function that measures the latency of answering each query with a fresh search.py process
+def cold_latencies(queries, dict_file, postings_file):
+    search_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search.py')
+    latencies = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        query_path = os.path.join(temp_dir, 'query.txt')
+        result_path = os.path.join(temp_dir, 'result.txt')
+        for query in queries:
+            with open(query_path, 'w') as query_file:
+                query_file.write(query)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, search_script, '-d', dict_file, '-p', postings_file,
+                            '-q', query_path, '-o', result_path], check=True, stdout=subprocess.DEVNULL)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+# Function that describes a list of latencies in milliseconds
+def summarise(name, latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return f'{name}: no queries'
+
+    def percentile(p):
+        return 1000 * latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    mean = 1000 * sum(latencies) / len(latencies)
+    return (f'{name}: {len(latencies)} queries, mean {mean:.2f} ms, p50 {percentile(50):.2f} ms, '
+            f'p95 {percentile(95):.2f} ms, max {1000 * latencies[-1]:.2f} ms')
+
+def main():
+    file_of_queries = file_of_output = dictionary_file = postings_file = unix_socket = None
+    host = '127.0.0.1'
+    port = 8765
+    clients = 1
+    benchmark = False
+    cold_queries = 10
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'q:o:H:P:u:k:bd:p:n:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-H':
+            host = a
+        elif o == '-P':
+            port = int(a)
+        elif o == '-u':
+            unix_socket = a
+        elif o == '-k':
+            clients = int(a)
+        elif o == '-b':
+            benchmark = True
+        elif o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            cold_queries = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if file_of_queries is None or (benchmark and (dictionary_file is None or postings_file is None)):
+        usage()
+        sys.exit(2)
+
+    with open(file_of_queries, 'r') as qf:
+        queries = qf.readlines()
+
+    answers, latencies = asyncio.run(send_all(queries, host, port, unix_socket, clients))
+    # A failed query is reported and gets an empty line in the results file
+    failed = 0
+    for i, answer in enumerate(answers):
+        if answer.startswith(SERVER_ERROR):
+            print(f'query {i + 1} failed: {answer[len(SERVER_ERROR):].strip()}')
+            answers[i] = '\n'
+            failed += 1
+    if file_of_output is not None:
+        with open(file_of_output, 'w') as rf:
+            rf.writelines(answers)
+
+    if benchmark:
+        print(summarise('server', latencies))
+        print(summarise('cold search.py', cold_latencies(queries[:cold_queries], dictionary_file, postings_file)))
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
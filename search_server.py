@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+import os
+import sys
+import getopt
+import asyncio
+import search
+from concurrent.futures import ThreadPoolExecutor
+from postings_cache import PostingsCache
+from tombstones import load_tombstones, bitmap_path
+
+# Long running search server
+# The dictionary is loaded and the postings file is memory mapped once when the server starts, and every query sent
+# to the server is answered with the same parse, plan and evaluate pipeline as search.py.
+# Protocol: the client sends one query per line, the server answers every line with one line holding the doc ids
+# of the result separated by spaces (an empty line if there is no result), the same as a line of the results file,
+# or with "error " followed by the error if the query failed.
+# Lines are answered in the order they were received on a connection, any number of clients can be connected.
+# The queries are evaluated one at a time in a worker thread, so the event loop keeps accepting connections and
+# reading and writing lines while a query is evaluated, but the queries of concurrent clients wait for each other.
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-H host] [-P port] [-u unix-socket]"
+          " [-c cache-size]")
+
+# Warm index shared by all the connections of the server
+class SearchIndex:
+    def __init__(self, dict_file, postings_file, cache_size=0):
+        self.dictionary, self.postings_file = search.open_index(dict_file, postings_file)
+        search.load_stemming_memo(dict_file)
+        search.load_wildcard_index(dict_file)
+        self.dict_file = dict_file
+        self.deleted = None
+        self.deleted_version = None
+        self.reload_deleted()
+        self.collection_size = len(search.get_full_set_postings(self.dictionary, self.postings_file))
+        # Only the decoded postings of the terms and the full doc id list are kept between queries
+        self.cache = PostingsCache(cache_size) if cache_size else None
+
+    # Function that reloads the bitmap of the deleted documents when tombstones.py has changed it
+    def reload_deleted(self):
+        try:
+            status = os.stat(bitmap_path(self.dict_file))
+            version = (status.st_ino, status.st_mtime_ns)
+        except FileNotFoundError:
+            version = None
+        if version != self.deleted_version:
+            self.deleted = load_tombstones(self.dict_file)
+            self.deleted_version = version
+
+    def search(self, query):
+        self.reload_deleted()
+        return search.search_query(query, self.dictionary, self.postings_file, self.collection_size,
+                                   cache=self.cache, deleted=self.deleted)
+
+# Function that answers one line of the protocol, the error of a failed query is answered instead of its result
+def answer_query(index, line):
+    try:
+        doc_ids = index.search(line.decode().strip())
+    except Exception as e:
+        return search.SERVER_ERROR + ' '.join(f'{type(e).__name__}: {e}'.split()) + '\n'
+    return ' '.join(str(doc_id) for doc_id in doc_ids) + '\n'
+
+# Function that answers the queries of one connection until the client closes it
+async def handle_client(index, executor, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            answer = await loop.run_in_executor(executor, answer_query, index, line)
+            writer.write(answer.encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(index, host, port, unix_socket):
+    # A single thread, as the postings cache and the memo of the index are not shared safely between threads
+    executor = ThreadPoolExecutor(max_workers=1)
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(lambda r, w: handle_client(index, executor, r, w), path=unix_socket)
+    else:
+        server = await asyncio.start_server(lambda r, w: handle_client(index, executor, r, w), host, port)
+    print('search server listening on ' + (unix_socket or f'{host}:{port}'))
+    async with server:
+        await server.serve_forever()
+
+def main():
+    dictionary_file = postings_file = unix_socket = None
+    host = '127.0.0.1'
+    port = 8765
+    cache_size = 0
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:H:P:u:c:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-H':
+            host = a
+        elif o == '-P':
+            port = int(a)
+        elif o == '-u':
+            unix_socket = a
+        elif o == '-c':
+            cache_size = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file is None or postings_file is None:
+        usage()
+        sys.exit(2)
+
+    index = SearchIndex(dictionary_file, postings_file, cache_size)
+    try:
+        asyncio.run(serve(index, host, port, unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+from array import array
+import postings_ops
+import postings_format
+import postings_cursors
+from bitmap_postings import RoaringBitmap
+
+# Delta segments of an incremental index
+# index.py -a indexes the documents that are not in the index yet into a delta segment, a dictionary and a postings
+# file of their own written next to the base index. The delta segments of a base index are listed, oldest first,
+# in its manifest (dictionary.txt -> dictionary.segments), one line per segment with the names of its dictionary
+# file and postings file. search.py opens the base index and its delta segments together: the entry of a term holds
+# the entries of every segment containing it and its postings are the union of theirs, so the segments can be
+# searched as one index. index.py --compact merges the delta segments back into the base index.
+
+# Function that returns the path of the manifest of the index whose dictionary is dictionary_path
+def manifest_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.segments'
+
+# Function that returns the (dictionary, postings) paths of the delta segments of an index, oldest first
+def read_manifest(dictionary_path):
+    path = manifest_path(dictionary_path)
+    if not os.path.exists(path):
+        return []
+    directory = os.path.dirname(path)
+    segments = []
+    with open(path, 'r') as manifest:
+        for line in manifest.read().split('\n'):
+            if line != '':
+                dictionary_name, postings_name = line.split(' ')
+                segments.append((os.path.join(directory, dictionary_name), os.path.join(directory, postings_name)))
+    return segments
+
+# Function that adds a delta segment to the manifest of an index
+# The segment files are stored by name, they are always next to the manifest
+def add_to_manifest(dictionary_path, segment_dictionary_path, segment_postings_path):
+    with open(manifest_path(dictionary_path), 'a') as manifest:
+        manifest.write(f"{os.path.basename(segment_dictionary_path)} {os.path.basename(segment_postings_path)}\n")
+
+# Function that returns the paths of the dictionary and postings file of the next delta segment of an index,
+# e.g. dictionary.delta2.txt and postings.delta2.txt
+def next_segment_paths(dictionary_path, postings_path):
+    number = len(read_manifest(dictionary_path)) + 1
+    dictionary_root, dictionary_extension = os.path.splitext(dictionary_path)
+    postings_root, postings_extension = os.path.splitext(postings_path)
+    return (f"{dictionary_root}.delta{number}{dictionary_extension}",
+            f"{postings_root}.delta{number}{postings_extension}")
+
+# Function that returns every file written by index.py for one segment, the lexicon, stemming memo, k-gram index,
+# positions and document lengths included
+def segment_files(dictionary_path, postings_path):
+    root = os.path.splitext(dictionary_path)[0]
+    return [dictionary_path, postings_path, root + '.lex', root + '.stems', root + '.kgrams',
+            postings_format.positions_path(postings_path), postings_format.lengths_path(postings_path)]
+
+# Function that removes the delta segments of an index and its manifest
+def remove_segments(dictionary_path):
+    for segment_dictionary_path, segment_postings_path in read_manifest(dictionary_path):
+        for path in segment_files(segment_dictionary_path, segment_postings_path):
+            if os.path.exists(path):
+                os.remove(path)
+    if os.path.exists(manifest_path(dictionary_path)):
+        os.remove(manifest_path(dictionary_path))
+
+# Function that combines the postings of one term in several segments
+# The lists are never empty, a segment only has an entry for the terms of its documents
+# Segments usually hold increasing doc id ranges, so their lists are simply concatenated, otherwise they are merged
+def merge_segment_postings(parts):
+    if len(parts) == 1:
+        return parts[0]
+    if any(isinstance(part, RoaringBitmap) for part in parts):
+        merged = parts[0]
+        for part in parts[1:]:
+            merged = postings_ops.union_postings(merged, part)
+        return merged
+    if all(parts[i - 1][-1] < parts[i][0] for i in range(1, len(parts))):
+        merged = array('i')
+        for part in parts:
+            merged.extend(part)
+        return merged
+    members = set()
+    for part in parts:
+        members.update(part)
+    return array('i', sorted(members))
+
+# Dictionary of a base index and its delta segments, looked up like the dictionary dict of search.py
+# The entry of a term is its document frequency in all the segments, followed by the tuple of its entry in every
+# segment (None for the segments that do not contain it)
+class SegmentedDictionary:
+    def __init__(self, dictionaries):
+        self.dictionaries = dictionaries
+
+    def get(self, term, default=None):
+        entries = tuple(dictionary.get(term) for dictionary in self.dictionaries)
+        if all(entry is None for entry in entries):
+            return default
+        return (sum(entry[0] for entry in entries if entry is not None), entries)
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return any(term in dictionary for dictionary in self.dictionaries)
+
+    def close(self):
+        for dictionary in self.dictionaries:
+            if hasattr(dictionary, 'close'):
+                dictionary.close()
+
+# Postings reader of a base index and its delta segments, to be used with a SegmentedDictionary
+# The full doc id list read through it is the union of the full doc id lists of the segments
+class SegmentedReader:
+    def __init__(self, readers):
+        self.readers = readers
+
+    def read_postings(self, entry, has_skip_count=True):
+        return merge_segment_postings([reader.read_postings(segment_entry, has_skip_count)
+                                       for reader, segment_entry in zip(self.readers, entry[1])
+                                       if segment_entry is not None])
+
+    def postings_length(self, entry):
+        return sum(reader.postings_length(segment_entry)
+                   for reader, segment_entry in zip(self.readers, entry[1]) if segment_entry is not None)
+
+    # Function that returns a cursor over the postings of a term in every segment, the union of their cursors
+    def open_cursor(self, entry, has_skip_count=True):
+        cursors = [reader.open_cursor(segment_entry, has_skip_count)
+                   for reader, segment_entry in zip(self.readers, entry[1]) if segment_entry is not None]
+        return cursors[0] if len(cursors) == 1 else postings_cursors.OrCursor(cursors)
+
+    # Function that returns the positions of a term in every segment, looked up one document at a time
+    # A document is in exactly one segment, so its positions are those of the first segment that has them
+    def read_positions(self, entry):
+        return SegmentedPositions([reader.read_positions(segment_entry)
+                                   for reader, segment_entry in zip(self.readers, entry[1])
+                                   if segment_entry is not None])
+
+    def has_positions(self):
+        return all(reader.has_positions() for reader in self.readers)
+
+    # Function that returns the doc ids of a term in every segment and their term frequencies
+    # The segments hold disjoint doc ids, the pairs are only sorted by doc id when a segment holds lower doc ids than
+    # an older one
+    def read_term_frequencies(self, entry):
+        parts = [reader.read_term_frequencies(segment_entry)
+                 for reader, segment_entry in zip(self.readers, entry[1]) if segment_entry is not None]
+        if len(parts) == 1:
+            return parts[0]
+        doc_ids = array('i')
+        frequencies = []
+        for part_doc_ids, part_frequencies in parts:
+            doc_ids.extend(part_doc_ids)
+            frequencies.extend(part_frequencies)
+        if any(doc_ids[i - 1] > doc_ids[i] for i in range(1, len(doc_ids))):
+            pairs = sorted(zip(doc_ids, frequencies))
+            doc_ids = array('i', [doc_id for doc_id, _ in pairs])
+            frequencies = [frequency for _, frequency in pairs]
+        return doc_ids, frequencies
+
+    def max_term_frequency(self, entry):
+        return max(reader.max_term_frequency(segment_entry)
+                   for reader, segment_entry in zip(self.readers, entry[1]) if segment_entry is not None)
+
+    # Number of tokens of every doc id of all the segments
+    @property
+    def document_lengths(self):
+        if any(reader.document_lengths is None for reader in self.readers):
+            return None
+        lengths = array('I', bytes(4 * max(len(reader.document_lengths) for reader in self.readers)))
+        for reader in self.readers:
+            for doc_id, length in enumerate(reader.document_lengths):
+                if length:
+                    lengths[doc_id] = length
+        return lengths
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+class SegmentedPositions:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def get(self, doc_id):
+        for part in self.parts:
+            positions = part.get(doc_id)
+            if positions:
+                return positions
+        return []
@@ -0,0 +1,72 @@
+import os
+import math
+import segments
+from tombstones import bitmap_path
+
+# Index partitioned by doc id range
+# index.py --shards n sorts the documents by doc id, splits them into n ranges of about the same number of documents,
+# and builds every range into a shard: a complete index of its own, with its own dictionary, postings file and full
+# doc id list (dictionary.shard1.txt and postings.shard1.txt, ...). The shards are listed, in doc id order, in the
+# shard manifest of the index (dictionary.txt -> dictionary.shards), one line per shard with the names of its
+# dictionary and postings files and its first and last doc id. search.py given the dictionary of a sharded index
+# evaluates every query on all the shards in parallel and concatenates their results in shard order, which is doc id
+# order since the shards hold increasing doc id ranges. A shard evaluates NOT against its own full doc id list, so the
+# NOT of every shard is the complement within its range and their concatenation is the complement in the collection.
+
+# Function that returns the path of the shard manifest of the index whose dictionary is dictionary_path
+def manifest_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.shards'
+
+# Function that returns the (dictionary, postings, first doc id, last doc id) of the shards of an index, in doc id
+# order, or an empty list if the index is not sharded
+def read_manifest(dictionary_path):
+    path = manifest_path(dictionary_path)
+    if not os.path.exists(path):
+        return []
+    directory = os.path.dirname(path)
+    shards = []
+    with open(path, 'r') as manifest:
+        for line in manifest.read().split('\n'):
+            if line != '':
+                dictionary_name, postings_name, first, last = line.split(' ')
+                shards.append((os.path.join(directory, dictionary_name), os.path.join(directory, postings_name),
+                               int(first), int(last)))
+    return shards
+
+# Function that writes the shard manifest of an index, the shard files are stored by name next to it
+def write_manifest(dictionary_path, shards):
+    with open(manifest_path(dictionary_path), 'w') as manifest:
+        for shard_dictionary_path, shard_postings_path, first, last in shards:
+            manifest.write(f"{os.path.basename(shard_dictionary_path)} {os.path.basename(shard_postings_path)} "
+                           f"{first} {last}\n")
+
+# Function that returns the paths of the dictionary and postings file of shard number of an index,
+# e.g. dictionary.shard2.txt and postings.shard2.txt
+def shard_paths(dictionary_path, postings_path, number):
+    dictionary_root, dictionary_extension = os.path.splitext(dictionary_path)
+    postings_root, postings_extension = os.path.splitext(postings_path)
+    return (f"{dictionary_root}.shard{number}{dictionary_extension}",
+            f"{postings_root}.shard{number}{postings_extension}")
+
+# Function that splits filenames (doc ids) into number_of_shards ranges of consecutive doc ids of about the same
+# number of documents, there are fewer ranges if there are fewer documents than shards
+def partition(filenames, number_of_shards):
+    doc_ids = sorted(filenames, key=int)
+    size = max(1, math.ceil(len(doc_ids) / number_of_shards))
+    return [doc_ids[i:i + size] for i in range(0, len(doc_ids), size)]
+
+# Function that removes the shards of an index and its shard manifest, with the delta segments of every shard
+def remove_shards(dictionary_path):
+    for shard_dictionary_path, shard_postings_path, _, _ in read_manifest(dictionary_path):
+        segments.remove_segments(shard_dictionary_path)
+        paths = segments.segment_files(shard_dictionary_path, shard_postings_path)
+        for path in paths + [bitmap_path(shard_dictionary_path)]:
+            if os.path.exists(path):
+                os.remove(path)
+    if os.path.exists(manifest_path(dictionary_path)):
+        os.remove(manifest_path(dictionary_path))
+
+# Function that returns the results of a query on every shard, lines of the results files of the shards, as one line
+# The shards are in doc id order, so their results are concatenated
+def concatenate_results(lines):
+    return ' '.join(line.strip() for line in lines if line.strip() != '') + '\n'
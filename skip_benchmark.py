@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import index
+import search
+import query_planner
+import postings_cursors
+
+# Benchmark of the spacing of the skip entries of the postings lists
+# The documents are indexed once per spacing (index.py --skips) into a temporary directory, then the queries are
+# evaluated with cursors (search.py -s), whose AND and AND NOT skip through the postings with the skip tables stored
+# in the postings file. For every spacing, the size of the postings file, the time taken by the queries and the
+# numbers of skip entries and blocks decoded are printed. Larger blocks mean fewer skip entries to decode but more doc
+# ids to decode in every block a cursor lands in, smaller blocks the opposite, and a second skip level keeps small
+# blocks without decoding every skip entry.
+
+SPACINGS = ['16', '32', '64', '128', '256', 'sqrt', 'multi']
+REPEATS = 3
+
+def usage():
+    print("usage: " + sys.argv[0] + " -i directory-of-documents -q file-of-queries [-s spacing,spacing,...]")
+
+# Function that evaluates the queries with cursors and returns the time taken and the numbers of skip entries and
+# blocks decoded
+def run_queries(dict_file, postings_file, queries):
+    dictionary, reader = search.open_index(dict_file, postings_file)
+    search.load_stemming_memo(dict_file)
+    collection_size = len(search.get_full_set_postings(dictionary, reader))
+    plans = []
+    for query in queries:
+        postfix = search.parse_query(query)
+        if postfix is not None:
+            plans.append(query_planner.plan_query(postfix, lambda term: search.get_term_frequency(term, dictionary),
+                                                  collection_size))
+    # Every cursor opened on the postings file is kept to count what it decoded
+    cursors = []
+    open_cursor = reader.open_cursor
+
+    def open_counted_cursor(entry, has_skip_count=True):
+        cursor = open_cursor(entry, has_skip_count)
+        cursors.append(cursor)
+        return cursor
+
+    reader.open_cursor = open_counted_cursor
+    # The best of REPEATS runs is kept, the counts are those of the last run
+    elapsed = None
+    for _ in range(REPEATS):
+        cursors.clear()
+        results = 0
+        start = time.perf_counter()
+        for plan in plans:
+            for _ in postings_cursors.stream(search.plan_cursor(plan, dictionary, reader)):
+                results += 1
+        run_time = time.perf_counter() - start
+        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+    block_cursors = [cursor for cursor in cursors if isinstance(cursor, postings_cursors.BlockCursor)]
+    entries = sum(cursor.skips.entries_decoded for cursor in block_cursors)
+    blocks = sum(cursor.blocks_decoded for cursor in block_cursors)
+    del cursors, block_cursors
+    reader.close()
+    return elapsed, entries, blocks, results
+
+def benchmark(in_dir, queries_file, spacings):
+    with open(queries_file, 'r') as f:
+        queries = [query for query in f.read().split('\n') if query.strip() != '']
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'spacing':>8} {'postings bytes':>15} {'time (s)':>9} {'skip entries':>13} {'blocks':>8} {'results':>8}")
+        for spacing in spacings:
+            dict_file = os.path.join(directory, f"dictionary.{spacing}.txt")
+            postings_file = os.path.join(directory, f"postings.{spacing}.txt")
+            index.build_index(in_dir, dict_file, postings_file, skip_spacing=spacing)
+            elapsed, entries, blocks, results = run_queries(dict_file, postings_file, queries)
+            print(f"{spacing:>8} {os.path.getsize(postings_file):>15} {elapsed:>9.3f} {entries:>13} {blocks:>8} "
+                  f"{results:>8}")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    input_directory = queries_file = None
+    spacings = SPACINGS
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:q:s:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':
+            input_directory = a
+        elif o == '-q':
+            queries_file = a
+        elif o == '-s':
+            spacings = a.split(',')
+        else:
+            assert False, "unhandled option"
+
+    if input_directory is None or queries_file is None:
+        usage()
+        sys.exit(2)
+
+    benchmark(input_directory, queries_file, spacings)
+
+if __name__ == "__main__":
+    main()
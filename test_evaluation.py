@@ -0,0 +1,287 @@
+import os
+import re
+import errno
+import pickle
+import shutil
+import filecmp
+import random
+from array import array
+from collections import Counter
+import pytest
+import index
+import search
+import postings_ops
+import postings_format
+import linked_postings
+import result_cache
+import segments
+import tombstones
+
+# Every evaluation mode of search.py, checked against the linked list reference on generated Boolean queries
+# Run with python -m pytest -q
+
+NUMBER_OF_DOCUMENTS = 400
+VOCABULARY_SIZE = 300
+NUMBER_OF_QUERIES = 150
+NUMBER_OF_SHARDS = 3
+LIMIT = 5
+# Number of documents of a ranked result, small so that the top k heap fills up and MaxScore prunes
+RANKED_K = 5
+# Fixed skip spacing of a few doc ids, so that most postings lists have several blocks
+SMALL_SKIP_SPACING = '4'
+# Bytes of the in-memory block of the external memory builds, a few documents, so the builds write hundreds of runs
+RUN_MEMORY_LIMIT = 1000
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'ri', 'so', 'tu', 've']
+
+# Function that returns distinct generated words, none of them an operator
+def generate_vocabulary(rng):
+    vocabulary = []
+    while len(vocabulary) < VOCABULARY_SIZE:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+        if word not in vocabulary:
+            vocabulary.append(word)
+    return vocabulary
+
+# Function that writes the generated documents, with doc ids that are not consecutive, to directory
+# The words are drawn with a skewed distribution, so the postings lists have very different lengths
+def generate_documents(directory, vocabulary, rng):
+    os.makedirs(directory)
+    for doc_id in sorted(rng.sample(range(1, 3 * NUMBER_OF_DOCUMENTS), NUMBER_OF_DOCUMENTS)):
+        words = [vocabulary[min(int(rng.paretovariate(0.8)) - 1, len(vocabulary) - 1)]
+                 for _ in range(rng.randint(10, 60))]
+        with open(os.path.join(directory, str(doc_id)), 'w') as f:
+            f.write(' '.join(words) + '.\n')
+
+# Function that returns a random Boolean query of at most depth nested operators
+def generate_query(vocabulary, depth, rng):
+    if depth == 0 or rng.random() < 0.25:
+        word = rng.choice(vocabulary[:10]) if rng.random() < 0.5 else rng.choice(vocabulary)
+        return 'NOT ' + word if rng.random() < 0.15 else word
+    operator = rng.choice(['AND', 'AND', 'OR'])
+    query = f' {operator} '.join('(' + generate_query(vocabulary, depth - 1, rng) + ')'
+                                 for _ in range(rng.randint(2, 3)))
+    return 'NOT (' + query + ')' if rng.random() < 0.15 else query
+
+# Every pair of lengths takes another path of the array operations: the linear merges, galloping through the longer
+# list and the empty lists
+@pytest.mark.parametrize('lengths', [(0, 50), (300, 300), (250, 400), (20, 900), (900, 20), (1, 1000)])
+def test_array_operations_match_sets(lengths):
+    rng = random.Random(sum(lengths))
+    p1, p2 = (array('i', sorted(rng.sample(range(1, 3000), length))) for length in lengths)
+    assert list(postings_ops.intersect_postings(p1, p2)) == sorted(set(p1) & set(p2))
+    assert list(postings_ops.union_postings(p1, p2)) == sorted(set(p1) | set(p2))
+    assert list(postings_ops.and_not_postings(p1, p2)) == sorted(set(p1) - set(p2))
+    lists = [p1, p2] + [array('i', sorted(rng.sample(range(1, 3000), rng.randint(0, 200)))) for _ in range(20)]
+    assert list(postings_ops.union_many(lists)) == sorted(set().union(*lists))
+
+@pytest.fixture(scope='module')
+def indexes(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('evaluation'))
+    rng = random.Random(11)
+    vocabulary = generate_vocabulary(rng)
+    docs = os.path.join(directory, 'docs')
+    generate_documents(docs, vocabulary, rng)
+    queries = os.path.join(directory, 'queries.txt')
+    with open(queries, 'w') as f:
+        for _ in range(NUMBER_OF_QUERIES):
+            f.write(generate_query(vocabulary, rng.randint(1, 3), rng) + '\n')
+    single = os.path.join(directory, 'dictionary.txt'), os.path.join(directory, 'postings.txt')
+    sharded = os.path.join(directory, 'sharded.txt'), os.path.join(directory, 'sharded-postings.txt')
+    # index.py writes its temporary files to the working directory
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        index.build_index(docs, *single)
+        index.build_shards(docs, *sharded, NUMBER_OF_SHARDS)
+    finally:
+        os.chdir(working_directory)
+    return directory, queries, single, sharded
+
+# Function that runs search.py on the generated queries and returns the doc ids of every query
+# index_files are the dictionary and postings files of another index of the generated documents to search
+def run_queries(indexes, sharded=False, index_files=None, **options):
+    directory, queries, single, sharded_index = indexes
+    results_file = os.path.join(directory, 'results.txt')
+    search.run_search(*(index_files or (sharded_index if sharded else single)), queries, results_file, **options)
+    with open(results_file, 'r') as f:
+        return [[int(doc_id) for doc_id in line.split()] for line in f.read().split('\n')[:NUMBER_OF_QUERIES]]
+
+@pytest.fixture(scope='module')
+def reference(indexes):
+    return run_queries(indexes, operations=linked_postings, use_planner=False)
+
+def test_reference_is_not_trivial(reference):
+    assert len(reference) == NUMBER_OF_QUERIES
+    assert sum(1 for doc_ids in reference if 0 < len(doc_ids) < NUMBER_OF_DOCUMENTS) > NUMBER_OF_QUERIES // 2
+
+# Function that returns the files of an index of the generated documents built with the given skip spacing, the
+# indexes are built on first use
+@pytest.fixture(scope='module')
+def skip_indexes(indexes):
+    directory = indexes[0]
+    built = {postings_format.DEFAULT_SKIP_SPACING: indexes[2]}
+    def index_files(spacing):
+        if spacing not in built:
+            built[spacing] = (os.path.join(directory, f'skips-{spacing}.txt'),
+                              os.path.join(directory, f'skips-{spacing}-postings.txt'))
+            index.build_index(os.path.join(directory, 'docs'), *built[spacing], skip_spacing=spacing)
+        return built[spacing]
+    return index_files
+
+# Every mode is checked on every layout of the skip entries: the default blocks, sqrt(df) blocks, blocks of a few doc
+# ids, and blocks of 16 with a second skip level, which the lists of the most frequent terms have
+@pytest.mark.parametrize('skip_spacing', [postings_format.DEFAULT_SKIP_SPACING, 'sqrt', SMALL_SKIP_SPACING, 'multi'])
+@pytest.mark.parametrize('options', [
+    {},
+    {'use_planner': False},
+    {'cache_size': 64},
+    {'operations': linked_postings},
+    {'streaming': True},
+], ids=['arrays', 'arrays without planner', 'postings cache', 'linked lists with planner', 'cursors'])
+def test_modes_match_reference(indexes, reference, skip_indexes, options, skip_spacing):
+    assert run_queries(indexes, index_files=skip_indexes(skip_spacing), **options) == reference
+
+# --limit n implies the streaming search, as in search.py
+def test_limit_keeps_first_doc_ids(indexes, reference):
+    assert run_queries(indexes, streaming=True, limit=LIMIT) == [doc_ids[:LIMIT] for doc_ids in reference]
+
+@pytest.mark.parametrize('options', [{}, {'streaming': True}, {'streaming': True, 'limit': LIMIT}],
+                         ids=['arrays', 'cursors', 'limit'])
+def test_sharded_index_matches_reference(indexes, reference, options):
+    expected = [doc_ids[:options.get('limit')] for doc_ids in reference]
+    assert run_queries(indexes, sharded=True, **options) == expected
+
+def test_result_cache_matches_reference(indexes, reference, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    # The first run fills the cache, the second one answers from it
+    assert run_queries(indexes, result_cache_dir=cache_dir) == reference
+    assert os.listdir(cache_dir)
+    assert run_queries(indexes, result_cache_dir=cache_dir) == reference
+
+# The workers share one cache directory, whose entries stay within the byte limit however many workers write to it
+@pytest.mark.parametrize('workers', [1, 3])
+def test_result_cache_evicts_to_byte_limit(indexes, reference, tmp_path, workers):
+    cache_dir, max_bytes = str(tmp_path / 'cache'), 2000
+    for _ in range(2):
+        assert run_queries(indexes, workers=workers, result_cache_dir=cache_dir,
+                           result_cache_size=max_bytes) == reference
+    entries = [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+    assert entries and all(name.endswith(result_cache.ENTRY_EXTENSION) for name in entries)
+    assert len(entries) < NUMBER_OF_QUERIES
+    assert sum(os.path.getsize(name) for name in entries) <= max_bytes
+
+# The documents are indexed in three parts with interleaved doc ids: the base index and two delta segments added by
+# add_documents (index.py -a), searched together and then compacted into the base index. NOT is taken against the doc
+# ids of all the segments.
+def test_delta_segments_match_reference(indexes, reference, tmp_path):
+    docs = os.path.join(indexes[0], 'docs')
+    filenames = sorted(os.listdir(docs), key=int)
+    index_files = str(tmp_path / 'dictionary.txt'), str(tmp_path / 'postings.txt')
+    index.build_index(docs, *index_files, filenames=filenames[::3])
+    # add_documents indexes the documents of its directory that are not in the index yet
+    part = str(tmp_path / 'part')
+    os.makedirs(part)
+    for filename in filenames[::3] + filenames[1::3]:
+        shutil.copy(os.path.join(docs, filename), part)
+    for directory in (part, docs):
+        assert index.add_documents(directory, *index_files) is not None
+    assert len(segments.read_manifest(index_files[0])) == 2
+    for options in ({}, {'streaming': True}):
+        assert run_queries(indexes, index_files=index_files, **options) == reference
+    assert index.compact_index(*index_files)['segments'] == 2
+    assert not segments.read_manifest(index_files[0])
+    assert run_queries(indexes, index_files=index_files) == reference
+
+# The documents found in the most results are deleted: they are removed from the results of the AND and OR queries,
+# NOT does not bring them back, and the results cached before they were deleted are filtered as well
+def test_deleted_documents_are_not_returned(indexes, reference, tmp_path):
+    directory, queries, _, _ = indexes
+    index_files = str(tmp_path / 'dictionary.txt'), str(tmp_path / 'postings.txt')
+    index.build_index(os.path.join(directory, 'docs'), *index_files)
+    cache_dir = str(tmp_path / 'cache')
+    assert run_queries(indexes, index_files=index_files, result_cache_dir=cache_dir) == reference
+    cached = sorted(os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names)
+    deleted = {doc_id for doc_id, _ in Counter(doc_id for doc_ids in reference for doc_id in doc_ids).most_common(5)}
+    with open(queries, 'r') as f:
+        query_lines = f.read().split('\n')
+    for operator in ('AND', 'OR', 'NOT'):
+        assert any(operator in query and deleted & set(doc_ids) for query, doc_ids in zip(query_lines, reference))
+    tombstones.delete_documents(index_files[0], deleted)
+    expected = [[doc_id for doc_id in doc_ids if doc_id not in deleted] for doc_ids in reference]
+    for options in ({}, {'streaming': True}, {'result_cache_dir': cache_dir}):
+        assert run_queries(indexes, index_files=index_files, **options) == expected
+    # The deletions do not change the version of the index, the cached results are still used
+    assert sorted(os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names) == cached
+
+# Index of the generated documents with positions, whose term frequencies and document lengths the ranked search uses
+@pytest.fixture(scope='module')
+def positional_index_files(indexes):
+    directory = indexes[0]
+    index_files = os.path.join(directory, 'positional.txt'), os.path.join(directory, 'positional-postings.txt')
+    index.build_index(os.path.join(directory, 'docs'), *index_files, positional=True)
+    return index_files
+
+# MaxScore only passes over documents that cannot enter the top k, so it ranks the documents like the exhaustive
+# scoring, ties included. The words of every generated query are also asked as a free text query.
+@pytest.mark.parametrize('scoring', ['bm25', 'tfidf'])
+def test_pruned_ranking_matches_exhaustive(indexes, positional_index_files, scoring, capsys):
+    directory, queries, _, _ = indexes
+    with open(queries, 'r') as f:
+        boolean_queries = f.read().split('\n')[:NUMBER_OF_QUERIES]
+    queries_file, results_file = os.path.join(directory, 'ranked.txt'), os.path.join(directory, 'results.txt')
+    free_text_queries = [' '.join(re.findall(r'[a-z]+', query)) for query in boolean_queries]
+    with open(queries_file, 'w') as f:
+        f.write('\n'.join(boolean_queries + free_text_queries) + '\n')
+    rankings, scored = [], []
+    for pruning in (True, False):
+        search.run_search(*positional_index_files, queries_file, results_file,
+                          ranked={'scoring': scoring, 'k': RANKED_K, 'pruning': pruning})
+        with open(results_file, 'r') as f:
+            rankings.append(f.read().split('\n')[:2 * NUMBER_OF_QUERIES])
+        scored.append(int(re.search(r'ranking: (\d+) documents scored', capsys.readouterr().out).group(1)))
+    assert rankings[0] == rankings[1]
+    assert sum(1 for line in rankings[0] if len(line.split()) == RANKED_K) > NUMBER_OF_QUERIES
+    assert scored[0] < scored[1]
+
+# The index is built without positions, so its phrase and NEAR queries have no result, the other queries are answered
+@pytest.mark.parametrize('sharded', [False, True], ids=['single', 'sharded'])
+def test_phrases_without_positions_keep_other_queries(indexes, reference, sharded):
+    directory, queries, single, sharded_index = indexes
+    with open(queries, 'r') as f:
+        query = f.readline().strip()
+    first, second = re.findall(r'[a-z]+', query + ' ' + query)[:2]
+    queries_file, results_file = os.path.join(directory, 'phrases.txt'), os.path.join(directory, 'results.txt')
+    with open(queries_file, 'w') as f:
+        f.write(f'{query}\n"{first} {second}"\n{first} NEAR/3 {second}\n{query}\n')
+    search.run_search(*(sharded_index if sharded else single), queries_file, results_file)
+    with open(results_file, 'r') as f:
+        results = [[int(doc_id) for doc_id in line.split()] for line in f.read().split('\n')[:4]]
+    assert results == [reference[0], [], [], reference[0]]
+
+# A build with blocks of a few documents writes more runs than the merge fan in, so they are merged in several passes.
+# Stopped by a temp limit too small for its runs and resumed from its checkpoint, it writes the same files as a build
+# that was never interrupted
+def test_resumed_build_matches_fresh_build(indexes, tmp_path):
+    docs = os.path.join(indexes[0], 'docs')
+    fresh, resumed = (str(tmp_path / name) for name in ('fresh', 'resumed'))
+    for directory in (fresh, resumed):
+        os.makedirs(directory)
+    stats = index.build_index(docs, os.path.join(fresh, 'dictionary.txt'), os.path.join(fresh, 'postings.txt'),
+                              memory_limit=RUN_MEMORY_LIMIT, positional=True)
+    assert stats['blocks'] > index.MERGE_FAN_IN
+    with pytest.raises(OSError) as stopped:
+        index.build_index(docs, os.path.join(resumed, 'dictionary.txt'), os.path.join(resumed, 'postings.txt'),
+                          memory_limit=RUN_MEMORY_LIMIT, positional=True, temp_limit=20000)
+    assert stopped.value.errno == errno.ENOSPC
+    stats = index.build_index(docs, os.path.join(resumed, 'dictionary.txt'), os.path.join(resumed, 'postings.txt'),
+                              memory_limit=RUN_MEMORY_LIMIT, positional=True, resume=True)
+    assert 0 < stats['resumed'] < NUMBER_OF_DOCUMENTS
+    names = sorted(os.listdir(fresh))
+    assert names == sorted(os.listdir(resumed))
+    # The memo of the stems is a cache, the resumed build holds the same words in another order
+    memos = [name for name in names if name.endswith('.stems')]
+    for name in memos:
+        with open(os.path.join(fresh, name), 'rb') as f, open(os.path.join(resumed, name), 'rb') as g:
+            assert pickle.load(f) == pickle.load(g)
+    _, mismatch, errors = filecmp.cmpfiles(fresh, resumed, [name for name in names if name not in memos], shallow=False)
+    assert not mismatch and not errors
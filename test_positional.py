@@ -0,0 +1,127 @@
+import os
+import random
+import pytest
+from nltk.tokenize import word_tokenize
+import index
+import search
+from normalisation import TermNormaliser
+
+# Phrase and NEAR/k queries answered by search.py on a positional index, checked against a brute force scan of the
+# terms of every document
+# Run with python -m pytest -q
+
+NUMBER_OF_DOCUMENTS = 300
+VOCABULARY_SIZE = 30
+NUMBER_OF_QUERIES = 40
+DISTANCES = [0, 1, 2, 3]
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'ri', 'so', 'tu', 've']
+
+# Function that writes documents of words drawn from a small vocabulary to directory, so that most pairs of words
+# occur close to each other in some documents and far apart in others
+def generate_documents(directory, rng):
+    vocabulary = set()
+    while len(vocabulary) < VOCABULARY_SIZE:
+        vocabulary.add(''.join(rng.choice(SYLLABLES) for _ in range(2)))
+    vocabulary = sorted(vocabulary)
+    os.makedirs(directory)
+    for doc_id in range(1, NUMBER_OF_DOCUMENTS + 1):
+        with open(os.path.join(directory, str(doc_id)), 'w') as f:
+            f.write(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(10, 40))) + '.\n')
+    return vocabulary
+
+@pytest.fixture(scope='module')
+def positional_index(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('positional'))
+    vocabulary = generate_documents(os.path.join(directory, 'docs'), random.Random(23))
+    dictionary, postings = os.path.join(directory, 'dictionary.txt'), os.path.join(directory, 'postings.txt')
+    index.build_index(os.path.join(directory, 'docs'), dictionary, postings, positional=True)
+    return directory, dictionary, postings, vocabulary
+
+# Function that returns the terms of every document of a directory in order, tokenized and stemmed like index.py does
+def document_tokens(docs):
+    normaliser = TermNormaliser()
+    tokens = {}
+    for filename in os.listdir(docs):
+        with open(os.path.join(docs, filename), 'r') as f:
+            tokens[int(filename)] = [normaliser.normalise(word) for word in word_tokenize(f.read())]
+    return tokens
+
+# Function that returns the (first, last) positions of every occurrence of a phrase, a tuple of terms, in a document
+def occurrences(doc_tokens, phrase):
+    return [(start, start + len(phrase) - 1) for start in range(len(doc_tokens) - len(phrase) + 1)
+            if tuple(doc_tokens[start:start + len(phrase)]) == phrase]
+
+# Function that returns the sorted doc ids of the documents where the phrases left and right occur without
+# overlapping, in either order, with at most distance words between them
+# A phrase NEAR/distance None is just the phrase left
+def brute_force(tokens, left, right=None, distance=None):
+    matched = []
+    for doc_id, doc_tokens in sorted(tokens.items()):
+        left_spans = occurrences(doc_tokens, left)
+        if right is None:
+            if left_spans:
+                matched.append(doc_id)
+            continue
+        if any(max(left_start, right_start) - min(left_end, right_end) - 1 <= distance
+               for left_start, left_end in left_spans for right_start, right_end in occurrences(doc_tokens, right)
+               if left_end < right_start or right_end < left_start):
+            matched.append(doc_id)
+    return matched
+
+# Function that runs search.py on queries and returns the doc ids of every query
+def run_queries(directory, dictionary, postings, queries):
+    queries_file, results_file = os.path.join(directory, 'queries.txt'), os.path.join(directory, 'results.txt')
+    with open(queries_file, 'w') as f:
+        f.write('\n'.join(queries) + '\n')
+    search.run_search(dictionary, postings, queries_file, results_file)
+    with open(results_file, 'r') as f:
+        return [[int(doc_id) for doc_id in line.split()] for line in f.read().split('\n')[:len(queries)]]
+
+# Function that returns the words of an operand of a query, a phrase between double quotes
+def query_operand(words):
+    return words[0] if len(words) == 1 else '"' + ' '.join(words) + '"'
+
+# The phrases are taken from the documents, so that they all have results
+def test_phrases_match_brute_force(positional_index):
+    directory, dictionary, postings, vocabulary = positional_index
+    tokens = document_tokens(os.path.join(directory, 'docs'))
+    rng = random.Random(5)
+    phrases = []
+    for _ in range(NUMBER_OF_QUERIES):
+        with open(os.path.join(directory, 'docs', str(rng.randint(1, NUMBER_OF_DOCUMENTS))), 'r') as f:
+            words = f.read().split()[:-1]
+        start = rng.randrange(len(words) - 3)
+        phrases.append(words[start:start + rng.randint(2, 3)])
+    results = run_queries(directory, dictionary, postings, [query_operand(words) for words in phrases])
+    normaliser = TermNormaliser()
+    for words, doc_ids in zip(phrases, results):
+        expected = brute_force(tokens, tuple(normaliser.normalise(word) for word in words))
+        assert expected and doc_ids == expected, words
+
+# NEAR/k matches at most k words between its operands: every query is asked with each distance, and the documents
+# where the operands are exactly k words apart are in the results of NEAR/k and not in those of NEAR/(k - 1)
+def test_near_matches_brute_force_at_every_distance(positional_index):
+    directory, dictionary, postings, vocabulary = positional_index
+    tokens = document_tokens(os.path.join(directory, 'docs'))
+    rng = random.Random(9)
+    operands = []
+    for _ in range(NUMBER_OF_QUERIES // 2):
+        left, right = rng.sample(vocabulary, 2)
+        # A phrase of two words as the left operand of every other query
+        operands.append(([left, rng.choice(vocabulary)] if len(operands) % 2 else [left], [right]))
+    queries = [f"{query_operand(left)} NEAR/{distance} {query_operand(right)}"
+               for left, right in operands for distance in DISTANCES]
+    results = iter(run_queries(directory, dictionary, postings, queries))
+    normaliser = TermNormaliser()
+    boundary_documents = 0
+    for left, right in operands:
+        left, right = (tuple(normaliser.normalise(word) for word in words) for words in (left, right))
+        previous = None
+        for distance in DISTANCES:
+            expected = brute_force(tokens, left, right, distance)
+            assert next(results) == expected, (left, right, distance)
+            if previous is not None:
+                assert set(previous) <= set(expected)
+                boundary_documents += len(expected) - len(previous)
+            previous = expected
+    assert boundary_documents > NUMBER_OF_QUERIES
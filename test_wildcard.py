@@ -0,0 +1,105 @@
+import os
+import random
+import fnmatch
+import pytest
+from nltk.tokenize import word_tokenize
+import index
+import search
+import wildcard
+from normalisation import TermNormaliser
+
+# Wildcard queries answered by search.py, checked against a brute force scan of the terms of every document
+# Run with python -m pytest -q
+
+NUMBER_OF_DOCUMENTS = 300
+VOCABULARY_SIZE = 400
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'ri', 'so', 'tu', 've', 'bra',
+             'cle', 'dro', 'fri', 'str', 'ment', 'ion', 'ex']
+
+# Function that writes documents of words made of syllables to directory
+def generate_documents(directory, rng):
+    vocabulary = set()
+    while len(vocabulary) < VOCABULARY_SIZE:
+        vocabulary.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    vocabulary = sorted(vocabulary)
+    os.makedirs(directory)
+    for doc_id in range(1, NUMBER_OF_DOCUMENTS + 1):
+        with open(os.path.join(directory, str(doc_id)), 'w') as f:
+            f.write(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(10, 40))) + '.\n')
+
+@pytest.fixture(scope='module')
+def wildcard_index(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('wildcard'))
+    generate_documents(os.path.join(directory, 'docs'), random.Random(17))
+    dictionary, postings = os.path.join(directory, 'dictionary.txt'), os.path.join(directory, 'postings.txt')
+    index.build_index(os.path.join(directory, 'docs'), dictionary, postings, positional=True)
+    return directory, dictionary, postings
+
+# Function that returns the terms of every document of a directory, tokenized and stemmed like index.py does
+def document_terms(docs):
+    normaliser = TermNormaliser()
+    terms = {}
+    for filename in os.listdir(docs):
+        with open(os.path.join(docs, filename), 'r') as f:
+            terms[int(filename)] = {normaliser.normalise(word) for word in word_tokenize(f.read())}
+    return terms
+
+# Function that returns the sorted doc ids of the documents having a term matching pattern
+def brute_force(terms, pattern):
+    return sorted(doc_id for doc_id, doc_terms in terms.items()
+                  if any(fnmatch.fnmatchcase(term, pattern) for term in doc_terms))
+
+# Function that runs search.py on queries and returns the doc ids of every query
+def run_queries(directory, dictionary, postings, queries, **options):
+    queries_file, results_file = os.path.join(directory, 'queries.txt'), os.path.join(directory, 'results.txt')
+    with open(queries_file, 'w') as f:
+        f.write('\n'.join(queries) + '\n')
+    search.run_search(dictionary, postings, queries_file, results_file, **options)
+    with open(results_file, 'r') as f:
+        return [[int(doc_id) for doc_id in line.split()] for line in f.read().split('\n')[:len(queries)]]
+
+def test_tokenize_query_keeps_patterns():
+    assert search.tokenize_query('oil*') == ['oil*']
+    assert search.tokenize_query('*friso') == ['*friso']
+    assert search.tokenize_query('br*so') == ['br*so']
+    assert search.tokenize_query('oil* AND (b* OR "crude oil")') == ['oil*', 'AND', '(', 'b*', 'OR', '``', 'crude',
+                                                                      'oil', "''", ')']
+    assert search.tokenize_query('x * y') == ['x', '*', 'y']
+
+def test_wildcards_match_brute_force(wildcard_index):
+    directory, dictionary, postings = wildcard_index
+    terms = document_terms(os.path.join(directory, 'docs'))
+    vocabulary = sorted(wildcard.read_terms(dictionary))
+    rng = random.Random(3)
+    patterns = []
+    for term in rng.sample([term for term in vocabulary if len(term) >= 4], 10):
+        patterns.extend([term[:2] + '*', '*' + term[-3:], term[:2] + '*' + term[-2:]])
+    results = run_queries(directory, dictionary, postings, patterns)
+    for pattern, doc_ids in zip(patterns, results):
+        expected = brute_force(terms, pattern)
+        assert expected, pattern
+        assert doc_ids == expected, pattern
+
+def test_wildcards_in_boolean_and_ranked_queries(wildcard_index):
+    directory, dictionary, postings = wildcard_index
+    terms = document_terms(os.path.join(directory, 'docs'))
+    vocabulary = sorted(wildcard.read_terms(dictionary))
+    prefix, suffix = vocabulary[len(vocabulary) // 3][:2], vocabulary[len(vocabulary) // 2][-2:]
+    results = run_queries(directory, dictionary, postings, [f'({prefix}*) AND NOT *{suffix}'])
+    expected = sorted(set(brute_force(terms, prefix + '*')) - set(brute_force(terms, '*' + suffix)))
+    assert expected and results[0] == expected
+    # A free text wildcard is scored with the terms it matches, so every document scored contains one of them
+    ranked = run_queries(directory, dictionary, postings, [prefix + '*'], ranked={'k': NUMBER_OF_DOCUMENTS})
+    assert ranked[0] and set(ranked[0]) <= set(brute_force(terms, prefix + '*'))
+
+# A wildcard query on an index without a k-gram index has no result, the other queries are still answered
+def test_missing_kgram_index_keeps_other_queries(wildcard_index):
+    directory, dictionary, postings = wildcard_index
+    terms = document_terms(os.path.join(directory, 'docs'))
+    term = sorted(wildcard.read_terms(dictionary))[0]
+    os.rename(wildcard.kgrams_path(dictionary), wildcard.kgrams_path(dictionary) + '.moved')
+    try:
+        results = run_queries(directory, dictionary, postings, [term, term[:2] + '*', term])
+    finally:
+        os.rename(wildcard.kgrams_path(dictionary) + '.moved', wildcard.kgrams_path(dictionary))
+    assert results == [brute_force(terms, term), [], brute_force(terms, term)]
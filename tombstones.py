@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+import os
+import sys
+import getopt
+
+# Deleted documents of an index
+# The doc ids of the deleted documents are kept in a bitmap next to the dictionary (dictionary.txt -> dictionary.deleted),
+# bit doc_id % 8 of byte doc_id // 8 is set when the document is deleted. The postings are not changed: search.py
+# removes the deleted doc ids from the result of every query, which costs one bit test per doc id of the result,
+# and index.py --compact drops them from the postings for good.
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file doc-id ...")
+
+# Function that returns the path of the bitmap of the index whose dictionary is dictionary_path
+def bitmap_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.deleted'
+
+class Tombstones:
+    def __init__(self, bitmap=None):
+        self.bitmap = bytearray(bitmap or b'')
+        self.count = sum(bin(byte).count('1') for byte in self.bitmap)
+
+    def __contains__(self, doc_id):
+        byte = doc_id >> 3
+        return byte < len(self.bitmap) and (self.bitmap[byte] >> (doc_id & 7)) & 1 == 1
+
+    def __len__(self):
+        return self.count
+
+    # Function that marks doc ids as deleted
+    def delete(self, doc_ids):
+        for doc_id in doc_ids:
+            if doc_id in self:
+                continue
+            byte = doc_id >> 3
+            if byte >= len(self.bitmap):
+                self.bitmap.extend(bytes(byte + 1 - len(self.bitmap)))
+            self.bitmap[byte] |= 1 << (doc_id & 7)
+            self.count += 1
+
+    # Function that clears doc ids, once index.py --compact has removed them from the postings
+    def clear(self, doc_ids):
+        for doc_id in doc_ids:
+            if doc_id in self:
+                self.bitmap[doc_id >> 3] &= ~(1 << (doc_id & 7))
+                self.count -= 1
+
+    # Function that returns the doc ids of the bitmap in increasing order
+    def doc_ids(self):
+        return [(byte << 3) + bit for byte, value in enumerate(self.bitmap) if value
+                for bit in range(8) if (value >> bit) & 1]
+
+    # Function that returns the doc ids of a result that are not deleted
+    def filter(self, doc_ids):
+        if not self.count:
+            return doc_ids
+        return [doc_id for doc_id in doc_ids if doc_id not in self]
+
+# Function that loads the bitmap of an index, None is returned if no document of the index has been deleted
+def load_tombstones(dictionary_path):
+    path = bitmap_path(dictionary_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        tombstones = Tombstones(f.read())
+    return tombstones if len(tombstones) else None
+
+# Function that writes the bitmap of an index, the file is removed when there is no deleted document left
+# The bitmap is written to a new file that is moved over the old one, so a search never reads half a bitmap
+def save_tombstones(dictionary_path, tombstones):
+    path = bitmap_path(dictionary_path)
+    if not len(tombstones):
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + '.new', 'wb') as f:
+        f.write(tombstones.bitmap.rstrip(b'\0'))
+    os.replace(path + '.new', path)
+
+# Function that deletes documents from an index
+def delete_documents(dictionary_path, doc_ids):
+    tombstones = load_tombstones(dictionary_path) or Tombstones()
+    tombstones.delete(doc_ids)
+    save_tombstones(dictionary_path, tombstones)
+    return tombstones
+
+def main():
+    dictionary_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file is None or not args:
+        usage()
+        sys.exit(2)
+
+    tombstones = delete_documents(dictionary_file, [int(doc_id) for doc_id in args])
+    print(f"{len(tombstones)} documents deleted from the index.")
+
+if __name__ == "__main__":
+    main()
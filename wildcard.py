@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+import os
+import re
+import sys
+import heapq
+import pickle
+import getopt
+from array import array
+from bisect import bisect_left
+import lexicon
+import segments
+
+# Wildcard queries such as oil*, *export and pe*l
+# index.py writes a k-gram index over the terms of the index next to the dictionary (dictionary.txt ->
+# dictionary.kgrams): the sorted array of every term, delta segments included, with its document frequency, and for
+# every k-gram of the terms, with $ marking the start and the end of a term, the sorted ids (positions in the term
+# array) of the terms containing it. A pattern is expanded into the terms matching it:
+#   a prefix pattern (oil*) is the range of the sorted term array found with two binary searches,
+#   any other pattern is the intersection of the term ids of its k-grams, e.g. $pe and l$ for pe*l, restricted to the
+#   range of its prefix. k-grams do not keep their order, so the candidates are checked against the pattern.
+# The patterns are not stemmed, they are matched against the stemmed terms of the dictionary.
+# A pattern matching more than max_expansions terms only keeps the max_expansions terms with the highest document
+# frequency, so the cost of a wildcard is bounded.
+
+K = 3
+MAX_EXPANSIONS = 1000
+WILDCARD = '*'
+BOUNDARY = '$'
+# Character sorting after every character of a term, the end of the range of a prefix in the sorted term array
+LAST_CHARACTER = '\U0010ffff'
+EXPANSION_PATTERN = re.compile(r'WILDCARD/(\d+)/(.*)$', re.S)
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file")
+
+# Function that returns the path of the k-gram index of the index whose dictionary is dictionary_path
+def kgrams_path(dictionary_path):
+    return os.path.splitext(dictionary_path)[0] + '.kgrams'
+
+# Function that tells whether a query token is a wildcard pattern
+def is_wildcard(token):
+    return isinstance(token, str) and WILDCARD in token
+
+# Function that returns the token ending the expansion of a pattern into count terms in a postfix expression
+def expansion_token(pattern, count):
+    return f'WILDCARD/{count}/{pattern}'
+
+# Function that returns the (number of terms, pattern) of an expansion token, None for any other token
+def parse_expansion_token(token):
+    match = EXPANSION_PATTERN.match(token)
+    return (int(match.group(1)), match.group(2)) if match else None
+
+# Function that returns the k-grams of a term, with $ marking its start and its end
+def term_kgrams(term, k=K):
+    padded = BOUNDARY + term + BOUNDARY
+    return {padded[i:i + k] for i in range(len(padded) - k + 1)}
+
+# Function that returns the k-grams every term matching a pattern contains
+# They are the k-grams of the pieces of the padded pattern between the wildcards, pieces shorter than k have none
+def pattern_kgrams(pattern, k=K):
+    kgrams = set()
+    for piece in (BOUNDARY + pattern + BOUNDARY).split(WILDCARD):
+        kgrams.update(piece[i:i + k] for i in range(len(piece) - k + 1))
+    return kgrams
+
+# Function that returns a function telling whether a term matches a pattern
+def compile_pattern(pattern):
+    return re.compile('.*'.join(re.escape(piece) for piece in pattern.split(WILDCARD)), re.S).fullmatch
+
+# Function that returns the document frequency of every term of a dictionary file and of its delta segments
+def read_terms(dictionary_path):
+    frequencies = {}
+    for path in [dictionary_path] + [segment[0] for segment in segments.read_manifest(dictionary_path)]:
+        with open(path, 'r') as dict_file:
+            for line in dict_file:
+                term, frequency = line.split(' ', 2)[:2]
+                if term != lexicon.FULL_SET_TERM:
+                    frequencies[term] = frequencies.get(term, 0) + int(frequency)
+    return frequencies
+
+# Function that writes the k-gram index of the terms of a dictionary file and of its delta segments
+def write_kgram_index(dictionary_path, k=K):
+    frequencies = read_terms(dictionary_path)
+    terms = sorted(frequencies)
+    kgrams = {}
+    # The k-grams are added in sorted order so that the same terms always give the same file
+    for term_id, term in enumerate(terms):
+        for kgram in sorted(term_kgrams(term, k)):
+            term_ids = kgrams.get(kgram)
+            if term_ids is None:
+                term_ids = kgrams[kgram] = array('I')
+            term_ids.append(term_id)
+    with open(kgrams_path(dictionary_path), 'wb') as f:
+        pickle.dump({'k': k, 'terms': terms, 'frequencies': array('I', [frequencies[term] for term in terms]),
+                     'kgrams': kgrams}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+class WildcardIndex:
+    def __init__(self, path, max_expansions=MAX_EXPANSIONS):
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        self.k = index['k']
+        self.terms = index['terms']
+        self.frequencies = index['frequencies']
+        self.kgrams = index['kgrams']
+        self.max_expansions = max_expansions
+        self.expansions = 0
+        self.capped = 0
+
+    # Function that returns the range of the ids of the terms starting with prefix
+    def prefix_range(self, prefix):
+        return (bisect_left(self.terms, prefix),
+                bisect_left(self.terms, prefix + LAST_CHARACTER) if prefix else len(self.terms))
+
+    # Function that returns the sorted terms matching a pattern, at most max_expansions of them
+    def expand(self, pattern):
+        pieces = pattern.split(WILDCARD)
+        low, high = self.prefix_range(pieces[0])
+        if len(pieces) == 2 and pieces[1] == '':
+            term_ids = range(low, high)
+        else:
+            # The smallest lists of term ids are intersected first
+            lists = sorted((self.kgrams.get(kgram, ()) for kgram in pattern_kgrams(pattern, self.k)), key=len)
+            if lists:
+                candidates = sorted(term_id for term_id in set(lists[0]).intersection(*lists[1:])
+                                    if low <= term_id < high)
+            else:
+                # No piece of the pattern is long enough to have a k-gram, the range of its prefix is scanned
+                candidates = range(low, high)
+            matches = compile_pattern(pattern)
+            term_ids = [term_id for term_id in candidates if matches(self.terms[term_id])]
+        self.expansions += 1
+        if len(term_ids) > self.max_expansions:
+            self.capped += 1
+            term_ids = sorted(heapq.nlargest(self.max_expansions, term_ids, key=self.frequencies.__getitem__))
+        return [self.terms[term_id] for term_id in term_ids]
+
+    # Function that describes the number of patterns expanded and capped
+    def report(self):
+        return (f"wildcards: {self.expansions} patterns expanded, {self.capped} capped at {self.max_expansions} "
+                f"terms")
+
+# Function that loads the k-gram index of an index, None is returned if it has none
+def load_kgram_index(dictionary_path, max_expansions=MAX_EXPANSIONS):
+    path = kgrams_path(dictionary_path)
+    if not os.path.exists(path):
+        return None
+    return WildcardIndex(path, max_expansions)
+
+def main():
+    dictionary_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file is None:
+        usage()
+        sys.exit(2)
+
+    write_kgram_index(dictionary_file)
+    print(f"k-gram index written to {kgrams_path(dictionary_file)}")
+
+if __name__ == "__main__":
+    main()